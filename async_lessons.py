@@ -0,0 +1,144 @@
+"""
+An asyncio front end for rendering lessons on demand, e.g. behind a web
+page.
+
+`sqlite3` calls block, so `AsyncLessonRunner` runs them on a small
+thread pool. Each worker thread borrows one of a fixed number of
+read-only connections, the same way `generate_lessons --jobs` does, and
+SQLite releases the GIL while a statement runs. Concurrent requests for
+the same lesson are coalesced: the first one starts the render and the
+others await the same result, so a burst of identical requests costs
+one query. Lesson definitions are read from the catalog on first use,
+also on a worker thread since that may rebuild the catalog index, and
+kept.
+
+Example:
+
+    async with AsyncLessonRunner("chinook.db") as runner:
+        markdown = await runner.render_lesson("17_inner_join")
+
+See `benchmarks/bench_async.py` for a load test.
+"""
+
+import asyncio
+import queue
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from generate_lessons import QueryBudget, ResultCache, connect_read_only, render_lesson
+from lesson_catalog import CATALOG_DIR, load_lessons
+
+# Default number of connections and worker threads.
+DEFAULT_POOL_SIZE = 4
+
+
+def _close_all(connections: List[sqlite3.Connection]) -> None:
+    for conn in connections:
+        conn.close()
+
+
+class AsyncLessonRunner:
+    """Render lessons from coroutines without blocking the event loop.
+
+    Args:
+        db_path: Path to the SQLite database.
+        pool_size: Number of read-only connections and worker threads,
+            i.e. the most lessons rendered at the same time.
+        count_total: Whether to report total row counts.
+        cache: Optional result cache shared by all connections.
+        budget: Optional limits for every lesson query.
+        coalesce: Whether concurrent requests for the same lesson share
+            one render.
+        catalog_dir: Directory holding the lesson files.
+    """
+
+    def __init__(self, db_path: str, pool_size: int = DEFAULT_POOL_SIZE, count_total: bool = False,
+                 cache: Optional[ResultCache] = None, budget: Optional[QueryBudget] = None,
+                 coalesce: bool = True, catalog_dir: str = CATALOG_DIR) -> None:
+        self.db_path = db_path
+        self.pool_size = pool_size
+        self.count_total = count_total
+        self.cache = cache
+        self.budget = budget
+        self.coalesce = coalesce
+        self.catalog_dir = catalog_dir
+        self.renders = 0
+        self.coalesced = 0
+        self._lessons: Dict[str, Dict] = {}
+        self._inflight: Dict[str, "asyncio.Future[str]"] = {}
+        self._pool: "queue.Queue[sqlite3.Connection]" = queue.Queue()
+        self._connections: List[sqlite3.Connection] = []
+        self._executor: Optional[ThreadPoolExecutor] = None
+        # Serializes catalog reads, which may rewrite the catalog index.
+        self._catalog_lock = threading.Lock()
+
+    async def __aenter__(self) -> "AsyncLessonRunner":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+    def lesson(self, slug: str) -> Dict:
+        """Return a lesson definition, reading it from the catalog on
+        first use. This blocks; coroutines go through `render_lesson`.
+
+        Raises:
+            ValueError: If the lesson is not in the catalog.
+        """
+        lesson = self._lessons.get(slug)
+        if lesson is None:
+            with self._catalog_lock:
+                lesson = self._lessons.get(slug)
+                if lesson is None:
+                    lesson = self._lessons[slug] = load_lessons([slug], catalog_dir=self.catalog_dir)[0]
+        return lesson
+
+    def _render(self, slug: str) -> str:
+        """Render a lesson on a pooled connection; runs in a worker thread."""
+        lesson = self.lesson(slug)
+        try:
+            conn = self._pool.get_nowait()
+        except queue.Empty:
+            conn = connect_read_only(self.db_path)
+            self._connections.append(conn)
+        try:
+            return render_lesson(conn, lesson, self.count_total, cache=self.cache, budget=self.budget)
+        finally:
+            self._pool.put(conn)
+
+    async def render_lesson(self, slug: str) -> str:
+        """Return the Markdown document of a lesson.
+
+        Raises:
+            ValueError: If the lesson is not in the catalog.
+        """
+        if self.coalesce:
+            pending = self._inflight.get(slug)
+            if pending is not None:
+                self.coalesced += 1
+                return await asyncio.shield(pending)
+        loop = asyncio.get_running_loop()
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.pool_size,
+                                                thread_name_prefix="lesson")
+        self.renders += 1
+        future = loop.run_in_executor(self._executor, self._render, slug)
+        if not self.coalesce:
+            return await future
+        self._inflight[slug] = future
+        future.add_done_callback(lambda _: self._inflight.pop(slug, None))
+        # Shielded so that a cancelled caller does not cancel the render
+        # other callers are waiting for.
+        return await asyncio.shield(future)
+
+    async def close(self) -> None:
+        """Wait for running renders and close the connections."""
+        loop = asyncio.get_running_loop()
+        if self._executor is not None:
+            await loop.run_in_executor(None, self._executor.shutdown)
+            self._executor = None
+        connections, self._connections = self._connections, []
+        self._pool = queue.Queue()
+        await loop.run_in_executor(None, _close_all, connections)
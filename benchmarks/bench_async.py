@@ -0,0 +1,104 @@
+"""
+Load test for `async_lessons.AsyncLessonRunner`.
+
+A number of simulated clients run concurrently on one event loop, each
+sending requests for lessons back to back, like browsers hitting the
+lesson page. The lessons are drawn with a skewed distribution (a few
+lessons are much more popular than the rest) from a fixed random seed,
+so runs are comparable. For every pool size the test is run with and
+without request coalescing, and the throughput, p50/p99 latency, the
+number of renders and the number of coalesced requests are reported.
+
+Run it from the root of the project directory, ideally against a
+scaled database:
+
+    python benchmarks/bench_async.py --db bench_data/chinook_x100.db --clients 64
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+from typing import Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from async_lessons import AsyncLessonRunner  # noqa: E402
+from bench_lessons import percentile  # noqa: E402
+from generate_lessons import get_lessons, rows_to_markdown  # noqa: E402
+
+
+def request_plan(slugs: List[str], clients: int, requests: int, seed: int) -> List[List[str]]:
+    """Draw the lessons each client requests, weighting the i-th lesson
+    by 1 / (i + 1) after a seeded shuffle.
+    """
+    rng = random.Random(seed)
+    ranked = slugs[:]
+    rng.shuffle(ranked)
+    weights = [1 / (rank + 1) for rank in range(len(ranked))]
+    return [rng.choices(ranked, weights, k=requests) for _ in range(clients)]
+
+
+async def run_load(db_path: str, plan: List[List[str]], pool_size: int, coalesce: bool) -> Dict:
+    """Replay a request plan against a fresh runner and measure it."""
+    latencies: List[float] = []
+
+    async def client(slugs: List[str]) -> None:
+        for slug in slugs:
+            start = time.perf_counter()
+            await runner.render_lesson(slug)
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    async with AsyncLessonRunner(db_path, pool_size=pool_size, coalesce=coalesce) as runner:
+        # Load the lesson definitions before the clock starts.
+        for slug in {slug for slugs in plan for slug in slugs}:
+            runner.lesson(slug)
+        start = time.perf_counter()
+        await asyncio.gather(*(client(slugs) for slugs in plan))
+        elapsed = time.perf_counter() - start
+    return {
+        "pool_size": pool_size,
+        "coalesce": coalesce,
+        "requests": len(latencies),
+        "throughput": len(latencies) / elapsed,
+        "p50_ms": percentile(latencies, 50),
+        "p99_ms": percentile(latencies, 99),
+        "renders": runner.renders,
+        "coalesced": runner.coalesced,
+    }
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Load test the asyncio lesson runner.")
+    parser.add_argument("--db", default="chinook.db", help="path to the Chinook SQLite database")
+    parser.add_argument("--clients", type=int, default=32, help="concurrent simulated clients")
+    parser.add_argument("--requests", type=int, default=50, help="requests per client")
+    parser.add_argument("--pool-sizes", type=int, nargs="+", default=[1, 4, 8],
+                        help="connection pool sizes to test")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the request plan")
+    args = parser.parse_args(argv)
+
+    slugs = [lesson["slug"] for lesson in get_lessons() if lesson.get("run", True)]
+    plan = request_plan(slugs, args.clients, args.requests, args.seed)
+    rows = []
+    for pool_size in args.pool_sizes:
+        for coalesce in (False, True):
+            result = asyncio.run(run_load(args.db, plan, pool_size, coalesce))
+            rows.append((
+                result["pool_size"],
+                "yes" if coalesce else "no",
+                result["requests"],
+                round(result["throughput"]),
+                round(result["p50_ms"], 2),
+                round(result["p99_ms"], 2),
+                result["renders"],
+                result["coalesced"],
+            ))
+    print(rows_to_markdown(["Pool", "Coalescing", "Requests", "Requests/s", "p50 ms", "p99 ms",
+                            "Renders", "Coalesced"], rows))
+
+
+if __name__ == '__main__':
+    main()
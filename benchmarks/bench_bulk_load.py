@@ -0,0 +1,154 @@
+"""
+Measure how fast `bulk_load.py` appends generated sales to the Chinook
+database, compared with plainer ways of inserting the same rows.
+
+The benchmark generates `--invoices` new invoices for random existing
+customers, each with 1 to 9 lines for random existing tracks, and
+writes them to `invoices` and `invoice_items` files in CSV and JSON
+Lines. Every strategy then loads them into a fresh copy of the
+database, reading the files with the same readers:
+
+* `execute`: one `execute` per row in one transaction, with the
+  indexes in place and foreign keys enforced per row;
+* `executemany`: the same with one `executemany` per batch;
+* `bulk_load`: `bulk_load.bulk_load`, i.e. WAL mode, indexes dropped
+  and rebuilt, and foreign keys checked once at the end.
+
+The time includes parsing, index rebuilds, checks and the commit.
+
+Run it from the root of the project directory:
+
+    python benchmarks/bench_bulk_load.py --invoices 100000
+"""
+
+import argparse
+import csv
+import json
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bulk_load import BATCH_SIZE, READERS, bulk_load, file_format, insert_rows  # noqa: E402
+from generate_lessons import rows_to_markdown  # noqa: E402
+from scaled_db import DEFAULT_SOURCE  # noqa: E402
+
+INVOICE_COLUMNS = ["InvoiceId", "CustomerId", "InvoiceDate", "BillingAddress", "BillingCity",
+                   "BillingState", "BillingCountry", "BillingPostalCode", "Total"]
+ITEM_COLUMNS = ["InvoiceLineId", "InvoiceId", "TrackId", "UnitPrice", "Quantity"]
+
+
+def generate_sales(db_path: str, invoices: int, seed: int = 0) -> Tuple[List[tuple], List[tuple]]:
+    """Generate invoices and invoice lines that continue the database's
+    own, referencing its customers and tracks.
+
+    Returns:
+        The invoice rows and the invoice line rows, in the column order
+        of `INVOICE_COLUMNS` and `ITEM_COLUMNS`.
+    """
+    rng = random.Random(seed)
+    with sqlite3.connect(db_path) as conn:
+        customers = conn.execute("SELECT CustomerId, Address, City, State, Country, PostalCode "
+                                 "FROM customers").fetchall()
+        tracks = conn.execute("SELECT TrackId, UnitPrice FROM tracks").fetchall()
+        invoice_id, line_id = conn.execute(
+            "SELECT (SELECT MAX(InvoiceId) FROM invoices), (SELECT MAX(InvoiceLineId) FROM invoice_items)"
+        ).fetchone()
+    invoice_rows, item_rows = [], []
+    for _ in range(invoices):
+        invoice_id += 1
+        customer = rng.choice(customers)
+        total = 0.0
+        for _ in range(rng.randint(1, 9)):
+            line_id += 1
+            track_id, price = rng.choice(tracks)
+            quantity = rng.randint(1, 2)
+            item_rows.append((line_id, invoice_id, track_id, price, quantity))
+            total += price * quantity
+        date = f"{rng.randint(2010, 2025)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d} 00:00:00"
+        invoice_rows.append((invoice_id, customer[0], date, *customer[1:], round(total, 2)))
+    return invoice_rows, item_rows
+
+
+def write_file(path: str, columns: Sequence[str], rows: List[tuple]) -> None:
+    """Write rows as CSV or JSON Lines, depending on the extension."""
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        if file_format(path) == "csv":
+            writer = csv.writer(f)
+            writer.writerow(columns)
+            writer.writerows(["" if value is None else value for value in row] for row in rows)
+        else:
+            for row in rows:
+                f.write(json.dumps(dict(zip(columns, row))) + "\n")
+
+
+def _load_in_place(db_path: str, sources: Sequence[Tuple[str, str]], many: bool) -> None:
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    try:
+        conn.execute("PRAGMA foreign_keys = ON")
+        conn.execute("BEGIN")
+        for table, path in sources:
+            header, rows = READERS[file_format(path)](path)
+            if many:
+                insert_rows(conn, table, header, rows)
+            else:
+                sql = f"INSERT INTO {table} ({', '.join(header)}) VALUES ({', '.join('?' * len(header))})"
+                for row in rows:
+                    conn.execute(sql, row)
+        conn.execute("COMMIT")
+    finally:
+        conn.close()
+
+
+STRATEGIES: Dict[str, Callable[[str, Sequence[Tuple[str, str]]], None]] = {
+    "execute": lambda db_path, sources: _load_in_place(db_path, sources, many=False),
+    "executemany": lambda db_path, sources: _load_in_place(db_path, sources, many=True),
+    "bulk_load": lambda db_path, sources: bulk_load(db_path, sources, batch_size=BATCH_SIZE),
+}
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Benchmark bulk loading of generated sales.")
+    parser.add_argument("--source", default=DEFAULT_SOURCE, help="path to the Chinook database")
+    parser.add_argument("--invoices", type=int, default=100000, help="invoices to generate")
+    parser.add_argument("--formats", nargs="+", choices=["csv", "jsonl"], default=["csv", "jsonl"],
+                        help="file formats to load")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per strategy; the best is reported")
+    args = parser.parse_args(argv)
+
+    invoice_rows, item_rows = generate_sales(args.source, args.invoices)
+    total_rows = len(invoice_rows) + len(item_rows)
+    print(f"Generated {len(invoice_rows)} invoices and {len(item_rows)} invoice lines.\n")
+    rows = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        for fmt in args.formats:
+            sources = []
+            for table, columns, data in (("invoices", INVOICE_COLUMNS, invoice_rows),
+                                         ("invoice_items", ITEM_COLUMNS, item_rows)):
+                path = os.path.join(work_dir, f"{table}.{fmt}")
+                write_file(path, columns, data)
+                sources.append((table, path))
+            for name, load in STRATEGIES.items():
+                timings = []
+                for _ in range(args.repeat):
+                    target = os.path.join(work_dir, "target.db")
+                    for suffix in ("", "-wal", "-shm"):
+                        if os.path.exists(target + suffix):
+                            os.remove(target + suffix)
+                    shutil.copyfile(args.source, target)
+                    start = time.perf_counter()
+                    load(target, sources)
+                    timings.append(time.perf_counter() - start)
+                best = min(timings)
+                rows.append((fmt, name, round(best, 2), round(total_rows / best)))
+    print(rows_to_markdown(["Format", "Strategy", "Seconds", "Rows/s"], rows))
+
+
+if __name__ == '__main__':
+    main()
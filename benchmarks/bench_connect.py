@@ -0,0 +1,133 @@
+"""
+Compare connection profiles for running the lesson queries on scaled
+Chinook databases.
+
+Every executed lesson query is run to completion on each profile:
+
+* `default`: plain `sqlite3.connect(db_path)`, as the generator used to;
+* `read-only`: a `mode=ro` URI without the tuning pragmas;
+* `tuned`: `generate_lessons.connect_read_only`, i.e. memory-mapped,
+  with a larger page cache and in-memory temporary storage;
+* `tuned, immutable`: the same with `immutable=1`.
+
+The cold time opens a new connection and runs every query once; where
+the platform supports it, the database file is first dropped from the
+OS page cache with `posix_fadvise`, so the run includes reading it from
+disk. The warm time is the median of `--repeat` further runs on the same
+connection; the profiles take turns, so drift in machine load affects
+them all alike.
+
+Run it from the root of the project directory:
+
+    python benchmarks/bench_connect.py --scales 10 100
+"""
+
+import argparse
+import os
+import sqlite3
+import statistics
+import sys
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from generate_lessons import connect_read_only, get_lessons, rows_to_markdown  # noqa: E402
+from scaled_db import DEFAULT_DATA_DIR, DEFAULT_SOURCE, ensure_scaled_database  # noqa: E402
+
+PROFILES: Dict[str, Callable[[str], sqlite3.Connection]] = {
+    "default": sqlite3.connect,
+    "read-only": lambda path: connect_read_only(path, tuned=False),
+    "tuned": connect_read_only,
+    "tuned, immutable": lambda path: connect_read_only(path, immutable=True),
+}
+
+
+def evict_from_page_cache(path: str) -> bool:
+    """Ask the OS to drop a file from its page cache.
+
+    Returns:
+        Whether the platform supports it.
+    """
+    if not hasattr(os, "posix_fadvise"):
+        return False
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+    return True
+
+
+def run_queries(conn: sqlite3.Connection, queries: List[str]) -> float:
+    """Run every query to completion, returning the time taken in ms."""
+    start = time.perf_counter()
+    for query in queries:
+        for _ in conn.execute(query):
+            pass
+    return (time.perf_counter() - start) * 1000
+
+
+def bench_profiles(db_path: str, queries: List[str], repeat: int) -> Dict[str, Tuple[float, float]]:
+    """Return the cold and the median warm time of every profile, in ms."""
+    connections: Dict[str, sqlite3.Connection] = {}
+    cold: Dict[str, float] = {}
+    warm: Dict[str, List[float]] = {name: [] for name in PROFILES}
+    try:
+        for name, connect in PROFILES.items():
+            evict_from_page_cache(db_path)
+            start = time.perf_counter()
+            conn = connections[name] = connect(db_path)
+            cold[name] = (time.perf_counter() - start) * 1000 + run_queries(conn, queries)
+        for _ in range(repeat):
+            for name, conn in connections.items():
+                warm[name].append(run_queries(conn, queries))
+    finally:
+        for conn in connections.values():
+            conn.close()
+    return {name: (cold[name], statistics.median(warm[name])) for name in PROFILES}
+
+
+def runnable_queries(db_path: str) -> List[str]:
+    """Return the executed lesson queries that succeed on a database."""
+    queries = []
+    conn = connect_read_only(db_path, tuned=False)
+    try:
+        for lesson in get_lessons():
+            if not lesson.get("run", True):
+                continue
+            query = lesson["query"].strip().rstrip(';')
+            try:
+                conn.execute(query).fetchone()
+            except sqlite3.Error:
+                continue
+            queries.append(query)
+    finally:
+        conn.close()
+    return queries
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Compare SQLite connection profiles on the lesson queries.")
+    parser.add_argument("--source", default=DEFAULT_SOURCE, help="path to the Chinook database")
+    parser.add_argument("--data-dir", default=DEFAULT_DATA_DIR, help="directory for the scaled databases")
+    parser.add_argument("--scales", type=int, nargs="+", default=[10, 100],
+                        help="scale factors to benchmark")
+    parser.add_argument("--repeat", type=int, default=5, help="warm runs per profile")
+    args = parser.parse_args(argv)
+
+    for factor in args.scales:
+        db_path = ensure_scaled_database(args.source, factor, args.data_dir)
+        queries = runnable_queries(db_path)
+        timings = bench_profiles(db_path, queries, args.repeat)
+        baseline = timings["default"][1]
+        rows = [(name, round(cold, 1), round(warm, 1), f"{baseline / warm:.2f}x")
+                for name, (cold, warm) in timings.items()]
+        size = os.path.getsize(db_path) / (1024 * 1024)
+        print(f"## Scale x{factor} ({size:.1f} MiB, {len(queries)} queries)\n")
+        print(rows_to_markdown(["Profile", "Cold ms", "Warm ms", "Warm speedup"], rows) + "\n")
+
+
+if __name__ == '__main__':
+    main()
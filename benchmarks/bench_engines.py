@@ -0,0 +1,155 @@
+"""
+Run every runnable lesson on each execution engine in
+`lesson_engines.py` (SQLite, pandas and, when installed, DuckDB) at
+several data scales, check that the engines agree and report the
+speedups over SQLite.
+
+For every scale factor a synthetic database is built (or reused) with
+`scaled_db.py`. Each engine loads it once, which for pandas and DuckDB
+means copying every table into memory; that load time is reported
+separately. Every lesson is then run `--repeat` times per engine and
+the median is reported, together with how the result compares with
+SQLite's (see `lesson_engines.compare_results`). `reordered` means the
+same rows came back in another order, which happens where an `ORDER BY`
+has ties.
+
+Run it from the root of the project directory:
+
+    python benchmarks/bench_engines.py --scales 1 10 100 --json engines.json
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+from typing import Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from generate_lessons import get_lessons, rows_to_markdown  # noqa: E402
+from lesson_engines import ENGINES, available_engines, compare_results  # noqa: E402
+from scaled_db import DEFAULT_DATA_DIR, DEFAULT_SOURCE, ensure_scaled_database  # noqa: E402
+
+REFERENCE_ENGINE = "sqlite"
+
+
+def bench_database(db_path: str, lessons: List[Dict], engine_names: List[str], repeat: int) -> Dict:
+    """Run every lesson on every engine against one database.
+
+    Returns:
+        The load time of each engine in ms and, per lesson, each
+        engine's median time in ms, its comparison with the reference
+        engine and any error.
+    """
+    engines = {name: ENGINES[name]() for name in engine_names}
+    load_ms = {}
+    lesson_results = []
+    try:
+        for name, engine in engines.items():
+            start = time.perf_counter()
+            engine.load(db_path)
+            load_ms[name] = (time.perf_counter() - start) * 1000
+        for lesson in lessons:
+            if not lesson.get("run", True):
+                continue
+            entry = {"slug": lesson["slug"], "engines": {}}
+            reference = None
+            for name, engine in engines.items():
+                if not engine.supports(lesson):
+                    entry["engines"][name] = {"ms": None, "status": "n/a", "error": None}
+                    continue
+                timings = []
+                try:
+                    for _ in range(repeat):
+                        start = time.perf_counter()
+                        result = engine.run(lesson)
+                        timings.append((time.perf_counter() - start) * 1000)
+                except Exception as exc:  # engines raise their own error types
+                    entry["engines"][name] = {"ms": None, "status": "error", "error": str(exc)}
+                    continue
+                if name == REFERENCE_ENGINE:
+                    reference = result
+                    status = "reference"
+                else:
+                    status = "unchecked" if reference is None else compare_results(reference, result)
+                entry["engines"][name] = {"ms": statistics.median(timings), "status": status, "error": None}
+            lesson_results.append(entry)
+    finally:
+        for engine in engines.values():
+            engine.close()
+    return {"load_ms": load_ms, "lessons": lesson_results}
+
+
+def format_results(factor: int, results: Dict, engine_names: List[str]) -> str:
+    """Render the results for one scale factor as Markdown tables."""
+    others = [name for name in engine_names if name != REFERENCE_ENGINE]
+    headers = ["Lesson", f"{REFERENCE_ENGINE} ms"]
+    for name in others:
+        headers += [f"{name} ms", f"{name} speedup", f"{name} result"]
+    rows = []
+    # Per engine: SQLite's and the engine's total over the lessons both ran.
+    totals = {name: [0.0, 0.0] for name in others}
+    for entry in results["lessons"]:
+        timings = entry["engines"]
+        reference_ms = timings[REFERENCE_ENGINE]["ms"]
+        row = [entry["slug"], None if reference_ms is None else round(reference_ms, 3)]
+        for name in others:
+            ms = timings[name]["ms"]
+            speedup = None
+            if ms is not None and reference_ms is not None:
+                speedup = f"{reference_ms / max(ms, 1e-9):.2f}x"
+                totals[name][0] += reference_ms
+                totals[name][1] += ms
+            row += [None if ms is None else round(ms, 3), speedup, timings[name]["status"]]
+        rows.append(row)
+    load = rows_to_markdown(["Engine", "Load ms"],
+                            [(name, round(ms, 1)) for name, ms in results["load_ms"].items()])
+    summary = [
+        (name, round(reference_ms, 1), round(ms, 1), f"{reference_ms / max(ms, 1e-9):.2f}x",
+         sum(entry["engines"][name]["status"] in ("equal", "reordered") for entry in results["lessons"]))
+        for name, (reference_ms, ms) in totals.items()
+    ]
+    summary_md = rows_to_markdown(
+        ["Engine", f"{REFERENCE_ENGINE} total ms", "Total ms", "Speedup", "Lessons agreeing"], summary)
+    return (f"## Scale x{factor}\n\n{load}\n\n" + rows_to_markdown(headers, rows)
+            + f"\n\n{summary_md}")
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Compare lesson execution engines on scaled databases.")
+    parser.add_argument("--source", default=DEFAULT_SOURCE, help="path to the Chinook database")
+    parser.add_argument("--data-dir", default=DEFAULT_DATA_DIR, help="directory for the scaled databases")
+    parser.add_argument("--scales", type=int, nargs="+", default=[1, 10, 100],
+                        help="scale factors to benchmark")
+    parser.add_argument("--engines", nargs="+", choices=sorted(ENGINES),
+                        help="engines to run; defaults to every installed one")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per lesson and engine")
+    parser.add_argument("--json", help="also write the raw results to this JSON file")
+    args = parser.parse_args(argv)
+
+    installed = available_engines()
+    engine_names = [name for name in ENGINES if name in (args.engines or installed)]
+    missing = [name for name in engine_names if name not in installed]
+    if missing:
+        sys.exit(f"error: not installed: {', '.join(missing)}")
+    if REFERENCE_ENGINE not in engine_names:
+        engine_names.insert(0, REFERENCE_ENGINE)
+
+    lessons = get_lessons()
+    report = {}
+    for factor in args.scales:
+        db_path = ensure_scaled_database(args.source, factor, args.data_dir)
+        results = bench_database(db_path, lessons, engine_names, args.repeat)
+        report[f"x{factor}"] = results
+        print(format_results(factor, results, engine_names) + "\n")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"repeat": args.repeat, "engines": engine_names, "scales": report}, f, indent=2)
+            f.write("\n")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+"""
+Benchmark the runnable lesson queries against scaled-up Chinook
+databases.
+
+For every scale factor a synthetic database is built (or reused) with
+`scaled_db.py`, and every lesson query that `generate_lessons.py`
+executes is measured in two ways:
+
+* the query itself, run to completion `--repeat` times, reported as
+  p50/p95/p99 latency and the peak Python memory of materializing the
+  whole result with `fetchall()`;
+* the generator's own code path, `fetch_sample_results`, reported as
+  p50 latency and peak Python memory, so that regressions in the
+  generator show up next to slow query patterns;
+* the same call served from a warm `ResultCache`, reported as p50
+  latency.
+
+Run it from the root of the project directory:
+
+    python benchmarks/bench_lessons.py --scales 10 100 1000 --json bench.json
+"""
+
+import argparse
+import gc
+import json
+import math
+import os
+import sqlite3
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Optional, Sequence
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from generate_lessons import (  # noqa: E402
+    ResultCache, connect_read_only, fetch_sample_results, get_lessons, rows_to_markdown,
+)
+from scaled_db import DEFAULT_DATA_DIR, DEFAULT_SOURCE, ensure_scaled_database  # noqa: E402
+
+
+def percentile(samples: Sequence[float], pct: float) -> float:
+    """Return the nearest-rank percentile of `samples`."""
+    ordered = sorted(samples)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def time_calls(func: Callable[[], object], repeat: int) -> List[float]:
+    """Time `repeat` calls of `func`, in milliseconds."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def peak_memory(func: Callable[[], object]) -> int:
+    """Return the peak Python heap allocation of one call, in bytes."""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def bench_database(db_path: str, lessons: List[Dict[str, str]], repeat: int) -> List[Dict]:
+    """Measure every executed lesson query against one database."""
+    conn = connect_read_only(db_path)
+    cache = ResultCache()
+    results = []
+    try:
+        for lesson in lessons:
+            if not lesson.get("run", True):
+                continue
+            query = lesson["query"].strip().rstrip(';')
+
+            def run_query():
+                for _ in conn.execute(query):
+                    pass
+
+            def sample():
+                return fetch_sample_results(conn, lesson["query"])
+
+            def cached_sample():
+                return fetch_sample_results(conn, lesson["query"], cache=cache)
+
+            try:
+                run_query()  # warm the page cache
+                query_ms = time_calls(run_query, repeat)
+                sample_ms = time_calls(sample, repeat)
+                cached_sample()
+                cached_ms = time_calls(cached_sample, repeat)
+                fetchall_peak = peak_memory(lambda: conn.execute(query).fetchall())
+                sample_peak = peak_memory(sample)
+            except sqlite3.Error as exc:
+                results.append({"slug": lesson["slug"], "error": str(exc)})
+                continue
+            results.append({
+                "slug": lesson["slug"],
+                "error": None,
+                "query_p50_ms": percentile(query_ms, 50),
+                "query_p95_ms": percentile(query_ms, 95),
+                "query_p99_ms": percentile(query_ms, 99),
+                "sample_p50_ms": percentile(sample_ms, 50),
+                "cached_p50_ms": percentile(cached_ms, 50),
+                "fetchall_peak_bytes": fetchall_peak,
+                "sample_peak_bytes": sample_peak,
+            })
+    finally:
+        cache.close()
+        conn.close()
+    return results
+
+
+def format_results(factor: int, results: List[Dict]) -> str:
+    """Render the results for one scale factor as a Markdown table."""
+    rows = []
+    for entry in results:
+        if entry["error"]:
+            rows.append((entry["slug"], None, None, None, None, None, None, None))
+            continue
+        rows.append((
+            entry["slug"],
+            round(entry["query_p50_ms"], 3),
+            round(entry["query_p95_ms"], 3),
+            round(entry["query_p99_ms"], 3),
+            round(entry["sample_p50_ms"], 3),
+            round(entry["cached_p50_ms"], 4),
+            round(entry["fetchall_peak_bytes"] / 1024, 1),
+            round(entry["sample_peak_bytes"] / 1024, 1),
+        ))
+    headers = ["Lesson", "p50 ms", "p95 ms", "p99 ms", "Sample p50 ms", "Cached p50 ms",
+               "fetchall KiB", "Sample KiB"]
+    return f"## Scale x{factor}\n\n" + rows_to_markdown(headers, rows)
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Benchmark lesson queries on scaled databases.")
+    parser.add_argument("--source", default=DEFAULT_SOURCE, help="path to the Chinook database")
+    parser.add_argument("--data-dir", default=DEFAULT_DATA_DIR, help="directory for the scaled databases")
+    parser.add_argument("--scales", type=int, nargs="+", default=[10, 100, 1000],
+                        help="scale factors to benchmark")
+    parser.add_argument("--repeat", type=int, default=20, help="timed runs per query")
+    parser.add_argument("--json", help="also write the raw results to this JSON file")
+    args = parser.parse_args(argv)
+
+    lessons = get_lessons()
+    report = {}
+    for factor in args.scales:
+        db_path = ensure_scaled_database(args.source, factor, args.data_dir)
+        results = bench_database(db_path, lessons, args.repeat)
+        report[f"x{factor}"] = results
+        print(format_results(factor, results) + "\n")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"repeat": args.repeat, "sqlite_version": sqlite3.sqlite_version,
+                       "scales": report}, f, indent=2)
+            f.write("\n")
+
+
+if __name__ == '__main__':
+    main()
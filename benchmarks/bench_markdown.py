@@ -0,0 +1,98 @@
+"""
+Benchmark the Markdown table renderers used by the lesson generator.
+
+A synthetic result set shaped like a Chinook `tracks` query (integer
+ids, text names with the occasional pipe or line break, nullable
+composer and float prices) is rendered three ways:
+
+* the original row-by-row `df.iterrows()` renderer,
+* the column-oriented `df_to_markdown`, and
+* `rows_to_markdown`, which formats raw cursor tuples directly.
+
+Run it from the root of the project directory:
+
+    python benchmarks/bench_markdown.py --rows 100000
+"""
+
+import argparse
+import gc
+import os
+import random
+import sys
+import time
+from typing import Callable, List
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from generate_lessons import df_to_markdown, rows_to_markdown  # noqa: E402
+
+COLUMNS = ["TrackId", "Name", "Composer", "Milliseconds", "UnitPrice"]
+
+
+def legacy_df_to_markdown(df: pd.DataFrame) -> str:
+    """The renderer the generator used before the column-oriented one."""
+    header = '| ' + ' | '.join(str(col) for col in df.columns) + ' |'
+    separator = '| ' + ' | '.join(['---' for _ in df.columns]) + ' |'
+    rows = []
+    for _, row in df.iterrows():
+        cells = [str(cell) for cell in row]
+        rows.append('| ' + ' | '.join(cells) + ' |')
+    return '\n'.join([header, separator] + rows)
+
+
+def make_rows(count: int, seed: int = 0) -> List[tuple]:
+    """Build `count` synthetic track rows."""
+    rng = random.Random(seed)
+    names = ["For Those About To Rock", "Balls to the Wall", "Fast As a Shark",
+             "Restless and Wild", "Princess of the Dawn", "Put The Finger On You",
+             "Let's Get It Up", "Inject The Venom | Live", "Snowballed\nRemastered"]
+    composers = ["Angus Young, Malcolm Young, Brian Johnson", None,
+                 "F. Baltes, S. Kaufman, U. Dirkscneider & W. Hoffman", None]
+    return [
+        (i, rng.choice(names), rng.choice(composers), rng.randint(60000, 600000),
+         rng.choice((0.99, 1.99)))
+        for i in range(1, count + 1)
+    ]
+
+
+def best_of(func: Callable[[], str], repeat: int) -> float:
+    """Return the fastest of `repeat` timed calls, in seconds. Like
+    `timeit`, garbage collection is paused while a call is timed.
+    """
+    timings = []
+    for _ in range(repeat):
+        gc.collect()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - start)
+        finally:
+            gc.enable()
+    return min(timings)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the Markdown table renderers.")
+    parser.add_argument("--rows", type=int, default=100_000, help="number of rows to render")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per renderer")
+    args = parser.parse_args(argv)
+
+    rows = make_rows(args.rows)
+    df = pd.DataFrame.from_records(rows, columns=COLUMNS)
+
+    legacy = best_of(lambda: legacy_df_to_markdown(df), args.repeat)
+    results = [
+        ("legacy iterrows", legacy),
+        ("df_to_markdown", best_of(lambda: df_to_markdown(df), args.repeat)),
+        ("rows_to_markdown", best_of(lambda: rows_to_markdown(COLUMNS, rows), args.repeat)),
+    ]
+    print(f"Rendering {args.rows} rows (best of {args.repeat}):")
+    for name, seconds in results:
+        print(f"  {name:<18} {seconds * 1000:10.1f} ms  {legacy / seconds:6.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+"""
+Compare the sales queries on an unpartitioned database with the same
+queries on copies partitioned by `partitioned_sales.py`.
+
+For every scale factor a synthetic database is built (or reused) with
+`scaled_db.py` and partitioned by year and by customer country. The
+workload is every runnable lesson that reads `invoices` or
+`invoice_items` plus the dashboard queries of `summary_tables.py`
+(e.g. the notebook's top 10 artists). Each query runs `--repeat` times:
+
+* `unpartitioned`: on the scaled database;
+* `combined`: on the partitioned copy, through the `UNION ALL` views
+  over the ATTACHed partitions;
+* `fan-out`: split into partial aggregates that run in parallel on one
+  connection per partition and are merged, for the queries that allow
+  it (others show `-`).
+
+The median times are reported, with how the partitioned result compares
+with the unpartitioned one (see `lesson_engines.compare_results`).
+Partitions only run in parallel on as many cores as there are; the
+number of CPUs is printed with the results.
+
+Run it from the root of the project directory:
+
+    python benchmarks/bench_partitions.py --scales 10 100
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+from typing import Callable, List, Optional, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from generate_lessons import connect_read_only, get_lessons, rows_to_markdown  # noqa: E402
+from lesson_engines import compare_results  # noqa: E402
+from lesson_sql import referenced_tables  # noqa: E402
+from partitioned_sales import FACT_TABLES, PARTITION_KEYS, PartitionedDatabase, partition_database  # noqa: E402
+from scaled_db import DEFAULT_DATA_DIR, DEFAULT_SOURCE, ensure_scaled_database  # noqa: E402
+from summary_tables import DASHBOARDS  # noqa: E402
+
+
+def sales_queries() -> List[Tuple[str, str]]:
+    """Return the name and SQL of every query in the workload."""
+    queries = [(lesson["slug"], lesson["query"]) for lesson in get_lessons()
+               if lesson.get("run", True) and referenced_tables(lesson["query"]) & set(FACT_TABLES)]
+    queries += [(name, base_sql) for name, (_, base_sql) in DASHBOARDS.items()]
+    return queries
+
+
+def _median_ms(run: Callable[[], object], repeat: int) -> Tuple[float, object]:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = run()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings), result
+
+
+def bench_layout(db_path: str, directory: str, queries: List[Tuple[str, str]], repeat: int) -> List[tuple]:
+    """Time every query on the unpartitioned and the partitioned database.
+
+    Returns:
+        One table row per query.
+    """
+    conn = connect_read_only(db_path)
+    database = PartitionedDatabase(directory)
+    rows = []
+    try:
+        for name, query in queries:
+            def unpartitioned():
+                cursor = conn.execute(query)
+                rows = cursor.fetchall()
+                return [desc[0] for desc in cursor.description], rows
+
+            base_ms, expected = _median_ms(unpartitioned, repeat)
+            combined_ms, (columns, result, _) = _median_ms(lambda: database.execute(query, fan_out=False), repeat)
+            row = [name, round(base_ms, 2), round(combined_ms, 2), compare_results(expected, (columns, result))]
+            if database.plan(query) is None:
+                row += ["-", "-", "-"]
+            else:
+                fan_out_ms, (columns, result, _) = _median_ms(lambda: database.execute(query), repeat)
+                row += [round(fan_out_ms, 2), f"{base_ms / max(fan_out_ms, 1e-9):.2f}x",
+                        compare_results(expected, (columns, result))]
+            rows.append(tuple(row))
+    finally:
+        database.close()
+        conn.close()
+    return rows
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Benchmark partitioned sales tables against one database.")
+    parser.add_argument("--source", default=DEFAULT_SOURCE, help="path to the Chinook database")
+    parser.add_argument("--data-dir", default=DEFAULT_DATA_DIR, help="directory for the scaled databases")
+    parser.add_argument("--scales", type=int, nargs="+", default=[10, 100],
+                        help="scale factors to benchmark")
+    parser.add_argument("--by", nargs="+", choices=sorted(PARTITION_KEYS), default=["year", "country"],
+                        help="partitionings to compare")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per query")
+    args = parser.parse_args(argv)
+
+    queries = sales_queries()
+    print(f"{os.cpu_count()} CPU(s)\n")
+    headers = ["Query", "Unpartitioned ms", "Combined ms", "Combined result", "Fan-out ms", "Fan-out speedup",
+               "Fan-out result"]
+    with tempfile.TemporaryDirectory() as work_dir:
+        for factor in args.scales:
+            db_path = ensure_scaled_database(args.source, factor, args.data_dir)
+            for by in args.by:
+                directory = os.path.join(work_dir, f"x{factor}_{by}")
+                start = time.perf_counter()
+                manifest = partition_database(db_path, directory, by)
+                elapsed = time.perf_counter() - start
+                print(f"## Scale x{factor}, by {by}: {len(manifest['partitions'])} partitions "
+                      f"built in {elapsed:.1f} s\n")
+                print(rows_to_markdown(headers, bench_layout(db_path, directory, queries, args.repeat)) + "\n")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+"""
+Compare loading tables with `pd.read_sql_query` against loading them
+from the columnar snapshots of `table_snapshots.py`.
+
+Every scenario runs in a fresh interpreter, so the peak resident set
+size of the child process shows what the load really costs; a
+`baseline` scenario that only imports pandas is reported for reference.
+The snapshots are exported once before timing starts, also in a child
+process; the export time reported includes its start-up.
+
+* `load`: every table of the database;
+* `sales by artist`: the four tables the notebook's top 10 artists
+  chart reads, joined and aggregated in pandas.
+
+Each is measured with `read_sql_query`, with snapshots whose text
+columns load as categoricals, and with snapshots whose text columns
+load as strings. The time is measured inside the child and excludes
+interpreter start-up.
+
+Run it from the root of the project directory:
+
+    python benchmarks/bench_snapshots.py --scales 1 10 100
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from generate_lessons import rows_to_markdown  # noqa: E402
+from scaled_db import DEFAULT_DATA_DIR, DEFAULT_SOURCE, ensure_scaled_database  # noqa: E402
+
+SALES_TABLES = ("invoice_items", "tracks", "albums", "artists")
+
+LOADERS = ("read_sql_query", "snapshot (category)", "snapshot (object)")
+
+
+def load(loader: str, db_path: str, snapshot_dir: str, tables: Optional[Tuple[str, ...]] = None) -> Dict:
+    """Load tables with one of `LOADERS`; runs in the child process."""
+    if loader == "read_sql_query":
+        from lesson_engines import read_tables
+
+        frames = read_tables(db_path)
+        return frames if tables is None else {name: frames[name] for name in tables}
+    from table_snapshots import load_tables
+
+    strings = "category" if "category" in loader else "object"
+    return load_tables(db_path, tables, strings=strings, snapshot_dir=snapshot_dir)
+
+
+def sales_by_artist(frames: Dict) -> object:
+    """Top 10 artists by sales, as in `panda_query.ipynb`."""
+    items = frames["invoice_items"]
+    sales = items["UnitPrice"] * items["Quantity"]
+    joined = (items[["TrackId"]].assign(Sales=sales)
+              .merge(frames["tracks"][["TrackId", "AlbumId"]], on="TrackId")
+              .merge(frames["albums"][["AlbumId", "ArtistId"]], on="AlbumId")
+              .merge(frames["artists"], on="ArtistId"))
+    return joined.groupby("Name", observed=True)["Sales"].sum().nlargest(10)
+
+
+def child(scenario: str, loader: str, db_path: str, snapshot_dir: str) -> None:
+    """Run one scenario and print the elapsed ms; runs in the child."""
+    import pandas  # noqa: F401
+
+    start = time.perf_counter()
+    if scenario == "load":
+        frames = load(loader, db_path, snapshot_dir)
+        # Touch every column, as any real use of the tables would.
+        for frame in frames.values():
+            for name in frame.columns:
+                frame[name].iloc[-1:]
+    elif scenario == "sales by artist":
+        sales_by_artist(load(loader, db_path, snapshot_dir, SALES_TABLES))
+    print(json.dumps({"ms": (time.perf_counter() - start) * 1000}))
+
+
+def run_child(args: List[str]) -> Tuple[float, int]:
+    """Run `child` in a new interpreter.
+
+    Returns:
+        The elapsed time it reported in ms and its peak RSS in KiB.
+    """
+    code = f"import sys; sys.path.insert(0, 'benchmarks'); import bench_snapshots; bench_snapshots.child(*{args!r})"
+    process = subprocess.Popen([sys.executable, "-c", code], cwd=ROOT, stdout=subprocess.PIPE)
+    output = process.stdout.read()
+    _, status, usage = os.wait4(process.pid, 0)
+    exit_code = os.waitstatus_to_exitcode(status)
+    if exit_code:
+        raise RuntimeError(f"Child exited with status {exit_code}: {args}")
+    # ru_maxrss is in KiB on Linux and in bytes on macOS.
+    maxrss = usage.ru_maxrss // 1024 if sys.platform == "darwin" else usage.ru_maxrss
+    return json.loads(output)["ms"], maxrss
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Compare read_sql_query with columnar snapshots.")
+    parser.add_argument("--source", default=DEFAULT_SOURCE, help="path to the Chinook database")
+    parser.add_argument("--data-dir", default=DEFAULT_DATA_DIR, help="directory for the scaled databases")
+    parser.add_argument("--scales", type=int, nargs="+", default=[1, 10, 100],
+                        help="scale factors to benchmark")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per scenario")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as snapshot_dir:
+        for factor in args.scales:
+            db_path = os.path.abspath(ensure_scaled_database(args.source, factor, args.data_dir))
+            # Exported in a child too: ru_maxrss counts the memory a child
+            # inherits from this process at fork time.
+            start = time.perf_counter()
+            subprocess.run([sys.executable, "table_snapshots.py", "--db", db_path, "--snapshot-dir",
+                            snapshot_dir, "--force"], cwd=ROOT, check=True, stdout=subprocess.DEVNULL)
+            export_ms = (time.perf_counter() - start) * 1000
+
+            rows = []
+            _, baseline_rss = run_child(["baseline", "", db_path, snapshot_dir])
+            rows.append(("baseline", "import pandas", "", round(baseline_rss / 1024, 1)))
+            for scenario in ("load", "sales by artist"):
+                for loader in LOADERS:
+                    runs = [run_child([scenario, loader, db_path, snapshot_dir]) for _ in range(args.repeat)]
+                    rows.append((scenario, loader, round(statistics.median(ms for ms, _ in runs), 1),
+                                 round(max(rss for _, rss in runs) / 1024, 1)))
+            print(f"## Scale x{factor} (snapshot export {export_ms:.0f} ms)\n")
+            print(rows_to_markdown(["Scenario", "Loader", "Median ms", "Peak RSS MiB"], rows) + "\n")
+
+
+if __name__ == '__main__':
+    main()
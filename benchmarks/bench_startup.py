@@ -0,0 +1,77 @@
+"""
+Measure the start-up cost of the lesson generator with and without
+pandas.
+
+The generator used to import pandas at module load. Each scenario is
+run in a fresh interpreter, once as-is and once with `import pandas`
+executed first to reproduce the old behaviour, and the median wall time
+and the peak resident set size of the child process are reported:
+
+* `import`: importing `generate_lessons` only;
+* `generate`: a full `--force` regeneration of every lesson into a
+  temporary directory.
+
+Run it from the root of the project directory:
+
+    python benchmarks/bench_startup.py --db chinook.db
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import List, Optional, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_child(code: str) -> Tuple[float, int]:
+    """Run Python code in a new interpreter.
+
+    Returns:
+        The wall time in seconds and the child's peak RSS in KiB.
+    """
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, "-c", code], cwd=ROOT, stdout=subprocess.DEVNULL)
+    _, status, usage = os.wait4(process.pid, 0)
+    elapsed = time.perf_counter() - start
+    exit_code = os.waitstatus_to_exitcode(status)
+    if exit_code:
+        raise RuntimeError(f"Child exited with status {exit_code}: {code}")
+    # ru_maxrss is in KiB on Linux and in bytes on macOS.
+    maxrss = usage.ru_maxrss // 1024 if sys.platform == "darwin" else usage.ru_maxrss
+    return elapsed, maxrss
+
+
+def measure(code: str, repeat: int) -> Tuple[float, int]:
+    """Return the median wall time and the largest peak RSS of `repeat` runs."""
+    runs = [run_child(code) for _ in range(repeat)]
+    return statistics.median(elapsed for elapsed, _ in runs), max(rss for _, rss in runs)
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Measure generator start-up time and memory.")
+    parser.add_argument("--db", default="chinook.db", help="path to the Chinook SQLite database")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per scenario")
+    args = parser.parse_args(argv)
+
+    db_path = os.path.abspath(args.db)
+    with tempfile.TemporaryDirectory() as lesson_dir:
+        scenarios = {
+            "import": "import generate_lessons",
+            "generate": ("import generate_lessons; generate_lessons.main(["
+                         f"'--db', {db_path!r}, '--lesson-dir', {lesson_dir!r}, '--force'])"),
+        }
+        print("| Scenario | pandas | Median ms | Peak RSS MiB |")
+        print("| --- | --- | ---: | ---: |")
+        for name, code in scenarios.items():
+            for label, prefix in (("not imported", ""), ("imported first", "import pandas; ")):
+                elapsed, rss = measure(prefix + code, args.repeat)
+                print(f"| {name} | {label} | {elapsed * 1000:.0f} | {rss / 1024:.1f} |")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+"""
+Build synthetic, scaled-up copies of the Chinook database for
+benchmarking.
+
+A scaled database keeps the exact schema, indexes and foreign keys of
+the source database. Every table is replicated `factor` times: copy
+`k` of a row gets its integer primary key shifted by `k` times the
+table's largest key, and each foreign key column is shifted by the same
+multiple of the referenced table's largest key. Every copy therefore
+references rows of the same copy, so all foreign keys stay valid and
+the data keeps the shape of the original.
+
+Run it from the root of the project directory to build databases ahead
+of time:
+
+    python benchmarks/scaled_db.py --scales 10 100 1000
+
+Databases are cached in `bench_data/` and rebuilt only when missing or
+older than the source database.
+"""
+
+import argparse
+import os
+import sqlite3
+import time
+from typing import Dict, List, Optional
+
+DEFAULT_SOURCE = "chinook.db"
+DEFAULT_DATA_DIR = "bench_data"
+
+
+def _quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _user_tables(conn: sqlite3.Connection) -> List[str]:
+    return [row[0] for row in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY name"
+    )]
+
+
+def _integer_key(conn: sqlite3.Connection, table: str) -> Optional[str]:
+    """Return the INTEGER PRIMARY KEY column of a table, if it has one."""
+    keys = [row for row in conn.execute(f"PRAGMA table_info({_quote(table)})") if row[5]]
+    if len(keys) == 1 and keys[0][2].upper() == "INTEGER":
+        return keys[0][1]
+    return None
+
+
+def _max_value(conn: sqlite3.Connection, table: str, column: str) -> int:
+    value = conn.execute(f"SELECT MAX({_quote(column)}) FROM {_quote(table)}").fetchone()[0]
+    return value or 0
+
+
+def scaled_database_path(factor: int, data_dir: str = DEFAULT_DATA_DIR) -> str:
+    """Return where the database scaled by `factor` is cached."""
+    return os.path.join(data_dir, f"chinook_x{factor}.db")
+
+
+def build_scaled_database(source: str, target: str, factor: int) -> Dict[str, int]:
+    """Write a copy of `source` to `target` with every table scaled.
+
+    Args:
+        source: Path to the Chinook database.
+        target: Path of the database to create. It is replaced if it
+            already exists.
+        factor: How many copies of each row the result contains.
+
+    Returns:
+        The resulting row count of each table.
+    """
+    if factor < 1:
+        raise ValueError("factor must be at least 1")
+    os.makedirs(os.path.dirname(os.path.abspath(target)), exist_ok=True)
+    tmp_target = target + ".tmp"
+    if os.path.exists(tmp_target):
+        os.remove(tmp_target)
+
+    src = sqlite3.connect(source)
+    dst = sqlite3.connect(tmp_target)
+    try:
+        src.backup(dst)
+    finally:
+        src.close()
+
+    try:
+        dst.execute("PRAGMA journal_mode = OFF")
+        dst.execute("PRAGMA synchronous = OFF")
+        tables = _user_tables(dst)
+        keys = {table: _integer_key(dst, table) for table in tables}
+        key_max = {table: _max_value(dst, table, key) for table, key in keys.items() if key}
+        # Work out every offset before the first insert changes the maxima.
+        shifts = {}
+        for table in tables:
+            shifted = {}
+            if keys[table]:
+                shifted[keys[table]] = key_max[table]
+            for fk in dst.execute(f"PRAGMA foreign_key_list({_quote(table)})").fetchall():
+                parent, column, parent_column = fk[2], fk[3], fk[4]
+                if parent in key_max and parent_column in (None, keys[parent]):
+                    shifted[column] = key_max[parent]
+                else:
+                    shifted[column] = _max_value(dst, parent, parent_column)
+            shifts[table] = (shifted, _max_value(dst, table, "rowid"))
+
+        counts = {}
+        with dst:
+            for table in tables:
+                shifted, last_rowid = shifts[table]
+                columns = [row[1] for row in dst.execute(f"PRAGMA table_info({_quote(table)})")]
+                select = ", ".join(
+                    f"src.{_quote(col)} + copies.k * {shifted[col]}" if col in shifted
+                    else f"src.{_quote(col)}"
+                    for col in columns
+                )
+                if factor > 1:
+                    dst.execute(
+                        "WITH RECURSIVE copies(k) AS "
+                        "(SELECT 1 UNION ALL SELECT k + 1 FROM copies WHERE k < ?) "
+                        f"INSERT INTO {_quote(table)} ({', '.join(map(_quote, columns))}) "
+                        f"SELECT {select} FROM copies CROSS JOIN {_quote(table)} AS src "
+                        "WHERE src.rowid <= ? ORDER BY copies.k, src.rowid",
+                        (factor - 1, last_rowid),
+                    )
+                counts[table] = dst.execute(f"SELECT COUNT(*) FROM {_quote(table)}").fetchone()[0]
+        violations = dst.execute("PRAGMA foreign_key_check").fetchall()
+        if violations:
+            raise RuntimeError(f"Scaled database has {len(violations)} foreign key violations")
+        dst.execute("ANALYZE")
+    finally:
+        dst.close()
+    os.replace(tmp_target, target)
+    return counts
+
+
+def ensure_scaled_database(source: str, factor: int, data_dir: str = DEFAULT_DATA_DIR) -> str:
+    """Return the path of a database scaled by `factor`, building it
+    first if it is missing or older than `source`.
+    """
+    target = scaled_database_path(factor, data_dir)
+    if not os.path.exists(target) or os.path.getmtime(target) < os.path.getmtime(source):
+        build_scaled_database(source, target, factor)
+    return target
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Build scaled copies of the Chinook database.")
+    parser.add_argument("--source", default=DEFAULT_SOURCE, help="path to the Chinook database")
+    parser.add_argument("--data-dir", default=DEFAULT_DATA_DIR, help="directory for the scaled databases")
+    parser.add_argument("--scales", type=int, nargs="+", default=[10, 100, 1000],
+                        help="scale factors to build")
+    args = parser.parse_args(argv)
+
+    for factor in args.scales:
+        target = scaled_database_path(factor, args.data_dir)
+        start = time.perf_counter()
+        counts = build_scaled_database(args.source, target, factor)
+        elapsed = time.perf_counter() - start
+        size_mb = os.path.getsize(target) / 1e6
+        print(f"x{factor}: {sum(counts.values())} rows, {size_mb:.1f} MB in {elapsed:.1f} s -> {target}")
+
+
+if __name__ == '__main__':
+    main()
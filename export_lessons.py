@@ -0,0 +1,249 @@
+"""
+This script exports the complete result of every executed lesson query
+to CSV, JSON Lines or Parquet files, one file per lesson.
+
+The lesson files only show a short preview of each result. Here the
+rows of the last query of each lesson are streamed from the `sqlite3`
+cursor in fixed-size batches (see `generate_lessons.stream_script`) and
+written out batch by batch, so memory use stays flat however large the
+result is. For each lesson the number of rows, the size of the file,
+the throughput and the peak resident set size of the process are
+reported. The peak RSS is the process high-water mark after the lesson,
+so a lesson that needed more memory than those before it shows up as a
+jump in that column.
+
+Parquet export needs the optional `pyarrow` package, which is imported
+only when that format is selected. Column types are inferred from the
+first batch: integers, floats, text and blobs map to the corresponding
+Arrow types, and a column that mixes integers and floats is stored as
+floats.
+
+Run this script from the root of the project directory:
+
+    python export_lessons.py --format parquet --output-dir exports
+"""
+
+import argparse
+import base64
+import csv
+import json
+import os
+import sqlite3
+import sys
+import time
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional
+
+from generate_lessons import (
+    DEFAULT_DB_PATH, connect_read_only, get_lessons, require_database, rows_to_markdown, stream_script,
+)
+
+# Rows fetched from the cursor and written per batch.
+DEFAULT_BATCH_SIZE = 10000
+
+
+def write_csv(path: str, columns: List[str], batches: Iterable[List[tuple]]) -> int:
+    """Write batches of rows to a CSV file with a header row. NULL is
+    written as an empty field.
+
+    Returns:
+        The number of rows written.
+    """
+    count = 0
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        for rows in batches:
+            writer.writerows(rows)
+            count += len(rows)
+    return count
+
+
+def _json_value(value: object) -> object:
+    if isinstance(value, bytes):
+        return base64.b64encode(value).decode("ascii")
+    return value
+
+
+def write_jsonl(path: str, columns: List[str], batches: Iterable[List[tuple]]) -> int:
+    """Write batches of rows to a JSON Lines file, one object per row.
+    Blobs are written as base64 strings.
+
+    Returns:
+        The number of rows written.
+    """
+    count = 0
+    encoder = json.JSONEncoder(ensure_ascii=False, default=_json_value)
+    with open(path, "w", encoding="utf-8") as f:
+        for rows in batches:
+            f.writelines(encoder.encode(dict(zip(columns, row))) + "\n" for row in rows)
+            count += len(rows)
+    return count
+
+
+def _arrow_type(values: List[object]):
+    """Infer the Arrow type of a column from its first batch of values."""
+    import pyarrow as pa
+
+    kinds = {type(value) for value in values if value is not None}
+    if not kinds:
+        return pa.string()
+    if kinds == {int}:
+        return pa.int64()
+    if kinds <= {int, float}:
+        return pa.float64()
+    if kinds == {bytes}:
+        return pa.binary()
+    return pa.string()
+
+
+def write_parquet(path: str, columns: List[str], batches: Iterable[List[tuple]]) -> int:
+    """Write batches of rows to a Parquet file, one row group per batch.
+
+    Returns:
+        The number of rows written.
+
+    Raises:
+        ValueError: If a later batch holds a value that does not fit the
+            column type inferred from the first batch.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    count = 0
+    writer = None
+    try:
+        for rows in batches:
+            values = list(zip(*rows))
+            if writer is None:
+                schema = pa.schema([pa.field(name, _arrow_type(list(column)))
+                                    for name, column in zip(columns, values)])
+                writer = pq.ParquetWriter(path, schema)
+            arrays = []
+            for field, column in zip(schema, values):
+                if field.type == pa.string():
+                    column = [None if value is None else str(value) for value in column]
+                try:
+                    arrays.append(pa.array(column, type=field.type))
+                except (pa.ArrowInvalid, pa.ArrowTypeError) as exc:
+                    raise ValueError(f"column {field.name!r} does not fit {field.type}: {exc}")
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+            count += len(rows)
+        if writer is None:
+            schema = pa.schema([pa.field(name, pa.string()) for name in columns])
+            writer = pq.ParquetWriter(path, schema)
+    finally:
+        if writer is not None:
+            writer.close()
+    return count
+
+
+# Output format name -> writer; the name is also the file extension.
+WRITERS: Dict[str, Callable[[str, List[str], Iterable[List[tuple]]], int]] = {
+    "csv": write_csv,
+    "jsonl": write_jsonl,
+    "parquet": write_parquet,
+}
+
+
+class ExportResult(NamedTuple):
+    """Outcome of exporting one lesson's result."""
+
+    slug: str
+    path: Optional[str]
+    rows: int
+    size_bytes: int
+    elapsed: float
+    peak_rss_kib: int
+    error: Optional[str]
+
+
+def peak_rss_kib() -> int:
+    """Return the peak resident set size of this process, in KiB."""
+    import resource
+
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in KiB on Linux and in bytes on macOS.
+    return maxrss // 1024 if sys.platform == "darwin" else maxrss
+
+
+def export_lesson(conn: sqlite3.Connection, lesson: Dict[str, str], output_dir: str,
+                  fmt: str = "csv", batch_size: int = DEFAULT_BATCH_SIZE) -> ExportResult:
+    """Stream the full result of a lesson's last query to a file.
+
+    Args:
+        conn: SQLite connection object.
+        lesson: Lesson definition, see `generate_lessons.get_lessons`.
+        output_dir: Directory the file is written to, as `<slug>.<fmt>`.
+        fmt: One of the keys of `WRITERS`.
+        batch_size: Rows fetched and written at a time.
+
+    Returns:
+        The file written, the number of rows and bytes, the wall time in
+        seconds and the process peak RSS afterwards. If the query fails
+        the error message is set and no file is kept.
+    """
+    slug = lesson["slug"]
+    path = os.path.join(output_dir, f"{slug}.{fmt}")
+    start = time.perf_counter()
+    try:
+        columns, batches = stream_script(conn, lesson["query"], batch_size)
+        rows = WRITERS[fmt](path, columns, batches)
+    except (sqlite3.Error, ValueError) as exc:
+        if os.path.exists(path):
+            os.remove(path)
+        return ExportResult(slug, None, 0, 0, time.perf_counter() - start, peak_rss_kib(), str(exc))
+    elapsed = time.perf_counter() - start
+    return ExportResult(slug, path, rows, os.path.getsize(path), elapsed, peak_rss_kib(), None)
+
+
+def format_results(results: List[ExportResult]) -> str:
+    """Render export results as a Markdown table."""
+    rows = []
+    for result in results:
+        if result.error:
+            rows.append((result.slug, result.error, None, None, None, None, None))
+            continue
+        seconds = max(result.elapsed, 1e-9)
+        rows.append((
+            result.slug,
+            os.path.basename(result.path),
+            result.rows,
+            round(result.size_bytes / 1024 / 1024, 3),
+            round(result.rows / seconds),
+            round(result.size_bytes / 1024 / 1024 / seconds, 1),
+            round(result.peak_rss_kib / 1024, 1),
+        ))
+    return rows_to_markdown(["Lesson", "File", "Rows", "MiB", "Rows/s", "MiB/s", "Peak RSS MiB"], rows)
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Export the full result of every lesson query.")
+    parser.add_argument("--db", default=DEFAULT_DB_PATH,
+                        help="path to the Chinook SQLite database")
+    parser.add_argument("--output-dir", default="exports",
+                        help="directory the exported files are written to")
+    parser.add_argument("--format", choices=sorted(WRITERS), default="csv",
+                        help="output file format; parquet requires pyarrow")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                        help="rows fetched from SQLite and written at a time")
+    args = parser.parse_args(argv)
+    require_database(args.db)
+
+    if args.format == "parquet":
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            parser.error("--format parquet requires the pyarrow package")
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    conn = connect_read_only(args.db)
+    try:
+        results = [export_lesson(conn, lesson, args.output_dir, args.format, args.batch_size)
+                   for lesson in get_lessons() if lesson.get("run", True)]
+    finally:
+        conn.close()
+    print(format_results(results))
+
+
+if __name__ == '__main__':
+    main()
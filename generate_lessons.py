@@ -4,8 +4,8 @@ using the Chinook sample database. Each lesson covers a specific SQL
 concept or query type. The script connects to the local `chinook.db`
 database, executes the example queries where appropriate, and writes
 the results into corresponding lesson files under the `lessons`
-directory. Lessons that modify data are illustrated but not executed
-against the database to avoid side effects.
+directory. Lessons that modify data are never executed against the
+database itself, to avoid side effects.
 
 Run this script from the root of the project directory:
 
@@ -14,20 +14,222 @@ Run this script from the root of the project directory:
 It will populate the `lessons` directory with numbered Markdown
 documents. Each document contains a title, a brief explanation of the
 concept, the SQL query, and a sample result where applicable.
+
+Only the rows shown in a sample table are read from SQLite. Pass
+`--count-rows` to also report the total size of each result set, which
+costs one extra `COUNT(*)` query per lesson. Pass `--jobs N` to run
+the lesson queries on N threads, each with its own read-only
+connection; the generated files are identical to a serial run.
+
+Lessons are cached: a manifest in the lessons directory remembers a
+hash of each lesson definition, the database file and the generator
+version, and unchanged lessons are skipped on the next run. Pass
+`--force` to regenerate everything.
+
+Pass `--execute-mutating` to also run the data-modifying lessons. They
+run on an in-memory copy of the database, each inside a savepoint that
+is rolled back, and their lesson files show the rows affected and the
+result of their final query.
+
+Every lesson query runs under a budget: `--timeout` (60 seconds by
+default), `--max-steps` (SQLite virtual machine instructions) and
+`--max-rows` (rows fetched or counted). A query that goes over is
+interrupted, its lesson file says so, and the run lists it and exits
+with status 1.
+
+The lesson definitions live in the lesson catalog, one TOML file per
+lesson under `catalog/` (see `lesson_catalog.py`). Pass `--only SLUG
+...` or `--tag TAG ...` to load and generate just those lessons, e.g.
+`--only 17_inner_join` or `--tag joins`.
+
+Every read-only connection is tuned for reading (see
+`tune_read_only`): the file is memory-mapped, the page cache is larger
+and temporary results stay in memory. Pass `--immutable` to also skip
+SQLite's file locking and change detection when nothing else writes to
+the database during the run.
+
+Pass `--suggest-rewrites` to add, under the sample result of each
+lesson, equivalent rewrites of query patterns that scale badly and how
+they compare on the database (see `query_rewrites.py`).
+
+Pass `--trace FILE` to record, for every distinct statement the run
+executes, its count, latency histogram and SQLite VM steps, and write
+them as JSON (a `.json` file) or in the Prometheus text format (see
+`sql_trace.py`).
+
+Pass `--watch` to keep the generator running while you author lessons:
+it polls the database and the catalog and regenerates only the lessons
+affected by each change (see `lesson_watch.py`).
 """
 
+import argparse
+import hashlib
+import json
 import os
+import queue
+import re
 import sqlite3
+import sys
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing, contextmanager
+from pathlib import Path
 from textwrap import dedent
-from typing import List, Dict
+from typing import TYPE_CHECKING, Callable, Iterator, List, Dict, NamedTuple, Optional, Sequence, Tuple
+
+from lesson_catalog import load_lessons, load_requirements
+from lesson_sql import normalize_sql, strip_sql
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+
+# Default locations of the database and the generated lessons.
+DEFAULT_DB_PATH = 'chinook.db'
+DEFAULT_LESSON_DIR = 'lessons'
+
+# Bump whenever a change to this script alters the generated Markdown,
+# so that cached lessons are regenerated.
+GENERATOR_VERSION = "5"
+
+# Name of the cache manifest kept next to the generated lessons.
+MANIFEST_NAME = ".manifest.json"
+
+# Lesson definition fields that determine the generated file.
+LESSON_FIELDS = ("slug", "title", "description", "query", "requires")
+
+# Text shown in sample tables for SQL NULL values.
+NULL_TEXT = "NULL"
+
+# Prepared statements kept per connection; the sqlite3 default is 128.
+STATEMENT_CACHE_SIZE = 512
+
+# Page cache of a read-only connection, in KiB; the SQLite default is
+# about 2 MiB.
+READ_CACHE_KIB = 64 * 1024
+
+# Largest part of a database file a read-only connection memory-maps.
+MAX_MMAP_BYTES = 1024 * 1024 * 1024
+
+# Default memory budget of a `ResultCache`.
+DEFAULT_RESULT_CACHE_BYTES = 8 * 1024 * 1024
+
+# Default seconds between two checks for changes in watch mode.
+DEFAULT_WATCH_INTERVAL = 0.5
+
+# Default wall time a lesson query may run for, in seconds.
+DEFAULT_TIMEOUT = 60.0
+
+# SQLite virtual machine instructions between two budget checks.
+BUDGET_CHECK_INTERVAL = 1000
+
+_NUMERIC_TYPES = frozenset((int, float))
+
+# Called with every connection `connect_read_only` opens, e.g. to attach
+# a `sql_trace.SQLTracer`.
+CONNECTION_HOOKS: List[Callable[[sqlite3.Connection], None]] = []
+
+# Progress listeners by connection, see `set_progress_listener`. Entries
+# go away with their connection.
+_PROGRESS_LISTENERS: "weakref.WeakKeyDictionary[sqlite3.Connection, Callable[[], None]]" = \
+    weakref.WeakKeyDictionary()
+
+
+def escape_cell(text: str) -> str:
+    """Escape characters that would break a Markdown table cell. Pipes
+    are backslash-escaped and line breaks are rendered as `<br>`.
+
+    Args:
+        text: The cell text to escape.
+
+    Returns:
+        The escaped cell text.
+    """
+    if '|' in text:
+        text = text.replace('|', '\\|')
+    if '\n' in text or '\r' in text:
+        text = text.replace('\r\n', '<br>').replace('\r', '<br>').replace('\n', '<br>')
+    return text
 
-import pandas as pd
+
+def _escape_column(cells: List[str]) -> List[str]:
+    """Escape a whole column of cell text at once. The cells are joined
+    into one string so the common case (nothing to escape) costs a
+    single scan instead of one call per cell.
+    """
+    joined = '\0'.join(cells)
+    if '|' not in joined and '\n' not in joined and '\r' not in joined:
+        return cells
+    if joined.count('\0') != len(cells) - 1:
+        # A cell contains the separator itself; escape cell by cell.
+        return [escape_cell(cell) for cell in cells]
+    return escape_cell(joined).split('\0')
+
+
+def _format_column(values: Sequence) -> Tuple[List[str], bool]:
+    """Format one column of raw SQLite values as Markdown cell text.
+
+    Args:
+        values: The values of a single result column.
+
+    Returns:
+        A tuple of the formatted cells and whether the column is numeric.
+    """
+    types = set(map(type, values))
+    has_null = type(None) in types
+    types.discard(type(None))
+    numeric = bool(types) and types <= _NUMERIC_TYPES
+    if has_null:
+        cells = [NULL_TEXT if value is None else str(value) for value in values]
+    else:
+        cells = list(map(str, values))
+    if not numeric:
+        cells = _escape_column(cells)
+    return cells, numeric
+
+
+def _render_table(headers: Sequence[str], columns: Sequence[List[str]],
+                  numeric: Sequence[bool]) -> str:
+    """Join already formatted columns into a Markdown table. Numeric
+    columns are right aligned, everything else is left aligned.
+    """
+    header = '| ' + ' | '.join(escape_cell(str(col)) for col in headers) + ' |'
+    separator = '| ' + ' | '.join('---:' if flag else '---' for flag in numeric) + ' |'
+    lines = [header, separator]
+    if columns and columns[0]:
+        lines.append('| ' + ' |\n| '.join(map(' | '.join, zip(*columns))) + ' |')
+    return '\n'.join(lines)
+
+
+def rows_to_markdown(columns: Sequence[str], rows: Sequence[tuple]) -> str:
+    """Convert raw cursor rows to a Markdown table. The rows are
+    transposed and every column is formatted in a single pass, so no
+    intermediate DataFrame is needed.
+
+    Args:
+        columns: Column names, usually taken from `cursor.description`.
+        rows: Row tuples as returned by `cursor.fetchall()`.
+
+    Returns:
+        A string containing the Markdown table.
+    """
+    if rows:
+        formatted = [_format_column(values) for values in zip(*rows)]
+    else:
+        formatted = [([], False) for _ in columns]
+    return _render_table(columns, [cells for cells, _ in formatted],
+                         [flag for _, flag in formatted])
 
 
-def df_to_markdown(df: pd.DataFrame) -> str:
+def df_to_markdown(df: "pd.DataFrame") -> str:
     """Convert a pandas DataFrame to a simple Markdown table without relying
     on external dependencies. Each column becomes a header and rows are
-    separated by vertical bars. Indices are omitted.
+    separated by vertical bars. Indices are omitted. Columns are
+    formatted with vectorized string operations and missing values are
+    shown as `NULL`.
 
     Args:
         df: The DataFrame to convert.
@@ -35,640 +237,1150 @@ def df_to_markdown(df: pd.DataFrame) -> str:
     Returns:
         A string containing the Markdown table.
     """
-    # Build header row
-    header_cells = [str(col) for col in df.columns]
-    header = '| ' + ' | '.join(header_cells) + ' |'
-    # Build separator row (align left)
-    separator = '| ' + ' | '.join(['---' for _ in df.columns]) + ' |'
-    # Build data rows
-    rows = []
-    for _, row in df.iterrows():
-        cells = [str(cell) for cell in row]
-        rows.append('| ' + ' | '.join(cells) + ' |')
-    return '\n'.join([header, separator] + rows)
+    import pandas as pd
+
+    cells = []
+    numeric = []
+    for _, series in df.items():
+        is_numeric = (pd.api.types.is_numeric_dtype(series)
+                      and not pd.api.types.is_bool_dtype(series))
+        text = series.astype(str).tolist()
+        for position in series.isna().to_numpy().nonzero()[0]:
+            text[position] = NULL_TEXT
+        if not is_numeric:
+            text = _escape_column(text)
+        cells.append(text)
+        numeric.append(is_numeric)
+    return _render_table(list(df.columns), cells, numeric)
+
+
+def split_statements(script: str) -> List[str]:
+    """Split a SQL script into individual statements.
+
+    Candidate boundaries are the semicolons in the script; a candidate is
+    accepted once `sqlite3.complete_statement` agrees that it ends a
+    statement, so semicolons inside string literals, comments or
+    trigger bodies do not split it. Chunks that hold only comments are
+    dropped.
+
+    Args:
+        script: One or more SQL statements.
+
+    Returns:
+        The statements in order, without surrounding whitespace.
+    """
+    statements = []
+    start = 0
+    for match in re.finditer(';', script):
+        candidate = script[start:match.end()]
+        if sqlite3.complete_statement(candidate):
+            if strip_sql(candidate).strip(' \t\r\n;'):
+                statements.append(candidate.strip())
+            start = match.end()
+    tail = script[start:]
+    if strip_sql(tail).strip():
+        statements.append(tail.strip())
+    return statements
+
+
+# Statements whose rows are worth showing. `cursor.description` alone is
+# not enough: SQLite reports a result column for some ALTER TABLE forms.
+_QUERY = re.compile(r"^\s*(SELECT|WITH|VALUES|PRAGMA|EXPLAIN)\b|\bRETURNING\b", re.IGNORECASE)
+
+
+def is_query(statement: str) -> bool:
+    """Return whether a statement produces a result set to display."""
+    return bool(_QUERY.search(strip_sql(statement)))
+
+
+class BudgetExceeded(Exception):
+    """Raised when a lesson query goes over its `QueryBudget`.
+
+    It deliberately does not derive from `sqlite3.Error`, so handlers
+    that skip queries SQLite cannot run do not swallow it.
+    """
+
+
+class QueryBudget:
+    """Limits a lesson query must stay within.
+
+    Time and virtual machine steps are enforced by a progress handler
+    (see `guard_query`) that interrupts the running statement; the row
+    budget caps the rows a script may fetch or count. `exceeded` maps
+    each lesson whose latest render went over to the reason; an entry is
+    dropped when the lesson is rendered again, so it stays bounded by
+    the number of lessons in long-running processes.
+
+    Args:
+        timeout: Wall time in seconds, or None for no limit.
+        max_steps: SQLite virtual machine instructions, or None for no
+            limit. Checked every `BUDGET_CHECK_INTERVAL` instructions, so
+            it is enforced in whole intervals.
+        max_rows: Rows fetched or counted, or None for no limit.
+    """
+
+    def __init__(self, timeout: Optional[float] = DEFAULT_TIMEOUT, max_steps: Optional[int] = None,
+                 max_rows: Optional[int] = None) -> None:
+        self.timeout = timeout
+        self.max_steps = max_steps
+        self.max_rows = max_rows
+        self.exceeded: Dict[str, str] = {}
+
+    def reset(self, slug: str) -> None:
+        """Forget that a lesson went over the budget, before it runs again."""
+        self.exceeded.pop(slug, None)
+
+    def record(self, slug: str, exc: BudgetExceeded) -> None:
+        """Remember that a lesson went over the budget."""
+        self.exceeded[slug] = str(exc)
+
+
+class LessonConnection(sqlite3.Connection):
+    """The connections `connect_read_only` opens. Unlike a plain
+    `sqlite3.Connection`, they can be weakly referenced, so state kept
+    per connection goes away with it.
+    """
+
+
+def set_progress_listener(conn: sqlite3.Connection, listener: Optional[Callable[[], None]]) -> None:
+    """Have SQLite call `listener` every `BUDGET_CHECK_INTERVAL` VM steps
+    of the statements run on `conn`, or remove it if None.
+
+    A connection has a single progress handler, so the listener is
+    called from the budget check of `guard_query` while a budget is in
+    force and reinstalled afterwards.
+
+    Raises:
+        TypeError: If a listener is given for a connection that cannot
+            be weakly referenced; open it with `connect_read_only` or
+            `sqlite3.connect(..., factory=LessonConnection)`.
+    """
+    if listener is None:
+        if progress_listener(conn) is not None:
+            del _PROGRESS_LISTENERS[conn]
+        conn.set_progress_handler(None, 0)
+    else:
+        try:
+            _PROGRESS_LISTENERS[conn] = listener
+        except TypeError:
+            raise TypeError("progress listeners need a connection opened with "
+                            "factory=LessonConnection, e.g. by connect_read_only") from None
+        conn.set_progress_handler(listener, BUDGET_CHECK_INTERVAL)
+
+
+def progress_listener(conn: sqlite3.Connection) -> Optional[Callable[[], None]]:
+    """Return the listener set with `set_progress_listener`, if any."""
+    try:
+        return _PROGRESS_LISTENERS.get(conn)
+    except TypeError:
+        # A plain sqlite3.Connection, which cannot have one.
+        return None
+
+
+@contextmanager
+def guard_query(conn: sqlite3.Connection, budget: Optional[QueryBudget]) -> Iterator[None]:
+    """Enforce the time and step limits of a budget on the statements run
+    on `conn` inside the block.
+
+    The connection's progress handler is replaced for the duration of
+    the block, calling any listener set with `set_progress_listener`,
+    and is itself the connection's listener meanwhile, so code that
+    chains listeners keeps the budget in force. When a limit is hit, the
+    handler makes SQLite abort the running statement, and the resulting
+    `sqlite3.OperationalError` is turned into `BudgetExceeded`.
+
+    Raises:
+        BudgetExceeded: If a limit was hit.
+    """
+    if budget is None or (budget.timeout is None and budget.max_steps is None):
+        yield
+        return
+    deadline = None if budget.timeout is None else time.monotonic() + budget.timeout
+    max_checks = None if budget.max_steps is None else budget.max_steps // BUDGET_CHECK_INTERVAL
+    checks = 0
+    reason = None
+    listener = progress_listener(conn)
+
+    def check() -> int:
+        nonlocal checks, reason
+        if listener is not None:
+            listener()
+        checks += 1
+        if max_checks is not None and checks > max_checks:
+            reason = f"step budget of {budget.max_steps} VM steps"
+        elif deadline is not None and time.monotonic() > deadline:
+            reason = f"time budget of {budget.timeout:g} s"
+        return reason is not None
+
+    try:
+        set_progress_listener(conn, check)
+    except TypeError:
+        # A plain sqlite3.Connection, which cannot have a listener.
+        conn.set_progress_handler(check, BUDGET_CHECK_INTERVAL)
+    try:
+        yield
+    except sqlite3.OperationalError as exc:
+        if reason is not None:
+            raise BudgetExceeded(f"exceeded its {reason}") from exc
+        raise
+    finally:
+        set_progress_listener(conn, listener)
+
+
+def execute_script(conn: sqlite3.Connection, script: str, limit: Optional[int] = 5,
+                   count_total: bool = False,
+                   max_rows: Optional[int] = None) -> Tuple[List[str], List[tuple], Optional[int]]:
+    """Run a SQL script statement by statement on one cursor and keep
+    the first rows of its last query.
+
+    Only `limit` rows of the last query are read from the cursor, so
+    queries without a `LIMIT` clause (e.g. a `CROSS JOIN`) are never
+    fully materialized just to show a short preview. Statements after
+    the last query still run.
+
+    Args:
+        conn: SQLite connection object.
+        script: One or more SQL statements, see `split_statements`.
+        limit: Maximum number of rows to fetch from the last query, or
+            None to fetch all of them.
+        count_total: Whether to also count every row of the last query
+            with a `COUNT(*)` run right after it.
+        max_rows: Maximum number of rows the last query may return when
+            all of them are fetched or counted, or None for no limit.
+
+    Returns:
+        The column names and fetched rows of the last query, and its
+        total row count if `count_total` is set (otherwise None). The
+        column list is empty if no statement of the script is a query.
+
+    Raises:
+        sqlite3.Error: If a statement fails.
+        BudgetExceeded: If the last query returns more than `max_rows`
+            rows and they are all fetched or counted.
+    """
+    statements = split_statements(script)
+    queries = [index for index, statement in enumerate(statements) if is_query(statement)]
+    last_query = queries[-1] if queries else None
+    columns: List[str] = []
+    rows: List[tuple] = []
+    total = None
+    cursor = conn.cursor()
+    try:
+        for index, statement in enumerate(statements):
+            cursor.execute(statement)
+            if index == last_query and cursor.description is not None:
+                columns = [desc[0] for desc in cursor.description]
+                if limit is None:
+                    rows = cursor.fetchall() if max_rows is None else cursor.fetchmany(max_rows + 1)
+                else:
+                    rows = cursor.fetchmany(limit)
+                if count_total:
+                    total = count_result_rows(conn, statement, max_rows)
+                # A preview is cut short by `limit`, so only the complete
+                # result counts against the budget.
+                seen = max(len(rows) if limit is None else 0, total or 0)
+                if max_rows is not None and seen > max_rows:
+                    raise BudgetExceeded(f"exceeded its row budget of {max_rows} rows")
+    finally:
+        cursor.close()
+    return columns, rows, total
+
+
+def stream_script(conn: sqlite3.Connection, script: str,
+                  batch_size: int = 1000) -> Tuple[List[str], Iterator[List[tuple]]]:
+    """Run a SQL script like `execute_script`, but hand out every row of
+    its last query in batches instead of a fixed-size preview.
+
+    The statements up to and including the last query run immediately.
+    Rows are then fetched `batch_size` at a time as the returned
+    iterator is consumed, so only one batch is held in memory, and the
+    statements after the last query run once it is exhausted.
+
+    Args:
+        conn: SQLite connection object.
+        script: One or more SQL statements, see `split_statements`.
+        batch_size: Number of rows per batch.
+
+    Returns:
+        The column names of the last query and an iterator over lists of
+        at most `batch_size` rows.
+
+    Raises:
+        ValueError: If no statement of the script is a query.
+        sqlite3.Error: If a statement fails.
+    """
+    statements = split_statements(script)
+    queries = [index for index, statement in enumerate(statements) if is_query(statement)]
+    if not queries:
+        raise ValueError("the script has no query")
+    last_query = queries[-1]
+    cursor = conn.cursor()
+    try:
+        for statement in statements[:last_query + 1]:
+            cursor.execute(statement)
+        columns = [desc[0] for desc in cursor.description or ()]
+    except BaseException:
+        cursor.close()
+        raise
+
+    def batches() -> Iterator[List[tuple]]:
+        try:
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield rows
+            for statement in statements[last_query + 1:]:
+                cursor.execute(statement)
+        finally:
+            cursor.close()
+
+    return columns, batches()
 
 
-def fetch_sample_results(conn: sqlite3.Connection, query: str, limit: int = 5) -> str:
+def count_result_rows(conn: sqlite3.Connection, query: str, max_rows: Optional[int] = None) -> int:
+    """Count the rows a query returns without fetching them into Python.
+
+    Args:
+        conn: SQLite connection object.
+        query: SQL query to count. A trailing semicolon is ignored.
+        max_rows: If given, stop counting after `max_rows + 1` rows.
+
+    Returns:
+        The total number of rows in the result set, or `max_rows + 1`
+        if there are more than `max_rows`.
+    """
+    clean_query = query.strip().rstrip(';')
+    # The newline keeps a trailing `--` comment from swallowing the `)`.
+    if max_rows is not None:
+        clean_query = f"SELECT 1 FROM ({clean_query}\n) LIMIT {int(max_rows) + 1}"
+    return conn.execute(f"SELECT COUNT(*) FROM ({clean_query}\n)").fetchone()[0]
+
+
+class ResultCache:
+    """A least-recently-used cache of rendered sample results.
+
+    Entries are keyed by the database file, its `PRAGMA data_version`,
+    the normalized query text (see `lesson_sql.normalize_sql`) and the
+    sampling options. The data version is read on a private read-only
+    connection per database file: it changes whenever any other
+    connection, in this process or another, commits to the file, so a
+    write to the database invalidates every entry made before it.
+    In-memory databases and connections with an open transaction are
+    never cached.
+
+    The cache may be shared between threads and connections.
+
+    Args:
+        max_bytes: Approximate memory budget. The least recently used
+            entries are evicted once the cached keys and results exceed
+            it.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_RESULT_CACHE_BYTES) -> None:
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[tuple, Tuple[str, int]]" = OrderedDict()
+        self._watchers: Dict[str, sqlite3.Connection] = {}
+        self._versions: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def _version(self, conn: sqlite3.Connection) -> Optional[Tuple[str, int]]:
+        """Return the database file and data version `conn` reads from,
+        or None if its results must not be cached. Call with the lock
+        held.
+        """
+        if conn.in_transaction:
+            return None
+        path = conn.execute("PRAGMA database_list").fetchone()[2]
+        if not path:
+            return None
+        watcher = self._watchers.get(path)
+        if watcher is None:
+            watcher = self._watchers[path] = connect_read_only(path, tuned=False)
+        version = watcher.execute("PRAGMA data_version").fetchone()[0]
+        if self._versions.setdefault(path, version) != version:
+            self._versions[path] = version
+            self._drop(path)
+        return path, version
+
+    def _drop(self, path: str) -> None:
+        for key in [key for key in self._entries if key[0] == path]:
+            self.size -= self._entries.pop(key)[1]
+
+    def get_or_compute(self, conn: sqlite3.Connection, query: str, limit: int,
+                       count_total: bool, compute: Callable[[], str]) -> str:
+        """Return the cached result of a query, calling `compute` to
+        produce and store it on a miss.
+        """
+        with self._lock:
+            version = self._version(conn)
+            if version is None:
+                self.misses += 1
+                return compute()
+            key = version + (normalize_sql(query), limit, count_total)
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+        # Run the query outside the lock so other threads are not held up.
+        value = compute()
+        size = sys.getsizeof(value) + sys.getsizeof(key[2])
+        if size > self.max_bytes:
+            return value
+        with self._lock:
+            if self._versions.get(key[0]) != key[1] or key in self._entries:
+                return value
+            self._entries[key] = (value, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.size -= evicted
+        return value
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def close(self) -> None:
+        """Drop every entry and close the data version connections."""
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+            for watcher in self._watchers.values():
+                watcher.close()
+            self._watchers.clear()
+            self._versions.clear()
+
+
+def fetch_sample_results(conn: sqlite3.Connection, query: str, limit: int = 5,
+                         count_total: bool = False, cache: Optional[ResultCache] = None,
+                         budget: Optional[QueryBudget] = None) -> str:
     """Execute a query and return a Markdown-formatted table of the first
-    few rows of the result set. If the query fails (e.g. for DDL
-    statements), an empty string is returned.
+    few rows of the result set. The query may be a script of several
+    statements, in which case the result of the last query is shown
+    (see `execute_script`). If the query fails or returns no result set
+    (e.g. for DDL statements), an empty string is returned.
 
     Args:
         conn: SQLite connection object.
-        query: SQL query to execute.
+        query: SQL query or script to execute.
         limit: Maximum number of rows to include in the output.
+        count_total: Whether to run an extra `COUNT(*)` over the query
+            and report the total number of rows below the table.
+        cache: If given, the result is looked up in and stored in this
+            cache instead of always running the query.
+        budget: Optional limits the query must stay within.
 
     Returns:
         A string containing a Markdown table representation of the
         query result, or an empty string if no sample should be
         provided.
+
+    Raises:
+        BudgetExceeded: If the query goes over `budget`.
     """
+    if cache is not None:
+        return cache.get_or_compute(
+            conn, query, limit, count_total,
+            lambda: fetch_sample_results(conn, query, limit, count_total, budget=budget))
+    max_rows = budget.max_rows if budget is not None else None
     try:
-        # Strip trailing semicolons to avoid errors when executing via pandas.
-        clean_query = query.strip().rstrip(';')
-        # Use pandas to run the query and fetch a small number of rows.
-        df = pd.read_sql_query(clean_query, conn)
-        if df.empty:
+        # Read only the rows we are going to show straight from the cursor.
+        with guard_query(conn, budget):
+            columns, rows, total = execute_script(conn, query, limit, count_total, max_rows)
+        if not columns:
+            return ""
+        if not rows:
             return "_No rows returned._"
-        if len(df) > limit:
-            df = df.head(limit)
-        # Convert DataFrame to a Markdown table without external dependencies.
-        return df_to_markdown(df)
-    except Exception:
+        table = rows_to_markdown(columns, rows)
+        if count_total:
+            table += f"\n\n_Showing {len(rows)} of {total} rows._"
+        return table
+    except sqlite3.Error:
         # For queries that cannot be executed (e.g. inserts/updates) we skip.
         return ""
 
 
-def generate_lessons(db_path: str, lessons: List[Dict[str, str]], lesson_dir: str) -> None:
+def read_dataframe(conn: sqlite3.Connection, query: str,
+                   limit: Optional[int] = None) -> "pd.DataFrame":
+    """Run a query or script and return the result of its last query as
+    a pandas DataFrame. pandas is imported on first use, so the rest of
+    the generator works without it.
+
+    Args:
+        conn: SQLite connection object.
+        query: SQL query or script to execute, see `execute_script`.
+        limit: Maximum number of rows to read, or None for all of them.
+
+    Returns:
+        A DataFrame with the column names from `cursor.description`.
+    """
+    import pandas as pd
+
+    columns, rows, _ = execute_script(conn, query, limit)
+    return pd.DataFrame.from_records(rows, columns=columns, coerce_float=True)
+
+
+# Statements that manage transactions themselves and therefore cannot
+# run inside the savepoint a scratch database wraps around a script.
+_TRANSACTION_CONTROL = re.compile(r"^\s*(BEGIN|COMMIT|END|ROLLBACK|SAVEPOINT|RELEASE)\b", re.IGNORECASE)
+
+
+def required_scripts(lesson: Dict[str, str], lessons_by_slug: Dict[str, Dict[str, str]]) -> List[str]:
+    """Return the scripts of the lessons a lesson builds on, in the order
+    they must run. Lessons list their prerequisites by slug under the
+    optional `requires` key, e.g. the UPDATE lesson needs the table the
+    INSERT lesson creates.
+
+    Raises:
+        KeyError: If a required lesson does not exist.
+    """
+    scripts: List[str] = []
+    seen = set()
+
+    def visit(current: Dict[str, str]) -> None:
+        for slug in current.get("requires", ()):
+            if slug in seen:
+                continue
+            seen.add(slug)
+            required = lessons_by_slug[slug]
+            visit(required)
+            scripts.append(required["query"])
+
+    visit(lesson)
+    return scripts
+
+
+class ScratchResult(NamedTuple):
+    """Outcome of running a lesson script on a scratch database."""
+
+    slug: str
+    rows_affected: int
+    elapsed: float
+    columns: List[str]
+    rows: List[tuple]
+    error: Optional[str]
+
+
+class ScratchDatabase:
+    """An in-memory copy of the lesson database for lessons that change
+    data or schema.
+
+    The copy is made once with the `sqlite3` backup API the first time a
+    lesson runs, and every script then runs inside a savepoint that is
+    rolled back afterwards, so each lesson sees the original data. A
+    script that manages its own transaction (e.g. `BEGIN ... ROLLBACK`)
+    cannot be nested in a savepoint; after such a script the working
+    copy is restored from a pristine in-memory snapshot instead. The
+    source database file is never written to.
+
+    The scripts of required lessons (see `required_scripts`) run first in
+    the same savepoint; they are not included in the timing or in the
+    number of rows affected.
+
+    Args:
+        db_path: Path to the SQLite database to copy.
+        limit: Maximum number of rows kept from the last statement that
+            returns rows.
+        budget: Optional limits each lesson script must stay within. A
+            script that goes over is stopped, rolled back and reported
+            as failed.
+    """
+
+    def __init__(self, db_path: str, limit: int = 5, budget: Optional[QueryBudget] = None) -> None:
+        self.db_path = db_path
+        self.limit = limit
+        self.budget = budget
+        self.results: List[ScratchResult] = []
+        self.lessons_by_slug: Dict[str, Dict[str, str]] = {}
+        self._pristine: Optional[sqlite3.Connection] = None
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def _load(self) -> None:
+        source = connect_read_only(self.db_path)
+        try:
+            self._pristine = sqlite3.connect(":memory:", check_same_thread=False)
+            source.backup(self._pristine)
+        finally:
+            source.close()
+        self._conn = sqlite3.connect(":memory:", isolation_level=None, check_same_thread=False)
+        self._pristine.backup(self._conn)
+
+    def register(self, lessons: List[Dict[str, str]]) -> None:
+        """Make lessons available as prerequisites of other lessons."""
+        self.lessons_by_slug.update((lesson["slug"], lesson) for lesson in lessons)
+
+    def run(self, lesson: Dict[str, str]) -> ScratchResult:
+        """Run a lesson script on the scratch copy and undo its changes.
+
+        Args:
+            lesson: Lesson definition, see `generate_lessons`.
+
+        Returns:
+            The number of rows the script inserted, updated or deleted,
+            its wall time in seconds, the first rows of the last
+            statement that returned rows, and the error message if a
+            statement failed.
+        """
+        with self._lock:
+            if self._conn is None:
+                self._load()
+            conn = self._conn
+            slug = lesson["slug"]
+            columns: List[str] = []
+            rows: List[tuple] = []
+            error = None
+            try:
+                setup = [stmt for script in required_scripts(lesson, self.lessons_by_slug)
+                         for stmt in split_statements(script)]
+            except KeyError as exc:
+                result = ScratchResult(slug, 0, 0.0, columns, rows, f"unknown required lesson {exc}")
+                self.results.append(result)
+                return result
+            manages_transaction = any(_TRANSACTION_CONTROL.match(strip_sql(stmt))
+                                      for stmt in setup + split_statements(lesson["query"]))
+            if not manages_transaction:
+                conn.execute("SAVEPOINT lesson")
+            changes_before = conn.total_changes
+            start = time.perf_counter()
+            try:
+                with guard_query(conn, self.budget):
+                    for statement in setup:
+                        conn.execute(statement)
+                    changes_before = conn.total_changes
+                    start = time.perf_counter()
+                    columns, rows, _ = execute_script(conn, lesson["query"], self.limit)
+            except BudgetExceeded as exc:
+                self.budget.record(slug, exc)
+                error = f"the script {exc}"
+            except sqlite3.Error as exc:
+                error = str(exc)
+            elapsed = time.perf_counter() - start
+            rows_affected = conn.total_changes - changes_before
+            if manages_transaction:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                self._pristine.backup(conn)
+            elif conn.in_transaction:
+                conn.execute("ROLLBACK TO lesson")
+                conn.execute("RELEASE lesson")
+            # Otherwise an interrupted statement already rolled back the
+            # whole transaction, savepoint included.
+            result = ScratchResult(slug, rows_affected, elapsed, columns, rows, error)
+            self.results.append(result)
+            return result
+
+    def close(self) -> None:
+        """Release the in-memory copies."""
+        for conn in (self._conn, self._pristine):
+            if conn is not None:
+                conn.close()
+        self._conn = self._pristine = None
+
+
+def format_scratch_result(result: ScratchResult) -> str:
+    """Render a scratch run as Markdown for a lesson file. Timings are
+    left out so the generated file stays deterministic.
+    """
+    if result.error:
+        return f"_The example failed on a scratch copy of the database: {result.error}_"
+    noun = "row" if result.rows_affected == 1 else "rows"
+    parts = [f"_{result.rows_affected} {noun} affected._"]
+    if result.columns:
+        parts.append(rows_to_markdown(result.columns, result.rows) if result.rows
+                     else "_No rows returned._")
+    return "\n\n".join(parts)
+
+
+def tune_read_only(conn: sqlite3.Connection, db_path: str) -> None:
+    """Apply the read-optimized pragmas to a connection.
+
+    The database file is memory-mapped up to its current size (at most
+    `MAX_MMAP_BYTES`), so pages are read straight from the OS page cache
+    instead of being copied, the page cache grows to `READ_CACHE_KIB`,
+    temporary B-trees for sorting and grouping stay in memory, and
+    `query_only` rejects writes even through `ATTACH`.
+
+    Args:
+        conn: SQLite connection to tune.
+        db_path: Path to the database file the connection reads.
+    """
+    mmap_size = min(os.path.getsize(db_path), MAX_MMAP_BYTES)
+    conn.execute(f"PRAGMA mmap_size = {mmap_size}")
+    conn.execute(f"PRAGMA cache_size = -{READ_CACHE_KIB}")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    conn.execute("PRAGMA query_only = ON")
+
+
+def connect_read_only(db_path: str, immutable: bool = False, tuned: bool = True) -> sqlite3.Connection:
+    """Open a read-only connection to a SQLite database file using a
+    `mode=ro` URI. Unlike `sqlite3.connect`, a missing file is an error
+    instead of silently creating an empty database.
+
+    Args:
+        db_path: Path to the SQLite database.
+        immutable: Whether to open the file with `immutable=1`, which
+            skips all locking and change detection. Only use it when
+            nothing writes to the file while the connection is open:
+            changes are then not seen, and `PRAGMA data_version` never
+            changes, so it must not be used for watching the database.
+        tuned: Whether to apply the read-optimized pragmas, see
+            `tune_read_only`.
+
+    Returns:
+        A connection that may be shared between threads, with room for
+        `STATEMENT_CACHE_SIZE` prepared statements.
+
+    Raises:
+        FileNotFoundError: If the database file does not exist.
+    """
+    if not os.path.isfile(db_path):
+        raise FileNotFoundError(f"database not found: {db_path}")
+    uri = Path(db_path).absolute().as_uri() + "?mode=ro"
+    if immutable:
+        uri += "&immutable=1"
+    conn = sqlite3.connect(uri, uri=True, check_same_thread=False,
+                           cached_statements=STATEMENT_CACHE_SIZE, factory=LessonConnection)
+    if tuned:
+        tune_read_only(conn, db_path)
+    for hook in CONNECTION_HOOKS:
+        hook(conn)
+    return conn
+
+
+def require_database(db_path: str) -> None:
+    """Exit with a one-line error if a database file does not exist, for
+    the command-line scripts to call before they touch anything else.
+    """
+    if not os.path.isfile(db_path):
+        sys.exit(f"error: database not found: {db_path}")
+
+
+def render_lesson(conn: Optional[sqlite3.Connection], lesson: Dict[str, str],
+                  count_total: bool = False, scratch: Optional[ScratchDatabase] = None,
+                  cache: Optional[ResultCache] = None, budget: Optional[QueryBudget] = None,
+                  rewrites: bool = False) -> str:
+    """Build the Markdown document for a single lesson.
+
+    Args:
+        conn: SQLite connection used to run the lesson query. It may be
+            None when the lesson is not executed.
+        lesson: Lesson definition, see `generate_lessons`.
+        count_total: Whether to report the total row count of the
+            executed query under its sample table.
+        scratch: If given, lessons that are not run against the real
+            database are run on this scratch copy instead.
+        cache: Optional result cache for the sample query.
+        budget: Optional limits for the sample query. A query that goes
+            over is stopped, recorded in the budget and noted in the
+            lesson file instead of a sample.
+        rewrites: Whether to add suggested rewrites of the executed
+            query and their measured difference, see `query_rewrites`.
+
+    Returns:
+        The contents of the lesson file.
+    """
+    # Prepare content
+    content = [f"# {lesson['title']}\n"]
+    # Wrap the description to 80 characters per line
+    description = dedent(lesson['description']).strip()
+    content.append(description + "\n")
+    # Include the SQL query as a fenced code block
+    content.append("```sql")
+    content.append(lesson['query'].strip())
+    content.append("```")
+    if budget is not None:
+        budget.reset(lesson['slug'])
+    # If the lesson's query should be executed, fetch sample results
+    if lesson.get("run", True):
+        try:
+            result_md = fetch_sample_results(conn, lesson['query'], count_total=count_total,
+                                             cache=cache, budget=budget)
+        except BudgetExceeded as exc:
+            budget.record(lesson['slug'], exc)
+            result_md = ""
+            content.append(f"_The example query was stopped because it {exc}._")
+        if result_md:
+            content.append("**Sample result (first few rows):**")
+            content.append(result_md)
+            if rewrites:
+                from query_rewrites import format_suggestions
+
+                suggestions = format_suggestions(conn, lesson['query'], budget=budget)
+                if suggestions:
+                    content.append(suggestions)
+    elif scratch is not None:
+        result = scratch.run(lesson)
+        content.append("**Result on a scratch copy of the database:**")
+        content.append(format_scratch_result(result))
+    return "\n\n".join(content)
+
+
+def _render_lessons_serial(db_path: str, lessons: List[Dict[str, str]], jobs: int,
+                           count_total: bool, scratch: Optional[ScratchDatabase],
+                           cache: Optional[ResultCache],
+                           budget: Optional[QueryBudget], immutable: bool,
+                           rewrites: bool) -> Iterator[str]:
+    """Render lessons one after another on a single read-only connection."""
+    conn = connect_read_only(db_path, immutable)
+    try:
+        for lesson in lessons:
+            yield render_lesson(conn, lesson, count_total, scratch, cache, budget, rewrites)
+    finally:
+        conn.close()
+
+
+def _render_lessons_parallel(db_path: str, lessons: List[Dict[str, str]], jobs: int,
+                             count_total: bool, scratch: Optional[ScratchDatabase],
+                             cache: Optional[ResultCache],
+                             budget: Optional[QueryBudget], immutable: bool,
+                             rewrites: bool) -> Iterator[str]:
+    """Render lessons on a thread pool, yielding documents in lesson order.
+
+    Each worker borrows one of `jobs` read-only connections for the
+    duration of a lesson. SQLite releases the GIL while it executes a
+    statement, so threads are enough to overlap the queries.
+    """
+    pool: "queue.Queue[sqlite3.Connection]" = queue.Queue()
+    connections = [connect_read_only(db_path, immutable) for _ in range(jobs)]
+    for conn in connections:
+        pool.put(conn)
+
+    def work(lesson: Dict[str, str]) -> str:
+        conn = pool.get()
+        try:
+            return render_lesson(conn, lesson, count_total, scratch, cache, budget, rewrites)
+        finally:
+            pool.put(conn)
+
+    try:
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            yield from executor.map(work, lessons)
+    finally:
+        for conn in connections:
+            conn.close()
+
+
+def database_identity(db_path: str) -> str:
+    """Describe the current state of a database file without opening it.
+
+    Args:
+        db_path: Path to the SQLite database.
+
+    Returns:
+        A string built from the file size and modification time.
+    """
+    stat = os.stat(db_path)
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def lesson_cache_key(lesson: Dict[str, str], db_identity: str, count_total: bool = False,
+                     scratch: bool = False, setup: Sequence[str] = (), rewrites: bool = False) -> str:
+    """Hash everything a generated lesson file depends on.
+
+    Lessons that are not executed do not depend on the database, so
+    its identity only contributes to the key of executed lessons.
+
+    Args:
+        lesson: Lesson definition, see `generate_lessons`.
+        db_identity: Value of `database_identity` for the database.
+        count_total: Whether total row counts are being reported.
+        scratch: Whether lessons that are not run are executed on a
+            scratch copy of the database.
+        setup: Scripts of the lessons this one requires, see
+            `required_scripts`.
+        rewrites: Whether suggested rewrites are added to executed
+            lessons.
+
+    Returns:
+        A hex digest identifying the lesson output.
+    """
+    run = lesson.get("run", True)
+    on_scratch = scratch and not run
+    payload = {
+        "generator": GENERATOR_VERSION,
+        "lesson": {field: lesson.get(field) for field in LESSON_FIELDS},
+        "run": run,
+        "database": db_identity if run or on_scratch else None,
+        "count_total": count_total if run else None,
+        "scratch": on_scratch,
+        "setup": list(setup) if on_scratch else None,
+        "rewrites": rewrites if run else None,
+    }
+    encoded = json.dumps(payload, sort_keys=True).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()
+
+
+def load_manifest(lesson_dir: str) -> Dict[str, Dict[str, str]]:
+    """Read the lesson cache manifest, returning an empty one if it is
+    missing, unreadable or was written by another generator version.
+    """
+    try:
+        with open(os.path.join(lesson_dir, MANIFEST_NAME), encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if manifest.get("generator") != GENERATOR_VERSION:
+        return {}
+    return manifest.get("lessons", {})
+
+
+def save_manifest(lesson_dir: str, entries: Dict[str, Dict[str, str]]) -> None:
+    """Atomically replace the lesson cache manifest."""
+    path = os.path.join(lesson_dir, MANIFEST_NAME)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"generator": GENERATOR_VERSION, "lessons": entries}, f,
+                  indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def write_if_changed(path: str, text: str) -> bool:
+    """Write a text file only when its bytes would change, so unchanged
+    lessons keep their modification time.
+
+    Returns:
+        True if the file was written.
+    """
+    data = text.encode("utf-8")
+    try:
+        with open(path, "rb") as f:
+            if f.read() == data:
+                return False
+    except FileNotFoundError:
+        pass
+    with open(path, "wb") as f:
+        f.write(data)
+    return True
+
+
+def _file_digest(path: str) -> Optional[str]:
+    """Return the SHA-256 of a file's bytes, or None if it is missing."""
+    try:
+        with open(path, "rb") as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    except FileNotFoundError:
+        return None
+
+
+def generate_lessons(db_path: str, lessons: List[Dict[str, str]], lesson_dir: str,
+                     count_total: bool = False, jobs: int = 1,
+                     use_cache: bool = True,
+                     scratch: Optional[ScratchDatabase] = None,
+                     result_cache: Optional[ResultCache] = None,
+                     budget: Optional[QueryBudget] = None,
+                     conn: Optional[sqlite3.Connection] = None,
+                     immutable: bool = False, rewrites: bool = False) -> List[str]:
     """Generate lesson markdown files based on provided lesson
     definitions.
 
+    A manifest in `lesson_dir` records a cache key for every generated
+    lesson (see `lesson_cache_key`) and the digest of the file written
+    for it. Lessons whose key is unchanged and whose file is intact are
+    skipped without touching the database.
+
     Args:
         db_path: Path to the SQLite database.
         lessons: List of lesson definitions. Each definition is a
             dictionary with keys `slug`, `title`, `description`,
-            `query`, and `run` indicating whether to execute the query.
+            `query`, and `run` indicating whether to execute the query,
+            plus an optional `requires` list of prerequisite lessons.
         lesson_dir: Directory where lesson files should be saved.
+        count_total: Whether to report the total row count of each
+            executed query under its sample table.
+        jobs: Number of lessons to execute concurrently. With more than
+            one job, each worker thread uses its own read-only
+            connection. Files are always written in lesson order and
+            are identical to those of a serial run.
+        use_cache: Whether to skip lessons that are up to date according
+            to the manifest. The manifest is refreshed either way.
+        scratch: If given, lessons with `run` set to False are executed
+            on this scratch copy of the database and their outcome is
+            included in the lesson file.
+        result_cache: If given, sample results are served from and
+            stored in this cache, which pays off when the same process
+            generates lessons repeatedly.
+        budget: Optional limits every executed lesson query must stay
+            within. Lessons that go over are listed in
+            `budget.exceeded` and are not recorded in the manifest, so
+            they are retried on the next run.
+        conn: Optional open connection to run a serial render on
+            instead of opening a new read-only one.
+        immutable: Whether to open the read-only connections with
+            `immutable=1`, see `connect_read_only`.
+        rewrites: Whether to add suggested rewrites of each executed
+            query and their measured difference to the lesson files.
+
+    Returns:
+        The slugs of the lessons that were rendered.
     """
     os.makedirs(lesson_dir, exist_ok=True)
-    conn = sqlite3.connect(db_path)
+    manifest = load_manifest(lesson_dir)
+    db_identity = ""
+    if scratch is not None or any(lesson.get("run", True) for lesson in lessons):
+        db_identity = database_identity(db_path)
+
+    if scratch is not None:
+        scratch.register(lessons)
+
+    stale = []
+    keys = {}
     for lesson in lessons:
-        filename = f"{lesson['slug']}.md"
-        path = os.path.join(lesson_dir, filename)
-        # Prepare content
-        content = [f"# {lesson['title']}\n"]
-        # Wrap the description to 80 characters per line
-        description = dedent(lesson['description']).strip()
-        content.append(description + "\n")
-        # Include the SQL query as a fenced code block
-        content.append("```sql")
-        content.append(lesson['query'].strip())
-        content.append("```")
-        # If the lesson's query should be executed, fetch sample results
-        if lesson.get("run", True):
-            result_md = fetch_sample_results(conn, lesson['query'])
-            if result_md:
-                content.append("**Sample result (first few rows):**")
-                content.append(result_md)
-        # Write the file
-        with open(path, "w", encoding="utf-8") as f:
-            f.write("\n\n".join(content))
-    conn.close()
-
-
-def main():
-    # Define the list of lessons. Each lesson covers a single SQL concept.
-    # The `run` flag indicates whether the query should be executed to
-    # capture sample results. Data manipulation or DDL statements are
-    # typically not run to avoid altering the database.
-    lessons = [
-        {
-            "slug": "01_select_basic",
-            "title": "Basic SELECT – retrieve all columns",
-            "description": """
-            The `SELECT` statement is the foundation of querying in SQL. A
-            basic `SELECT` retrieves all columns and rows from a table. In the
-            Chinook database, the `artists` table stores information about
-            musical artists. This query returns the first five artists and
-            shows every column in the table.
-            """,
-            "query": "SELECT * FROM artists LIMIT 5;",
-            "run": True,
-        },
-        {
-            "slug": "02_select_columns",
-            "title": "Selecting specific columns",
-            "description": """
-            Instead of selecting every column, you can specify exactly which
-            columns you want to see. Here we select the `FirstName` and
-            `LastName` columns from the `employees` table to list the staff
-            names without showing their contact details or other fields.
-            """,
-            "query": "SELECT FirstName, LastName FROM employees;",
-            "run": True,
-        },
-        {
-            "slug": "03_where_clause",
-            "title": "Filtering rows with WHERE",
-            "description": """
-            The `WHERE` clause filters rows based on a condition. In this
-            example we retrieve all customers from the United States. Only
-            rows where the `Country` column is `USA` are returned.
-            """,
-            "query": "SELECT * FROM customers WHERE Country = 'USA';",
-            "run": True,
-        },
-        {
-            "slug": "04_where_and",
-            "title": "Combining conditions with AND",
-            "description": """
-            You can combine multiple conditions using the `AND` operator. This
-            query finds customers in the USA who are also located in
-            California. Both conditions must be true for a row to be included.
-            """,
-            "query": "SELECT * FROM customers WHERE Country = 'USA' AND State = 'CA';",
-            "run": True,
-        },
-        {
-            "slug": "05_where_or",
-            "title": "Combining conditions with OR",
-            "description": """
-            The `OR` operator allows rows that meet at least one of the
-            specified conditions. This query returns customers who are in
-            either Brazil or France.
-            """,
-            "query": "SELECT * FROM customers WHERE Country = 'Brazil' OR Country = 'France';",
-            "run": True,
-        },
-        {
-            "slug": "06_where_in",
-            "title": "Testing membership with IN",
-            "description": """
-            The `IN` operator checks whether a value matches any value in a
-            list. This query selects all genres whose name is either 'Rock' or
-            'Jazz'.
-            """,
-            "query": "SELECT * FROM genres WHERE Name IN ('Rock', 'Jazz');",
-            "run": True,
-        },
-        {
-            "slug": "07_where_between",
-            "title": "Filtering by range with BETWEEN",
-            "description": """
-            Use `BETWEEN` to filter numeric values within a specified range.
-            Here we select tracks priced between $0.99 and $1.99 inclusive. The
-            `UnitPrice` column stores the price of each track.
-            """,
-            "query": "SELECT Name, UnitPrice FROM tracks WHERE UnitPrice BETWEEN 0.99 AND 1.99;",
-            "run": True,
-        },
-        {
-            "slug": "08_order_by",
-            "title": "Sorting results with ORDER BY",
-            "description": """
-            The `ORDER BY` clause sorts the result set. By default it sorts in
-            ascending order. This example lists employees by last name
-            alphabetically.
-            """,
-            "query": "SELECT FirstName, LastName FROM employees ORDER BY LastName;",
-            "run": True,
-        },
-        {
-            "slug": "09_order_by_desc",
-            "title": "Descending order sorting",
-            "description": """
-            Add the `DESC` keyword after a column name to sort in descending
-            order. Here we list the five most expensive tracks first by
-            ordering on `UnitPrice` descending.
-            """,
-            "query": "SELECT Name, UnitPrice FROM tracks ORDER BY UnitPrice DESC LIMIT 5;",
-            "run": True,
-        },
-        {
-            "slug": "10_group_by",
-            "title": "Grouping data with GROUP BY",
-            "description": """
-            The `GROUP BY` clause aggregates rows sharing the same value of
-            specified columns. This query counts how many customers are in
-            each country.
-            """,
-            "query": "SELECT Country, COUNT(*) AS CustomerCount FROM customers GROUP BY Country ORDER BY CustomerCount DESC;",
-            "run": True,
-        },
-        {
-            "slug": "11_having",
-            "title": "Filtering groups with HAVING",
-            "description": """
-            After grouping rows, use the `HAVING` clause to filter the
-            aggregated results. This query shows countries with more than five
-            customers.
-            """,
-            "query": "SELECT Country, COUNT(*) AS CustomerCount FROM customers GROUP BY Country HAVING COUNT(*) > 5 ORDER BY CustomerCount DESC;",
-            "run": True,
-        },
-        {
-            "slug": "12_count",
-            "title": "Counting rows with COUNT",
-            "description": """
-            `COUNT(*)` returns the total number of rows in a table. Here we
-            count the number of tracks in the database.
-            """,
-            "query": "SELECT COUNT(*) AS TrackCount FROM tracks;",
-            "run": True,
-        },
-        {
-            "slug": "13_sum",
-            "title": "Summing values with SUM",
-            "description": """
-            The `SUM` function adds up all values of a numeric column. This
-            query calculates the total of all invoice amounts.
-            """,
-            "query": "SELECT SUM(Total) AS TotalRevenue FROM invoices;",
-            "run": True,
-        },
-        {
-            "slug": "14_avg",
-            "title": "Calculating averages with AVG",
-            "description": """
-            Use the `AVG` function to compute the mean value of a numeric
-            column. Here we determine the average track price.
-            """,
-            "query": "SELECT AVG(UnitPrice) AS AveragePrice FROM tracks;",
-            "run": True,
-        },
-        {
-            "slug": "15_min_max",
-            "title": "Finding minimum and maximum values",
-            "description": """
-            The `MIN` and `MAX` functions return the smallest and largest
-            values in a column. This example shows the cheapest and most
-            expensive track prices.
-            """,
-            "query": "SELECT MIN(UnitPrice) AS MinPrice, MAX(UnitPrice) AS MaxPrice FROM tracks;",
-            "run": True,
-        },
-        {
-            "slug": "16_distinct",
-            "title": "Removing duplicates with DISTINCT",
-            "description": """
-            The `DISTINCT` keyword removes duplicate values from the result set.
-            This query lists all unique countries where customers reside.
-            """,
-            "query": "SELECT DISTINCT Country FROM customers ORDER BY Country;",
-            "run": True,
-        },
-        {
-            "slug": "17_inner_join",
-            "title": "Combining tables with INNER JOIN",
-            "description": """
-            Joins combine rows from two or more tables based on related columns.
-            An `INNER JOIN` returns only rows that have matching values on
-            both sides. Here we join `albums` with `artists` to show each
-            album's title alongside the artist's name.
-            """,
-            "query": "SELECT albums.Title AS Album, artists.Name AS Artist FROM albums JOIN artists ON albums.ArtistId = artists.ArtistId ORDER BY Artist, Album LIMIT 10;",
-            "run": True,
-        },
-        {
-            "slug": "18_left_join",
-            "title": "Including unmatched rows with LEFT JOIN",
-            "description": """
-            A `LEFT JOIN` (or left outer join) returns all rows from the left
-            table and the matching rows from the right table. If there is no
-            match, the result contains NULLs for the right table's columns.
-            This query lists customers and their invoices, if any. Customers
-            without invoices still appear in the result.
-            """,
-            "query": "SELECT customers.FirstName || ' ' || customers.LastName AS Customer, invoices.InvoiceId, invoices.Total FROM customers LEFT JOIN invoices ON customers.CustomerId = invoices.CustomerId ORDER BY Customer LIMIT 10;",
-            "run": True,
-        },
-        {
-            "slug": "19_right_join",
-            "title": "Simulating a RIGHT JOIN in SQLite",
-            "description": """
-            SQLite does not support the `RIGHT JOIN` syntax, but you can achieve
-            the same effect by swapping the tables and using a `LEFT JOIN`.
-            This query finds invoices and their customers, including invoices
-            that might not have a matching customer (although in this
-            database every invoice has a valid customer). The principle is
-            explained rather than demonstrated with missing data.
-            """,
-            "query": "SELECT invoices.InvoiceId, customers.FirstName || ' ' || customers.LastName AS Customer, invoices.Total FROM invoices LEFT JOIN customers ON customers.CustomerId = invoices.CustomerId LIMIT 10;",
-            "run": True,
-        },
-        {
-            "slug": "20_cross_join",
-            "title": "Creating a Cartesian product with CROSS JOIN",
-            "description": """
-            A `CROSS JOIN` returns the Cartesian product of two tables, meaning
-            each row of the first table is paired with each row of the second.
-            This can quickly produce large result sets. Here we cross join
-            employees and media types and show only a few rows to illustrate
-            the pattern.
-            """,
-            "query": "SELECT employees.FirstName || ' ' || employees.LastName AS Employee, media_types.Name AS MediaType FROM employees CROSS JOIN media_types LIMIT 10;",
-            "run": True,
-        },
-        {
-            "slug": "21_self_join",
-            "title": "Referencing a table to itself with SELF JOIN",
-            "description": """
-            A self join is a join of a table with itself. It's useful for
-            hierarchical relationships stored in a single table. In the
-            employees table, the `ReportsTo` column refers to the manager of
-            each employee. This query pairs employees with their managers.
-            """,
-            "query": "SELECT e.FirstName || ' ' || e.LastName AS Employee, m.FirstName || ' ' || m.LastName AS Manager FROM employees e LEFT JOIN employees m ON e.ReportsTo = m.EmployeeId ORDER BY Employee LIMIT 10;",
-            "run": True,
-        },
-        {
-            "slug": "22_union",
-            "title": "Combining result sets with UNION",
-            "description": """
-            The `UNION` operator combines the results of two queries and
-            eliminates duplicate rows. Here we list all unique countries that
-            appear in either the customers or employees tables. Each country
-            appears only once in the final set.
-            """,
-            "query": "SELECT Country FROM customers UNION SELECT Country FROM employees ORDER BY Country;",
-            "run": True,
-        },
-        {
-            "slug": "23_union_all",
-            "title": "Including duplicates with UNION ALL",
-            "description": """
-            `UNION ALL` also combines results from two queries but keeps
-            duplicates. This query returns the list of countries from the
-            customers table twice, so countries with more customers will appear
-            multiple times.
-            """,
-            "query": "SELECT Country FROM customers UNION ALL SELECT Country FROM customers ORDER BY Country LIMIT 20;",
-            "run": True,
-        },
-        {
-            "slug": "24_except",
-            "title": "Finding differences with EXCEPT",
-            "description": """
-            The `EXCEPT` operator returns rows from the first query that are
-            not present in the second. This example lists countries that have
-            customers but no employees. Note that the country names are
-            compared across the two tables.
-            """,
-            "query": "SELECT Country FROM customers EXCEPT SELECT Country FROM employees ORDER BY Country;",
-            "run": True,
-        },
-        {
-            "slug": "25_intersect",
-            "title": "Finding common values with INTERSECT",
-            "description": """
-            The `INTERSECT` operator returns rows that are common to both
-            queries. This query finds countries that appear in both the
-            customers and employees tables.
-            """,
-            "query": "SELECT Country FROM customers INTERSECT SELECT Country FROM employees ORDER BY Country;",
-            "run": True,
-        },
-        {
-            "slug": "26_subquery",
-            "title": "Using subqueries for comparisons",
-            "description": """
-            A subquery is a query nested within another query. In this
-            example we select tracks whose price is above the average track
-            price. The subquery computes the average price across all tracks.
-            """,
-            "query": "SELECT Name, UnitPrice FROM tracks WHERE UnitPrice > (SELECT AVG(UnitPrice) FROM tracks) ORDER BY UnitPrice DESC LIMIT 10;",
-            "run": True,
-        },
-        {
-            "slug": "27_exists",
-            "title": "Checking for existence with EXISTS",
-            "description": """
-            The `EXISTS` operator tests whether a subquery returns any rows. In
-            this query we list artists who have at least one album in the
-            database. The subquery checks for the existence of albums linked
-            to each artist.
-            """,
-            "query": "SELECT Name FROM artists a WHERE EXISTS (SELECT 1 FROM albums al WHERE al.ArtistId = a.ArtistId) ORDER BY Name LIMIT 10;",
-            "run": True,
-        },
-        {
-            "slug": "28_case",
-            "title": "Adding conditional logic with CASE",
-            "description": """
-            The `CASE` expression returns a value based on conditional
-            logic. This query labels tracks as 'Expensive' if the price is
-            greater than $1.00 and 'Cheap' otherwise. Labels can be used in
-            result sets just like any other computed column.
-            """,
-            "query": "SELECT Name, UnitPrice, CASE WHEN UnitPrice > 1.00 THEN 'Expensive' ELSE 'Cheap' END AS PriceCategory FROM tracks ORDER BY UnitPrice DESC LIMIT 10;",
-            "run": True,
-        },
-        {
-            "slug": "29_insert",
-            "title": "Inserting rows into a table",
-            "description": """
-            `INSERT` adds new rows to a table. In practice you would insert
-            data into existing business tables, but here we create a simple
-            temporary table to demonstrate. Create the table, insert a row,
-            and query the contents to see the result. (These statements are
-            not executed automatically by this tutorial.)
-            """,
-            "query": """
-            -- Create a temporary table for demonstration
-            CREATE TABLE IF NOT EXISTS demo_insert (
-                Id INTEGER PRIMARY KEY AUTOINCREMENT,
-                Name TEXT
-            );
-
-            -- Insert a new row
-            INSERT INTO demo_insert (Name) VALUES ('Example Row');
-
-            -- Query the table to see the inserted row
-            SELECT * FROM demo_insert;
-            """,
-            "run": False,
-        },
-        {
-            "slug": "30_update",
-            "title": "Updating existing rows",
-            "description": """
-            The `UPDATE` statement modifies existing rows. Using the same
-            temporary table from the previous lesson, change the row's name
-            and then retrieve it to verify the update. (These statements
-            are illustrative and not executed automatically.)
-            """,
-            "query": """
-            -- Update the row in the demo_insert table
-            UPDATE demo_insert SET Name = 'Updated Row' WHERE Id = 1;
-
-            -- Query the table to see the updated data
-            SELECT * FROM demo_insert;
-            """,
-            "run": False,
-        },
-        {
-            "slug": "31_delete",
-            "title": "Deleting rows",
-            "description": """
-            Use `DELETE` to remove rows from a table. Continuing with the
-            `demo_insert` table, delete the row we previously inserted and
-            then select from the table to confirm it's empty. (These
-            statements are illustrative and not executed automatically.)
-            """,
-            "query": """
-            -- Delete the row from the demo_insert table
-            DELETE FROM demo_insert WHERE Id = 1;
-
-            -- Query the table to confirm deletion
-            SELECT * FROM demo_insert;
-            """,
-            "run": False,
-        },
-        {
-            "slug": "32_create_table",
-            "title": "Creating new tables",
-            "description": """
-            The `CREATE TABLE` statement defines a new table. Here we create
-            a simple table called `example_table` with an integer primary key
-            and a text column. You would normally run this once during
-            database setup. (This statement is not executed automatically.)
-            """,
-            "query": """
-            CREATE TABLE example_table (
-                Id INTEGER PRIMARY KEY,
-                Description TEXT
-            );
-            """,
-            "run": False,
-        },
-        {
-            "slug": "33_alter_table",
-            "title": "Changing a table with ALTER TABLE",
-            "description": """
-            Use `ALTER TABLE` to modify an existing table structure. In this
-            example we add a `CreatedAt` column to the `example_table` to
-            record when each row was created. (This statement is not
-            executed automatically.)
-            """,
-            "query": "ALTER TABLE example_table ADD COLUMN CreatedAt DATETIME DEFAULT CURRENT_TIMESTAMP;",
-            "run": False,
-        },
-        {
-            "slug": "34_drop_table",
-            "title": "Removing tables with DROP TABLE",
-            "description": """
-            When a table is no longer needed, `DROP TABLE` permanently
-            removes it and its data. Here we drop the `example_table` we
-            created in previous lessons. (This statement is not executed
-            automatically.)
-            """,
-            "query": "DROP TABLE IF EXISTS example_table;",
-            "run": False,
-        },
-        {
-            "slug": "35_create_view",
-            "title": "Creating reusable queries with VIEWs",
-            "description": """
-            A view is a saved query that can be treated like a table. This
-            example creates a view combining customer names and their invoice
-            totals. You can query the view just like a normal table. (The
-            creation statement is not executed automatically, but the
-            subsequent SELECT demonstrates how you would use it.)
-            """,
-            "query": """
-            -- Create the view
-            CREATE VIEW IF NOT EXISTS customer_invoices AS
-            SELECT c.FirstName || ' ' || c.LastName AS Customer,
-                   i.Total
-              FROM customers c
-              JOIN invoices i ON c.CustomerId = i.CustomerId;
-
-            -- Query the view
-            SELECT * FROM customer_invoices ORDER BY Total DESC LIMIT 10;
-            """,
-            "run": False,
-        },
-        {
-            "slug": "36_create_index",
-            "title": "Improving performance with indexes",
-            "description": """
-            An index speeds up lookups on a table column. Creating too many
-            indexes can slow down writes, so it’s important to index only
-            where needed. This example creates an index on the `AlbumId`
-            column of the `tracks` table to improve joins and lookups by
-            album. (This statement is not executed automatically.)
-            """,
-            "query": "CREATE INDEX idx_tracks_albumid ON tracks (AlbumId);",
-            "run": False,
-        },
-        {
-            "slug": "37_transactions",
-            "title": "Ensuring atomicity with transactions",
-            "description": """
-            A transaction groups multiple statements into a single unit of
-            work. If any statement fails, the entire transaction can be
-            rolled back. This example shows how to begin a transaction,
-            update a record, and then roll back the change. (These
-            statements are illustrative and not executed automatically.)
-            """,
-            "query": """
-            -- Start a transaction
-            BEGIN TRANSACTION;
-
-            -- Example update: increase the price of a specific track
-            UPDATE tracks SET UnitPrice = UnitPrice + 0.10 WHERE TrackId = 1;
-
-            -- Roll back the change
-            ROLLBACK;
-            """,
-            "run": False,
-        },
-        {
-            "slug": "38_window_functions",
-            "title": "Using window functions",
-            "description": """
-            Window functions perform calculations across sets of rows that
-            relate to the current row. The `ROW_NUMBER()` function assigns
-            a unique sequential integer to rows ordered by price. This query
-            ranks tracks by descending price.
-            """,
-            "query": "SELECT TrackId, Name, UnitPrice, ROW_NUMBER() OVER (ORDER BY UnitPrice DESC) AS PriceRank FROM tracks ORDER BY UnitPrice DESC LIMIT 10;",
-            "run": True,
-        },
-        {
-            "slug": "39_cte",
-            "title": "Simplifying queries with common table expressions (CTE)",
-            "description": """
-            A CTE is a named temporary result set defined within a query.
-            This example uses a simple CTE to select the top five invoices by
-            total amount. The CTE improves readability by separating the
-            logic for selecting the top invoices from the outer query.
-            """,
-            "query": "WITH TopInvoices AS (SELECT InvoiceId, Total FROM invoices ORDER BY Total DESC LIMIT 5) SELECT * FROM TopInvoices ORDER BY Total DESC;",
-            "run": True,
-        },
-        {
-            "slug": "40_recursive_cte",
-            "title": "Working with hierarchical data using recursive CTEs",
-            "description": """
-            Recursive CTEs allow you to query hierarchical relationships,
-            such as an organizational chart. In the Chinook employees table,
-            the `ReportsTo` column references a manager. This query builds
-            a hierarchy starting from the top-level manager and recursively
-            traverses subordinate employees. The result shows each
-            employee alongside their manager chain. Not all SQLite
-            environments support recursive CTEs; if not supported, this
-            example may not execute. Results are limited for readability.
-            """,
-            "query": """
-            WITH RECURSIVE employee_hierarchy AS (
-                -- Anchor member: select top-level employees (no manager)
-                SELECT EmployeeId, FirstName || ' ' || LastName AS Name,
-                       ReportsTo, 0 AS Level,
-                       CAST(FirstName || ' ' || LastName AS TEXT) AS Path
-                  FROM employees
-                 WHERE ReportsTo IS NULL
-
-                UNION ALL
-
-                -- Recursive member: select employees reporting to the
-                -- previous level
-                SELECT e.EmployeeId, e.FirstName || ' ' || e.LastName AS Name,
-                       e.ReportsTo, h.Level + 1 AS Level,
-                       CAST(h.Path || ' -> ' || e.FirstName || ' ' || e.LastName AS TEXT) AS Path
-                  FROM employees e
-                  JOIN employee_hierarchy h ON e.ReportsTo = h.EmployeeId
-            )
-            SELECT EmployeeId, Name, Level, Path FROM employee_hierarchy ORDER BY Level, Name LIMIT 20;
-            """,
-            "run": True,
-        },
-    ]
-
-    db_path = os.path.join('sql_tutorial_project', 'chinook.db')
-    lesson_dir = os.path.join('sql_tutorial_project', 'lessons')
-    generate_lessons(db_path, lessons, lesson_dir)
+        slug = lesson['slug']
+        setup = required_scripts(lesson, scratch.lessons_by_slug) if scratch is not None else ()
+        keys[slug] = lesson_cache_key(lesson, db_identity, count_total, scratch is not None, setup,
+                                      rewrites)
+        entry = manifest.get(slug)
+        if (use_cache and entry and entry.get("key") == keys[slug]
+                and _file_digest(os.path.join(lesson_dir, f"{slug}.md")) == entry.get("sha256")):
+            continue
+        stale.append(lesson)
+
+    if stale:
+        if conn is not None and jobs <= 1:
+            documents = (render_lesson(conn, lesson, count_total, scratch, result_cache, budget,
+                                       rewrites)
+                         for lesson in stale)
+        else:
+            render = _render_lessons_parallel if jobs > 1 else _render_lessons_serial
+            documents = render(db_path, stale, jobs, count_total, scratch, result_cache, budget,
+                               immutable, rewrites)
+        with closing(documents):
+            for lesson, document in zip(stale, documents):
+                path = os.path.join(lesson_dir, f"{lesson['slug']}.md")
+                write_if_changed(path, document)
+                if budget is not None and lesson['slug'] in budget.exceeded:
+                    manifest.pop(lesson['slug'], None)
+                    continue
+                manifest[lesson['slug']] = {
+                    "key": keys[lesson['slug']],
+                    "sha256": hashlib.sha256(document.encode("utf-8")).hexdigest(),
+                }
+        save_manifest(lesson_dir, manifest)
+    return [lesson['slug'] for lesson in stale]
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    """Parse the command line options of the lesson generator."""
+    parser = argparse.ArgumentParser(description="Generate the SQL tutorial lesson files.")
+    parser.add_argument("--db", default=DEFAULT_DB_PATH,
+                        help="path to the Chinook SQLite database")
+    parser.add_argument("--lesson-dir", default=DEFAULT_LESSON_DIR,
+                        help="directory the lesson Markdown files are written to")
+    parser.add_argument("--count-rows", action="store_true",
+                        help="report the total number of rows under each sample table")
+    parser.add_argument("--jobs", "-j", type=int, default=1,
+                        help="number of lessons to execute in parallel")
+    parser.add_argument("--execute-mutating", action="store_true",
+                        help="run the data-modifying lessons on an in-memory copy of the database")
+    parser.add_argument("--force", action="store_true",
+                        help="regenerate every lesson even if the cache says it is up to date")
+    parser.add_argument("--only", nargs="+", metavar="SLUG",
+                        help="generate only these lessons, e.g. 17_inner_join")
+    parser.add_argument("--tag", nargs="+", dest="tags", metavar="TAG",
+                        help="generate only the lessons with these tags, e.g. joins")
+    parser.add_argument("--suggest-rewrites", action="store_true",
+                        help="add measured rewrites of slow query patterns to the lesson files")
+    parser.add_argument("--immutable", action="store_true",
+                        help="open the database with immutable=1; only safe if nothing writes to it meanwhile")
+    parser.add_argument("--trace", metavar="FILE",
+                        help="write per-statement SQL metrics to FILE: JSON for .json, else Prometheus text")
+    parser.add_argument("--watch", action="store_true",
+                        help="keep running and regenerate the lessons affected by each change")
+    parser.add_argument("--interval", type=float, default=DEFAULT_WATCH_INTERVAL,
+                        help="seconds between two checks for changes in watch mode")
+    parser.add_argument("--timeout", type=float, default=DEFAULT_TIMEOUT,
+                        help="seconds a lesson query may run before it is stopped; 0 for no limit")
+    parser.add_argument("--max-steps", type=int,
+                        help=f"SQLite VM steps a lesson query may take before it is stopped; "
+                             f"at least {BUDGET_CHECK_INTERVAL}")
+    parser.add_argument("--max-rows", type=int,
+                        help="rows a lesson query may fetch or count before it is stopped")
+    args = parser.parse_args(argv)
+    if args.immutable and args.watch:
+        parser.error("--immutable cannot be combined with --watch, which must see the database change")
+    if args.max_steps is not None and args.max_steps < BUDGET_CHECK_INTERVAL:
+        parser.error(f"--max-steps must be at least {BUDGET_CHECK_INTERVAL}, the interval between two checks")
+    if args.max_rows is not None and args.max_rows < 0:
+        parser.error("--max-rows must not be negative")
+    return args
+
+
+def get_lessons() -> List[Dict[str, str]]:
+    """Return the definitions of every lesson in the tutorial, in order.
+    The lessons are stored in the catalog, see `lesson_catalog`.
+    """
+    return load_lessons()
+
+
+def main(argv: Optional[List[str]] = None):
+    args = parse_args(argv)
+    require_database(args.db)
+    try:
+        lessons = load_lessons(args.only, args.tags)
+        # Prerequisites run on the scratch copy but are not regenerated.
+        requirements = load_requirements(lessons) if args.execute_mutating else []
+    except ValueError as exc:
+        sys.exit(f"error: {exc}")
+    budget = QueryBudget(args.timeout or None, args.max_steps, args.max_rows)
+    tracer = None
+    if args.trace:
+        from sql_trace import SQLTracer
+
+        tracer = SQLTracer()
+        tracer.install()
+    try:
+        _run(args, lessons, requirements, budget)
+    finally:
+        if tracer is not None:
+            tracer.uninstall()
+            tracer.write(args.trace)
+
+
+def _run(args: argparse.Namespace, lessons: List[Dict[str, str]], requirements: List[Dict[str, str]],
+         budget: QueryBudget) -> None:
+    """Generate or watch the lessons selected on the command line."""
+    if args.watch:
+        from lesson_watch import LessonWatcher
+
+        watcher = LessonWatcher(args.db, args.lesson_dir, args.only, args.tags,
+                                count_total=args.count_rows,
+                                execute_mutating=args.execute_mutating, budget=budget)
+        watcher.run(args.interval)
+        return
+    scratch = None
+    if args.execute_mutating:
+        scratch = ScratchDatabase(args.db, budget=budget)
+        scratch.register(requirements)
+    try:
+        rendered = generate_lessons(args.db, lessons, args.lesson_dir, count_total=args.count_rows,
+                                    jobs=args.jobs, use_cache=not args.force, scratch=scratch,
+                                    budget=budget, immutable=args.immutable,
+                                    rewrites=args.suggest_rewrites)
+    finally:
+        if scratch is not None:
+            scratch.close()
+    print(f"Rendered {len(rendered)} lesson(s); {len(lessons) - len(rendered)} up to date.")
+    if scratch is not None:
+        order = {lesson['slug']: index for index, lesson in enumerate(lessons)}
+        for result in sorted(scratch.results, key=lambda result: order[result.slug]):
+            status = result.error or f"{result.rows_affected} row(s) affected"
+            print(f"  {result.slug}: {status} in {result.elapsed * 1000:.2f} ms")
+    if budget.exceeded:
+        print(f"Stopped {len(budget.exceeded)} lesson(s) that went over budget:", file=sys.stderr)
+        for slug, reason in sorted(budget.exceeded.items()):
+            print(f"  {slug}: {reason}", file=sys.stderr)
+        sys.exit(1)
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    # Run the importable module so that the modules importing
+    # `generate_lessons`, e.g. `sql_trace`, share its hooks.
+    import generate_lessons
+
+    generate_lessons.main()
\ No newline at end of file
@@ -0,0 +1,236 @@
+"""
+This script proposes indexes for the lesson queries and measures them.
+
+The executed lesson queries are treated as a workload. For every table
+a query touches, the columns it filters or joins on, the columns it
+groups or sorts by and the columns it returns are collected with
+`lesson_sql.column_roles`. From these the advisor derives candidate
+indexes: one per filter, join or sort column, one on the filter columns
+followed by the sort columns, and a covering index that also includes
+the returned columns. Candidates that lead with the table's integer
+primary key or are a prefix of an existing index are dropped.
+
+Each candidate is then created on a scratch in-memory copy of the
+database, the lessons that use its table are re-run, and the measured
+speedup, whether the query planner picked the index, and the pages the
+index occupies are reported. The source database is never modified.
+
+Run this script from the root of the project directory, ideally
+against one of the scaled benchmark databases:
+
+    python index_advisor.py --db bench_data/chinook_x100.db --output index_advice.md
+"""
+
+import argparse
+import sqlite3
+import time
+from typing import Dict, List, Optional, Tuple
+
+from generate_lessons import (
+    DEFAULT_DB_PATH, connect_read_only, get_lessons, require_database, rows_to_markdown,
+)
+from lesson_sql import column_roles, table_columns
+from profile_lessons import explain_query_plan
+
+# Widest covering index the advisor proposes.
+MAX_INDEX_COLUMNS = 4
+
+# A candidate is recommended when it saves at least this fraction of
+# the time of the lessons that use its table.
+MIN_SAVING = 0.05
+
+
+def _existing_prefixes(conn: sqlite3.Connection, table: str) -> List[Tuple[str, ...]]:
+    """Return the lower-cased column lists of the table's indexes."""
+    prefixes = []
+    for index in conn.execute(f'PRAGMA index_list("{table}")').fetchall():
+        columns = [info[2] for info in conn.execute(f'PRAGMA index_info("{index[1]}")')]
+        prefixes.append(tuple(column.lower() for column in columns if column))
+    return prefixes
+
+
+def _rowid_column(conn: sqlite3.Connection, table: str) -> Optional[str]:
+    """Return the lower-cased INTEGER PRIMARY KEY column of a table."""
+    keys = [row for row in conn.execute(f'PRAGMA table_info("{table}")') if row[5]]
+    if len(keys) == 1 and keys[0][2].upper() == "INTEGER":
+        return keys[0][1].lower()
+    return None
+
+
+def propose_indexes(conn: sqlite3.Connection,
+                    lessons: List[Dict[str, str]]) -> Dict[Tuple[str, Tuple[str, ...]], List[str]]:
+    """Derive candidate indexes from the executed lesson queries.
+
+    Args:
+        conn: Connection to the database the queries run against.
+        lessons: Lesson definitions, see `generate_lessons.get_lessons`.
+
+    Returns:
+        A mapping of `(table, columns)` candidates to the slugs of the
+        lessons that suggested them, in the order first proposed.
+    """
+    columns = table_columns(conn)
+    existing = {table: _existing_prefixes(conn, table) for table in columns}
+    rowid = {table: _rowid_column(conn, table) for table in columns}
+    candidates: Dict[Tuple[str, Tuple[str, ...]], List[str]] = {}
+    for lesson in lessons:
+        if not lesson.get("run", True):
+            continue
+        for table, roles in column_roles(lesson["query"], columns).items():
+            keys = roles["filter"] + [col for col in roles["order"] if col not in roles["filter"]]
+            covering = keys + [col for col in roles["select"] if col not in keys]
+            proposals = [(col,) for col in keys]
+            if len(keys) > 1:
+                proposals.append(tuple(keys))
+            if keys and len(keys) < len(covering) <= MAX_INDEX_COLUMNS:
+                proposals.append(tuple(covering))
+            for proposal in proposals:
+                lowered = tuple(col.lower() for col in proposal)
+                # The table itself is already ordered by its rowid key.
+                if lowered[0] == rowid[table]:
+                    continue
+                if any(prefix[:len(lowered)] == lowered for prefix in existing[table]):
+                    continue
+                slugs = candidates.setdefault((table, proposal), [])
+                if lesson["slug"] not in slugs:
+                    slugs.append(lesson["slug"])
+    return candidates
+
+
+def index_name(table: str, columns: Tuple[str, ...]) -> str:
+    """Return the name the advisor gives a candidate index."""
+    return "advisor_" + "_".join((table,) + columns).lower()
+
+
+def create_index_sql(table: str, columns: Tuple[str, ...]) -> str:
+    """Return the `CREATE INDEX` statement for a candidate."""
+    column_list = ", ".join(f'"{column}"' for column in columns)
+    return f'CREATE INDEX "{index_name(table, columns)}" ON "{table}" ({column_list});'
+
+
+def _used_pages(conn: sqlite3.Connection) -> int:
+    page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+    return page_count - conn.execute("PRAGMA freelist_count").fetchone()[0]
+
+
+def time_query(conn: sqlite3.Connection, query: str, repeat: int) -> float:
+    """Return the best of `repeat` complete runs of a query, in ms."""
+    clean_query = query.strip().rstrip(';')
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in conn.execute(clean_query):
+            pass
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def measure_candidates(scratch: sqlite3.Connection, lessons: List[Dict[str, str]],
+                       candidates: Dict[Tuple[str, Tuple[str, ...]], List[str]],
+                       repeat: int = 5) -> List[Dict]:
+    """Create each candidate on a scratch database and time the workload.
+
+    Args:
+        scratch: Writable connection to a disposable copy of the database.
+        lessons: Lesson definitions, see `generate_lessons.get_lessons`.
+        candidates: Result of `propose_indexes`.
+        repeat: Timed runs per query; the fastest one counts.
+
+    Returns:
+        One entry per candidate, sorted by the time it saves.
+    """
+    columns = table_columns(scratch)
+    runnable = [lesson for lesson in lessons if lesson.get("run", True)]
+    tables_of = {lesson["slug"]: set(column_roles(lesson["query"], columns)) for lesson in runnable}
+    baseline = {lesson["slug"]: time_query(scratch, lesson["query"], repeat) for lesson in runnable}
+    page_size = scratch.execute("PRAGMA page_size").fetchone()[0]
+
+    results = []
+    for (table, index_columns), suggested_by in candidates.items():
+        name = index_name(table, index_columns)
+        affected = [lesson for lesson in runnable if table in tables_of[lesson["slug"]]]
+        pages_before = _used_pages(scratch)
+        scratch.execute(create_index_sql(table, index_columns))
+        scratch.execute(f'ANALYZE "{name}"')
+        size = (_used_pages(scratch) - pages_before) * page_size
+        speedups = {}
+        used_by = []
+        for lesson in affected:
+            slug = lesson["slug"]
+            speedups[slug] = baseline[slug] / max(time_query(scratch, lesson["query"], repeat), 1e-9)
+            if any(name in step for step in explain_query_plan(scratch, lesson["query"])):
+                used_by.append(slug)
+        scratch.execute(f'DROP INDEX "{name}"')
+
+        before = sum(baseline[lesson["slug"]] for lesson in affected)
+        after = sum(baseline[slug] / speedup for slug, speedup in speedups.items())
+        results.append({
+            "table": table,
+            "columns": list(index_columns),
+            "sql": create_index_sql(table, index_columns),
+            "suggested_by": suggested_by,
+            "used_by": used_by,
+            "saved_ms": before - after,
+            "saving": (before - after) / before if before else 0.0,
+            "speedups": speedups,
+            "size_bytes": size,
+        })
+    results.sort(key=lambda result: result["saved_ms"], reverse=True)
+    return results
+
+
+def format_report(results: List[Dict], db_path: str) -> str:
+    """Render measured candidates as a Markdown report."""
+    rows = []
+    for result in results:
+        best = max(result["speedups"].items(), key=lambda item: item[1], default=(None, 1.0))
+        recommended = bool(result["used_by"]) and result["saving"] >= MIN_SAVING
+        rows.append((
+            "yes" if recommended else "no",
+            result["sql"],
+            ", ".join(result["used_by"]),
+            round(result["saved_ms"], 3),
+            round(result["saving"] * 100, 1),
+            f"{best[1]:.2f}x ({best[0]})" if best[0] else "",
+            round(result["size_bytes"] / 1024, 1),
+        ))
+    table = rows_to_markdown(
+        ["Recommended", "Index", "Used by", "Saved ms", "Saved %", "Best speedup", "Size KiB"], rows)
+    return "\n\n".join([
+        "# Index advice for the lesson workload",
+        f"Measured on `{db_path}`. An index is recommended when the query planner uses it and "
+        f"it saves at least {MIN_SAVING:.0%} of the run time of the lessons that read its table.",
+        table,
+    ]) + "\n"
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Propose and measure indexes for the lesson queries.")
+    parser.add_argument("--db", default=DEFAULT_DB_PATH,
+                        help="path to the Chinook SQLite database")
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="timed runs per query; the fastest is used")
+    parser.add_argument("--output", help="write the Markdown report to this file instead of stdout")
+    args = parser.parse_args(argv)
+    require_database(args.db)
+
+    source = connect_read_only(args.db)
+    scratch = sqlite3.connect(":memory:")
+    try:
+        source.backup(scratch)
+        lessons = get_lessons()
+        results = measure_candidates(scratch, lessons, propose_indexes(scratch, lessons), args.repeat)
+    finally:
+        source.close()
+        scratch.close()
+
+    report = format_report(results, args.db)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(report)
+    else:
+        print(report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,175 @@
+"""
+The lesson catalog: one TOML file per lesson under `catalog/`.
+
+Each file is named after the lesson slug (e.g. `17_inner_join.toml`)
+and holds the lesson's `title`, `description`, `query` and `tags`, plus
+`run = false` for lessons that are not executed against the database
+and an optional `requires` list of prerequisite slugs (see
+`generate_lessons.required_scripts`). Lessons are ordered by slug.
+
+Reading every file just to pick one lesson would defeat the purpose,
+so the catalog keeps an index in `catalog/.index.json` that maps slugs
+to files, tags and prerequisites. The index records the size and
+modification time of every lesson file and is rebuilt automatically
+when a file is added, removed or changed; only the lessons that are
+selected are then parsed.
+"""
+
+import json
+import os
+import sys
+from typing import Dict, Iterable, List, Optional
+
+if sys.version_info >= (3, 11):
+    import tomllib
+else:
+    import tomli as tomllib
+
+# Directory holding the lesson files, next to this module.
+CATALOG_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "catalog")
+
+# Name of the index kept in the catalog directory.
+INDEX_NAME = ".index.json"
+
+# Bump when the layout of the index changes.
+INDEX_VERSION = 1
+
+LESSON_SUFFIX = ".toml"
+
+
+def load_lesson(path: str) -> Dict:
+    """Read one lesson file.
+
+    Returns:
+        The lesson definition, with its `slug` taken from the file name.
+
+    Raises:
+        ValueError: If the file is not valid TOML or lacks a required
+            field.
+    """
+    with open(path, "rb") as f:
+        try:
+            lesson = tomllib.load(f)
+        except tomllib.TOMLDecodeError as exc:
+            raise ValueError(f"{path}: {exc}") from exc
+    missing = [field for field in ("title", "description", "query") if field not in lesson]
+    if missing:
+        raise ValueError(f"{path}: missing {', '.join(missing)}")
+    lesson["slug"] = os.path.basename(path)[:-len(LESSON_SUFFIX)]
+    lesson.setdefault("run", True)
+    lesson.setdefault("tags", [])
+    return lesson
+
+
+def lesson_files(catalog_dir: str) -> Dict[str, List[int]]:
+    """Return the size and modification time of every lesson file."""
+    files = {}
+    with os.scandir(catalog_dir) as entries:
+        for entry in entries:
+            if entry.name.endswith(LESSON_SUFFIX) and entry.is_file():
+                stat = entry.stat()
+                files[entry.name] = [stat.st_size, stat.st_mtime_ns]
+    return files
+
+
+def build_index(catalog_dir: str, files: Dict[str, List[int]]) -> Dict:
+    """Parse every lesson file and build the catalog index."""
+    lessons = []
+    for name in sorted(files):
+        lesson = load_lesson(os.path.join(catalog_dir, name))
+        lessons.append({
+            "slug": lesson["slug"],
+            "file": name,
+            "tags": lesson["tags"],
+            "requires": lesson.get("requires", []),
+        })
+    return {"version": INDEX_VERSION, "files": files, "lessons": lessons}
+
+
+def load_index(catalog_dir: str = CATALOG_DIR) -> List[Dict]:
+    """Return the index entries of every lesson in the catalog, in order,
+    rebuilding the on-disk index first if it is out of date.
+
+    A catalog directory that cannot be written to still works; the index
+    is then rebuilt in memory on every call.
+    """
+    files = lesson_files(catalog_dir)
+    path = os.path.join(catalog_dir, INDEX_NAME)
+    try:
+        with open(path, encoding="utf-8") as f:
+            index = json.load(f)
+        if index.get("version") == INDEX_VERSION and index.get("files") == files:
+            return index["lessons"]
+    except (OSError, ValueError):
+        pass
+    index = build_index(catalog_dir, files)
+    tmp_path = path + ".tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(index, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, path)
+    except OSError:
+        pass
+    return index["lessons"]
+
+
+def lesson_tags(catalog_dir: str = CATALOG_DIR) -> Dict[str, List[str]]:
+    """Map every tag to the slugs of its lessons, in lesson order."""
+    tags: Dict[str, List[str]] = {}
+    for entry in load_index(catalog_dir):
+        for tag in entry["tags"]:
+            tags.setdefault(tag, []).append(entry["slug"])
+    return tags
+
+
+def load_lessons(only: Optional[Iterable[str]] = None, tags: Optional[Iterable[str]] = None,
+                 catalog_dir: str = CATALOG_DIR) -> List[Dict]:
+    """Load lessons from the catalog, parsing only the selected files.
+
+    Args:
+        only: Slugs of lessons to load.
+        tags: Tags whose lessons to load.
+        catalog_dir: Directory holding the lesson files.
+
+    Returns:
+        The lesson definitions in catalog order: every lesson if neither
+        `only` nor `tags` is given, otherwise the union of both
+        selections.
+
+    Raises:
+        ValueError: If a slug or tag is not in the catalog.
+    """
+    index = load_index(catalog_dir)
+    if only is None and tags is None:
+        selected = index
+    else:
+        only = set(only or ())
+        tags = set(tags or ())
+        unknown = sorted(only - {entry["slug"] for entry in index})
+        unknown += sorted(f"tag {tag}" for tag in tags - {t for entry in index for t in entry["tags"]})
+        if unknown:
+            raise ValueError(f"not in the lesson catalog: {', '.join(unknown)}")
+        selected = [entry for entry in index if entry["slug"] in only or tags & set(entry["tags"])]
+    return [load_lesson(os.path.join(catalog_dir, entry["file"])) for entry in selected]
+
+
+def load_requirements(lessons: List[Dict], catalog_dir: str = CATALOG_DIR) -> List[Dict]:
+    """Load the lessons that `lessons` require, directly or indirectly,
+    and that are not already among them.
+
+    Raises:
+        ValueError: If a required lesson is not in the catalog.
+    """
+    by_slug = {entry["slug"]: entry for entry in load_index(catalog_dir)}
+    loaded = {lesson["slug"] for lesson in lessons}
+    pending = [slug for lesson in lessons for slug in lesson.get("requires", ())]
+    needed = set()
+    while pending:
+        slug = pending.pop()
+        if slug in loaded or slug in needed:
+            continue
+        if slug not in by_slug:
+            raise ValueError(f"required lesson {slug} is not in the lesson catalog")
+        needed.add(slug)
+        pending.extend(by_slug[slug]["requires"])
+    return [load_lesson(os.path.join(catalog_dir, by_slug[slug]["file"])) for slug in sorted(needed)]
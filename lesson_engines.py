@@ -0,0 +1,483 @@
+"""
+Execution engines for the runnable lessons: the lesson's SQL on SQLite,
+an equivalent vectorized pandas implementation, and the same SQL on an
+in-process DuckDB database when `duckdb` is installed.
+
+Every engine loads a database once with `load` and then returns the
+complete result of a lesson with `run` as column names and rows, so the
+results of different engines can be compared with `compare_results`.
+The pandas and DuckDB engines copy every table into memory when they
+load, the way `panda_query.ipynb` pulls tables into DataFrames; the
+SQLite engine reads the file in place.
+
+pandas implementations are registered per lesson slug with
+`@pandas_lesson`. Each one receives the tables as DataFrames keyed by
+lower-cased table name and mirrors its lesson query, including the
+row order of `ORDER BY` and the rows picked by `LIMIT`.
+
+See `benchmarks/bench_engines.py` for a side-by-side benchmark.
+"""
+
+import math
+import sqlite3
+from abc import ABC, abstractmethod
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Tuple
+
+from generate_lessons import connect_read_only, execute_script
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+Result = Tuple[List[str], List[tuple]]
+
+# Lesson slug -> pandas implementation, see `pandas_lesson`.
+PANDAS_LESSONS: Dict[str, Callable[[Dict[str, "pd.DataFrame"]], "pd.DataFrame"]] = {}
+
+
+class Engine(ABC):
+    """Runs lessons against one database.
+
+    Subclasses set `name` and implement `load`, `run` and `close`; an
+    engine missing one of them cannot be created.
+    """
+
+    name = ""
+
+    @abstractmethod
+    def load(self, db_path: str) -> None:
+        """Prepare the engine to run lessons against a database."""
+
+    def supports(self, lesson: Dict) -> bool:
+        """Return whether the engine can run a lesson."""
+        return lesson.get("run", True)
+
+    @abstractmethod
+    def run(self, lesson: Dict) -> Result:
+        """Return the column names and every row of a lesson's result."""
+
+    @abstractmethod
+    def close(self) -> None:
+        """Release the loaded data."""
+
+
+class SQLiteEngine(Engine):
+    """Runs the lesson SQL on a read-only connection to the file."""
+
+    name = "sqlite"
+
+    def __init__(self) -> None:
+        self.conn: Optional[sqlite3.Connection] = None
+
+    def load(self, db_path: str) -> None:
+        self.close()
+        self.conn = connect_read_only(db_path)
+
+    def run(self, lesson: Dict) -> Result:
+        columns, rows, _ = execute_script(self.conn, lesson["query"], limit=None)
+        return columns, rows
+
+    def close(self) -> None:
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+def read_tables(db_path: str) -> Dict[str, "pd.DataFrame"]:
+    """Read every user table of a database into a DataFrame, keyed by
+    lower-cased table name.
+    """
+    import pandas as pd
+
+    conn = connect_read_only(db_path)
+    try:
+        names = [row[0] for row in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'")]
+        return {name.lower(): pd.read_sql_query(f'SELECT * FROM "{name}"', conn) for name in names}
+    finally:
+        conn.close()
+
+
+class PandasEngine(Engine):
+    """Runs the registered pandas implementation of a lesson on tables
+    loaded into DataFrames.
+    """
+
+    name = "pandas"
+
+    def __init__(self) -> None:
+        self.tables: Dict[str, "pd.DataFrame"] = {}
+
+    def load(self, db_path: str) -> None:
+        self.tables = read_tables(db_path)
+
+    def supports(self, lesson: Dict) -> bool:
+        return lesson.get("run", True) and lesson["slug"] in PANDAS_LESSONS
+
+    def run(self, lesson: Dict) -> Result:
+        frame = PANDAS_LESSONS[lesson["slug"]](self.tables)
+        return list(frame.columns), list(frame.itertuples(index=False, name=None))
+
+    def close(self) -> None:
+        self.tables = {}
+
+
+class DuckDBEngine(Engine):
+    """Runs the lesson SQL on an in-memory DuckDB copy of the database.
+
+    The tables are copied through pandas, so no DuckDB extension has to
+    be installed. Lessons that use SQLite-only syntax fail with the
+    error DuckDB reports.
+    """
+
+    name = "duckdb"
+
+    def __init__(self) -> None:
+        self.conn = None
+
+    def load(self, db_path: str) -> None:
+        import duckdb
+
+        self.close()
+        self.conn = duckdb.connect()
+        for name, frame in read_tables(db_path).items():
+            self.conn.from_df(frame).create(name)
+
+    def run(self, lesson: Dict) -> Result:
+        cursor = self.conn.execute(lesson["query"])
+        return [desc[0] for desc in cursor.description], cursor.fetchall()
+
+    def close(self) -> None:
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+ENGINES: Dict[str, Callable[[], Engine]] = {
+    SQLiteEngine.name: SQLiteEngine,
+    PandasEngine.name: PandasEngine,
+    DuckDBEngine.name: DuckDBEngine,
+}
+
+# Modules an engine needs besides the standard library.
+ENGINE_REQUIREMENTS = {"pandas": ("pandas",), "duckdb": ("duckdb", "pandas")}
+
+
+def available_engines() -> List[str]:
+    """Return the names of the engines whose dependencies are installed."""
+    import importlib.util
+
+    return [name for name in ENGINES
+            if all(importlib.util.find_spec(module) for module in ENGINE_REQUIREMENTS.get(name, ()))]
+
+
+def _normalize(value):
+    """Map engine-specific values to plain Python ones: NaN and pandas'
+    missing values become None and NumPy scalars become Python scalars.
+    """
+    if value is None:
+        return None
+    if hasattr(value, "item") and not isinstance(value, (str, bytes)):
+        value = value.item()
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    if type(value).__name__ in ("NAType", "NaTType"):
+        return None
+    return value
+
+
+def _same_row(left: tuple, right: tuple) -> bool:
+    if len(left) != len(right):
+        return False
+    for a, b in zip(left, right):
+        a, b = _normalize(a), _normalize(b)
+        if isinstance(a, (int, float)) and isinstance(b, (int, float)):
+            if not math.isclose(a, b, rel_tol=1e-9, abs_tol=1e-9):
+                return False
+        elif a != b:
+            return False
+    return True
+
+
+def compare_results(expected: Result, actual: Result) -> str:
+    """Compare the result of an engine with the reference result.
+
+    Numbers are compared with a relative tolerance of 1e-9, because
+    engines sum floating point values in different orders.
+
+    Returns:
+        `equal` if the columns and rows match in order, `reordered` if
+        the same rows come back in another order, otherwise `differs`.
+    """
+    (expected_columns, expected_rows), (columns, rows) = expected, actual
+    if [c.lower() for c in expected_columns] != [c.lower() for c in columns] or len(expected_rows) != len(rows):
+        return "differs"
+    if all(_same_row(a, b) for a, b in zip(expected_rows, rows)):
+        return "equal"
+
+    def key(row: tuple) -> tuple:
+        return tuple((value is None, repr(value)) for value in map(_normalize, row))
+
+    if all(_same_row(a, b) for a, b in zip(sorted(expected_rows, key=key), sorted(rows, key=key))):
+        return "reordered"
+    return "differs"
+
+
+def pandas_lesson(slug: str) -> Callable:
+    """Register the pandas implementation of a lesson."""
+    def register(func: Callable) -> Callable:
+        PANDAS_LESSONS[slug] = func
+        return func
+    return register
+
+
+def _full_name(frame: "pd.DataFrame") -> "pd.Series":
+    return frame["FirstName"] + " " + frame["LastName"]
+
+
+def _sort(frame: "pd.DataFrame", by, ascending=True) -> "pd.DataFrame":
+    # A stable sort keeps ties in table order, like SQLite's sorter.
+    # SQLite sorts NULL as the smallest value: first in ascending and
+    # last in descending order.
+    keys = [by] if isinstance(by, str) else list(by)
+    orders = [ascending] * len(keys) if isinstance(ascending, bool) else list(ascending)
+    if len(set(orders)) == 1:
+        return frame.sort_values(keys, ascending=orders[0], kind="stable",
+                                 na_position="first" if orders[0] else "last")
+    # Mixed directions: sort each key after a flag that ranks NULL lowest.
+    flags = {f"_not_null_{index}": frame[key].notna() for index, key in enumerate(keys)}
+    columns = [name for pair in zip(flags, keys) for name in pair]
+    ordered = frame.assign(**flags).sort_values(columns, ascending=[order for order in orders for _ in "ab"],
+                                                kind="stable")
+    return ordered.drop(columns=list(flags))
+
+
+@pandas_lesson("01_select_basic")
+def _select_basic(t):
+    return t["artists"].head(5)
+
+
+@pandas_lesson("02_select_columns")
+def _select_columns(t):
+    return t["employees"][["FirstName", "LastName"]]
+
+
+@pandas_lesson("03_where_clause")
+def _where_clause(t):
+    customers = t["customers"]
+    return customers[customers["Country"] == "USA"]
+
+
+@pandas_lesson("04_where_and")
+def _where_and(t):
+    customers = t["customers"]
+    return customers[(customers["Country"] == "USA") & (customers["State"] == "CA")]
+
+
+@pandas_lesson("05_where_or")
+def _where_or(t):
+    customers = t["customers"]
+    return customers[customers["Country"].isin(["Brazil", "France"])]
+
+
+@pandas_lesson("06_where_in")
+def _where_in(t):
+    genres = t["genres"]
+    return genres[genres["Name"].isin(["Rock", "Jazz"])]
+
+
+@pandas_lesson("07_where_between")
+def _where_between(t):
+    tracks = t["tracks"]
+    return tracks.loc[tracks["UnitPrice"].between(0.99, 1.99), ["Name", "UnitPrice"]]
+
+
+@pandas_lesson("08_order_by")
+def _order_by(t):
+    return _sort(t["employees"], "LastName")[["FirstName", "LastName"]]
+
+
+@pandas_lesson("09_order_by_desc")
+def _order_by_desc(t):
+    return _sort(t["tracks"], "UnitPrice", ascending=False)[["Name", "UnitPrice"]].head(5)
+
+
+def _customers_per_country(t):
+    counts = t["customers"].groupby("Country", dropna=False).size().reset_index(name="CustomerCount")
+    return _sort(counts, "CustomerCount", ascending=False)
+
+
+@pandas_lesson("10_group_by")
+def _group_by(t):
+    return _customers_per_country(t)
+
+
+@pandas_lesson("11_having")
+def _having(t):
+    counts = _customers_per_country(t)
+    return counts[counts["CustomerCount"] > 5]
+
+
+@pandas_lesson("12_count")
+def _count(t):
+    import pandas as pd
+
+    return pd.DataFrame({"TrackCount": [len(t["tracks"])]})
+
+
+@pandas_lesson("13_sum")
+def _sum(t):
+    import pandas as pd
+
+    return pd.DataFrame({"TotalRevenue": [t["invoices"]["Total"].sum()]})
+
+
+@pandas_lesson("14_avg")
+def _avg(t):
+    import pandas as pd
+
+    return pd.DataFrame({"AveragePrice": [t["tracks"]["UnitPrice"].mean()]})
+
+
+@pandas_lesson("15_min_max")
+def _min_max(t):
+    import pandas as pd
+
+    prices = t["tracks"]["UnitPrice"]
+    return pd.DataFrame({"MinPrice": [prices.min()], "MaxPrice": [prices.max()]})
+
+
+def _distinct_sorted(series: "pd.Series") -> "pd.DataFrame":
+    return _sort(series.drop_duplicates().to_frame(), series.name)
+
+
+@pandas_lesson("16_distinct")
+def _distinct(t):
+    return _distinct_sorted(t["customers"]["Country"])
+
+
+@pandas_lesson("17_inner_join")
+def _inner_join(t):
+    joined = t["albums"].merge(t["artists"], on="ArtistId")
+    joined = joined.rename(columns={"Title": "Album", "Name": "Artist"})
+    return _sort(joined, ["Artist", "Album"])[["Album", "Artist"]].head(10)
+
+
+@pandas_lesson("18_left_join")
+def _left_join(t):
+    joined = t["customers"].merge(t["invoices"], on="CustomerId", how="left")
+    joined["Customer"] = _full_name(joined)
+    return _sort(joined, "Customer")[["Customer", "InvoiceId", "Total"]].head(10)
+
+
+@pandas_lesson("19_right_join")
+def _right_join(t):
+    joined = t["invoices"].merge(t["customers"], on="CustomerId", how="left")
+    joined["Customer"] = _full_name(joined)
+    return joined[["InvoiceId", "Customer", "Total"]].head(10)
+
+
+@pandas_lesson("20_cross_join")
+def _cross_join(t):
+    import pandas as pd
+
+    # Only the first rows are needed, so only the employees that can
+    # appear in them take part in the cross join.
+    media_types = t["media_types"]
+    employees = t["employees"].head(math.ceil(10 / max(len(media_types), 1)))
+    joined = employees.merge(media_types, how="cross")
+    return pd.DataFrame({"Employee": _full_name(joined), "MediaType": joined["Name"]}).head(10)
+
+
+@pandas_lesson("21_self_join")
+def _self_join(t):
+    import pandas as pd
+
+    employees = t["employees"]
+    joined = employees.merge(employees, left_on="ReportsTo", right_on="EmployeeId",
+                             how="left", suffixes=("", "_m"))
+    frame = pd.DataFrame({
+        "Employee": _full_name(joined),
+        "Manager": joined["FirstName_m"] + " " + joined["LastName_m"],
+    })
+    return _sort(frame, "Employee").head(10)
+
+
+@pandas_lesson("22_union")
+def _union(t):
+    import pandas as pd
+
+    return _distinct_sorted(pd.concat([t["customers"]["Country"], t["employees"]["Country"]]))
+
+
+@pandas_lesson("23_union_all")
+def _union_all(t):
+    import pandas as pd
+
+    countries = pd.concat([t["customers"]["Country"], t["customers"]["Country"]]).to_frame()
+    return _sort(countries, "Country").head(20)
+
+
+@pandas_lesson("24_except")
+def _except(t):
+    countries = t["customers"]["Country"]
+    return _distinct_sorted(countries[~countries.isin(t["employees"]["Country"])])
+
+
+@pandas_lesson("25_intersect")
+def _intersect(t):
+    countries = t["customers"]["Country"]
+    return _distinct_sorted(countries[countries.isin(t["employees"]["Country"])])
+
+
+@pandas_lesson("26_subquery")
+def _subquery(t):
+    tracks = t["tracks"]
+    above = tracks[tracks["UnitPrice"] > tracks["UnitPrice"].mean()]
+    return _sort(above, "UnitPrice", ascending=False)[["Name", "UnitPrice"]].head(10)
+
+
+@pandas_lesson("27_exists")
+def _exists(t):
+    artists = t["artists"]
+    with_albums = artists[artists["ArtistId"].isin(t["albums"]["ArtistId"])]
+    return _sort(with_albums, "Name")[["Name"]].head(10)
+
+
+@pandas_lesson("28_case")
+def _case(t):
+    import numpy as np
+
+    top = _sort(t["tracks"], "UnitPrice", ascending=False)[["Name", "UnitPrice"]].head(10)
+    return top.assign(PriceCategory=np.where(top["UnitPrice"] > 1.00, "Expensive", "Cheap"))
+
+
+@pandas_lesson("38_window_functions")
+def _window_functions(t):
+    ranked = _sort(t["tracks"], "UnitPrice", ascending=False)[["TrackId", "Name", "UnitPrice"]]
+    return ranked.assign(PriceRank=range(1, len(ranked) + 1)).head(10)
+
+
+@pandas_lesson("39_cte")
+def _cte(t):
+    return _sort(t["invoices"], "Total", ascending=False)[["InvoiceId", "Total"]].head(5)
+
+
+@pandas_lesson("40_recursive_cte")
+def _recursive_cte(t):
+    import pandas as pd
+
+    employees = t["employees"].assign(Name=_full_name(t["employees"]))
+    level = employees.loc[employees["ReportsTo"].isna(), ["EmployeeId", "Name"]]
+    level = level.assign(Level=0, Path=level["Name"])
+    levels = []
+    while not level.empty:
+        levels.append(level)
+        children = employees.merge(level[["EmployeeId", "Level", "Path"]], left_on="ReportsTo",
+                                   right_on="EmployeeId", suffixes=("", "_h"))
+        level = pd.DataFrame({
+            "EmployeeId": children["EmployeeId"],
+            "Name": children["Name"],
+            "Level": children["Level"] + 1,
+            "Path": children["Path"] + " -> " + children["Name"],
+        })
+    return _sort(pd.concat(levels, ignore_index=True), ["Level", "Name"]).head(20)
@@ -0,0 +1,185 @@
+"""
+Lightweight helpers for looking inside the lesson queries.
+
+The lesson queries are short, hand-written SQLite statements, so a
+keyword-driven scan is enough to find the tables a query reads and the
+columns it filters, joins, groups and sorts on. This is not a full SQL
+parser: comments and string literals are blanked out first, and
+identifiers are matched against the real columns of the tables found
+in the query.
+"""
+
+import re
+import sqlite3
+from typing import Dict, List, Set
+
+# Keywords that start a clause whose identifiers we classify.
+_CLAUSES = re.compile(
+    r"\b(SELECT|FROM|JOIN|ON|WHERE|GROUP\s+BY|ORDER\s+BY|HAVING|LIMIT|UNION|EXCEPT|INTERSECT)\b",
+    re.IGNORECASE,
+)
+
+# `FROM table [AS] alias` and `JOIN table [AS] alias`.
+_TABLE_REF = re.compile(
+    r"\b(?:FROM|JOIN)\s+\"?(\w+)\"?(?:\s+(?:AS\s+)?(?!(?:ON|WHERE|JOIN|LEFT|RIGHT|INNER|CROSS|FULL|"
+    r"OUTER|NATURAL|GROUP|ORDER|HAVING|LIMIT|UNION|EXCEPT|INTERSECT|USING)\b)(\w+))?",
+    re.IGNORECASE,
+)
+
+_IDENTIFIER = re.compile(r"\b(?:(\w+)\.)?([A-Za-z_]\w*)\b")
+
+# Clause name -> role of the columns referenced inside it.
+_ROLES = {
+    "ON": "filter",
+    "WHERE": "filter",
+    "HAVING": "filter",
+    "GROUP BY": "order",
+    "ORDER BY": "order",
+    "SELECT": "select",
+}
+
+
+def strip_sql(query: str) -> str:
+    """Blank out comments and string literals so that keyword and
+    identifier scans do not match text inside them.
+    """
+    query = re.sub(r"--[^\n]*", " ", query)
+    query = re.sub(r"/\*.*?\*/", " ", query, flags=re.DOTALL)
+    return re.sub(r"'(?:[^']|'')*'", "''", query)
+
+
+def table_aliases(query: str) -> Dict[str, str]:
+    """Map every table name and alias used in a query to its table.
+
+    Common table expression names are included as if they were tables;
+    callers that need real tables should check them against the schema.
+    """
+    aliases = {}
+    for table, alias in _TABLE_REF.findall(strip_sql(query)):
+        aliases[table.lower()] = table
+        if alias:
+            aliases[alias.lower()] = table
+    return aliases
+
+
+def referenced_tables(query: str, known_tables: Set[str] = None) -> Set[str]:
+    """Return the names of the tables a query reads or writes.
+
+    Args:
+        query: SQL text, possibly several statements.
+        known_tables: Optional set of real table names (any case). When
+            given, only these are returned, which drops CTE names.
+
+    Returns:
+        Lower-cased table names.
+    """
+    stripped = strip_sql(query)
+    names = {table.lower() for table, _ in _TABLE_REF.findall(stripped)}
+    names.update(match.lower() for match in re.findall(
+        r"\b(?:INTO|UPDATE|TABLE|VIEW|INDEX\s+\w+\s+ON)\s+(?:IF\s+(?:NOT\s+)?EXISTS\s+)?\"?(\w+)",
+        stripped, re.IGNORECASE))
+    if known_tables is not None:
+        known = {table.lower() for table in known_tables}
+        names &= known
+    return names
+
+
+def table_columns(conn: sqlite3.Connection) -> Dict[str, List[str]]:
+    """Return the columns of every user table, keyed by lower-cased name."""
+    tables = [row[0] for row in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'")]
+    return {
+        table.lower(): [row[1] for row in conn.execute(f'PRAGMA table_info("{table}")')]
+        for table in tables
+    }
+
+
+def column_roles(query: str, columns: Dict[str, List[str]]) -> Dict[str, Dict[str, List[str]]]:
+    """Classify the columns a query uses, table by table.
+
+    Args:
+        query: A single SQL query.
+        columns: Table columns as returned by `table_columns`.
+
+    Returns:
+        `{table: {"filter": [...], "order": [...], "select": [...]}}`
+        for every real table in the query. Columns appear in the order
+        they are first mentioned within each role. Qualified references
+        (`t.Col`) are resolved through the query's aliases; unqualified
+        ones are attributed to every table of the query that has such a
+        column.
+    """
+    stripped = strip_sql(query)
+    aliases = {alias: table.lower() for alias, table in table_aliases(stripped).items()
+               if table.lower() in columns}
+    tables = sorted(set(aliases.values()))
+    lookup = {
+        table: {column.lower(): column for column in columns[table]}
+        for table in tables
+    }
+    roles = {table: {"filter": [], "order": [], "select": []} for table in tables}
+
+    def add(table: str, role: str, name: str) -> None:
+        column = lookup[table].get(name.lower())
+        if column and column not in roles[table][role]:
+            roles[table][role].append(column)
+
+    parts = _CLAUSES.split(stripped)
+    # re.split with one group alternates text and clause keywords.
+    for keyword, text in zip(parts[1::2], parts[2::2]):
+        role = _ROLES.get(re.sub(r"\s+", " ", keyword.upper()))
+        if role is None:
+            continue
+        for qualifier, name in _IDENTIFIER.findall(text):
+            if qualifier:
+                table = aliases.get(qualifier.lower())
+                if table:
+                    add(table, role, name)
+            else:
+                for table in tables:
+                    add(table, role, name)
+    return roles
+
+
+# String literals, quoted identifiers, comments and whitespace runs.
+_NORMALIZE_TOKENS = re.compile(
+    r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|(?:--[^\n]*|/\*.*?\*/|\s+)+", re.DOTALL)
+
+
+def normalize_sql(query: str) -> str:
+    """Return a canonical form of a query for use as a cache key.
+
+    Comments are removed, runs of whitespace collapse to one space and
+    trailing semicolons are dropped. String literals and quoted
+    identifiers are kept verbatim, so queries that differ only in a
+    literal value stay distinct.
+    """
+    def replace(match: "re.Match[str]") -> str:
+        token = match.group(0)
+        if token[0] in "'\"":
+            return token
+        return " "
+
+    return _NORMALIZE_TOKENS.sub(replace, query).strip().rstrip(";").strip()
+
+
+# String and numeric literals, outside quoted identifiers.
+_LITERALS = re.compile(r"'(?:[^']|'')*'|(\"(?:[^\"]|\"\")*\")|\b\d+(?:\.\d*)?(?:[eE][-+]?\d+)?\b|\bX'[0-9A-Fa-f]*'")
+
+# A parenthesised list of placeholders, e.g. `IN (?, ?, ?)`.
+_PLACEHOLDER_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+
+
+def fingerprint_sql(query: str) -> str:
+    """Return the shape of a query, for grouping statements that differ
+    only in their literal values.
+
+    The query is normalized as by `normalize_sql`, then every string,
+    number and blob literal becomes `?` and a list of placeholders
+    becomes a single `(?)`, so `WHERE Id IN (1, 2)` and
+    `WHERE Id IN (3, 4, 5)` have the same fingerprint.
+    """
+    def replace(match: "re.Match[str]") -> str:
+        return match.group(1) or "?"
+
+    return _PLACEHOLDER_LIST.sub("(?)", _LITERALS.sub(replace, normalize_sql(query)))
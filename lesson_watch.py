@@ -0,0 +1,408 @@
+"""
+Watch mode for the lesson generator: regenerate only the lessons that a
+change to the database or to the lesson catalog affects.
+
+The watcher polls instead of relying on inotify so that it works the
+same everywhere without extra dependencies. Every `interval` seconds it
+checks:
+
+* the size and modification time of the lesson files (see
+  `lesson_catalog.lesson_files`); an added or edited file regenerates
+  that lesson and, with `--execute-mutating`, the lessons that require
+  it;
+* the database file and `PRAGMA data_version` on a connection that is
+  kept open between checks. The data version changes whenever another
+  connection commits, which also covers writes that do not touch the
+  file's modification time, such as in WAL mode. When it changes, only
+  the tables the watched lessons read (see
+  `lesson_sql.referenced_tables`) are compared with the previous check,
+  and only the lessons that reference a changed table are regenerated.
+
+Comparing a table is split in two, so that a change is handled in
+milliseconds even on a large database:
+
+* right after the change, each watched table's `TableSignature` (its
+  schema, row count and largest rowid, which any insert, delete or
+  schema change alters) is compared, without reading the rows;
+* tables whose signature did not change may still have been updated in
+  place. On the following checks they are hashed, for up to
+  `VERIFY_SECONDS` per check, and compared with the digest taken when
+  the watcher started or last verified them.
+
+A table whose signature changed is hashed again once its lessons are
+regenerated, so that later changes are compared with the data the
+lessons show.
+
+Lessons are rendered on the warm connection and sample results go
+through a `ResultCache`, so a typical change is handled in
+milliseconds. Start it through the generator:
+
+    python generate_lessons.py --watch
+"""
+
+import hashlib
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, NamedTuple, Optional, Set, Tuple
+
+from generate_lessons import (
+    DEFAULT_WATCH_INTERVAL, QueryBudget, ResultCache, ScratchDatabase, connect_read_only,
+    generate_lessons, required_scripts,
+)
+from lesson_catalog import CATALOG_DIR, LESSON_SUFFIX, lesson_files, load_lessons, load_requirements
+from lesson_sql import referenced_tables
+
+# Rows hashed per fetch when fingerprinting a table.
+_FINGERPRINT_BATCH = 1000
+
+# Seconds a check may spend hashing tables to find updates in place; a
+# table that has been started is always finished.
+VERIFY_SECONDS = 0.05
+
+
+class TableSignature(NamedTuple):
+    """Cheap signs that a table changed. Inserts, deletes and schema
+    changes alter them; updates in place usually do not.
+    """
+
+    sql: str
+    rows: int
+    max_rowid: Optional[int]
+
+
+def _quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def user_tables(conn: sqlite3.Connection) -> Dict[str, str]:
+    """Return the `CREATE TABLE` statement of every user table, keyed by
+    lower-cased table name.
+    """
+    return {name.lower(): sql or "" for name, sql in conn.execute(
+        "SELECT name, sql FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'")}
+
+
+def table_signature(conn: sqlite3.Connection, name: str, sql: str) -> TableSignature:
+    """Return the signature of a table, counting its rows in SQLite."""
+    try:
+        rows, max_rowid = conn.execute(f"SELECT COUNT(*), MAX(rowid) FROM {_quote(name)}").fetchone()
+    except sqlite3.OperationalError:
+        # A WITHOUT ROWID table.
+        rows, max_rowid = conn.execute(f"SELECT COUNT(*) FROM {_quote(name)}").fetchone()[0], None
+    return TableSignature(sql, rows, max_rowid)
+
+
+def table_digest(conn: sqlite3.Connection, name: str) -> str:
+    """Return a digest of every row of a table, which reads all of them."""
+    digest = hashlib.blake2b(digest_size=16)
+    cursor = conn.execute(f"SELECT * FROM {_quote(name)}")
+    while True:
+        rows = cursor.fetchmany(_FINGERPRINT_BATCH)
+        if not rows:
+            break
+        digest.update(repr(rows).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class WatchEvent(NamedTuple):
+    """What one check found and did."""
+
+    changed_tables: List[str]
+    changed_lessons: List[str]
+    regenerated: List[str]
+    exceeded: List[Tuple[str, str]]
+    elapsed: float
+
+
+def _file_state(path: str) -> Optional[Tuple[int, int, int]]:
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+
+class LessonWatcher:
+    """Keeps the generated lessons in step with the database and the
+    lesson catalog.
+
+    Args:
+        db_path: Path to the SQLite database.
+        lesson_dir: Directory the lesson files are written to.
+        only: Slugs of the lessons to watch, see `lesson_catalog.load_lessons`.
+        tags: Tags of the lessons to watch.
+        count_total: Whether to report total row counts.
+        execute_mutating: Whether to run the data-modifying lessons on a
+            scratch copy of the database, see `ScratchDatabase`.
+        budget: Optional limits for every lesson query.
+        catalog_dir: Directory holding the lesson files.
+    """
+
+    def __init__(self, db_path: str, lesson_dir: str, only: Optional[List[str]] = None,
+                 tags: Optional[List[str]] = None, count_total: bool = False,
+                 execute_mutating: bool = False, budget: Optional[QueryBudget] = None,
+                 catalog_dir: str = CATALOG_DIR) -> None:
+        self.db_path = db_path
+        self.lesson_dir = lesson_dir
+        self.only = only
+        self.tags = tags
+        self.count_total = count_total
+        self.execute_mutating = execute_mutating
+        self.budget = budget
+        self.catalog_dir = catalog_dir
+        self.cache = ResultCache()
+        self.scratch: Optional[ScratchDatabase] = None
+        self.conn: Optional[sqlite3.Connection] = None
+        self.lessons: List[Dict] = []
+        self._files: Dict[str, List[int]] = {}
+        self._db_state: Optional[Tuple[int, int, int]] = None
+        self._data_version: Optional[int] = None
+        self._known: Set[str] = set()
+        # Signatures of the watched tables at the last check, and the
+        # digests of their rows when they were last verified or
+        # regenerated (None if they changed since).
+        self._signatures: Dict[str, TableSignature] = {}
+        self._digests: Dict[str, Optional[str]] = {}
+        # Watched tables whose rows may have changed since their digest.
+        self._unverified: Set[str] = set()
+
+    def _open(self) -> None:
+        """(Re)open the warm connection. The signatures and digests are
+        kept, to compare the new file with the old one.
+        """
+        if self.conn is not None:
+            self.conn.close()
+        self._db_state = _file_state(self.db_path)
+        self.conn = connect_read_only(self.db_path)
+        self._data_version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+        if self.scratch is not None:
+            # The scratch copy is taken again from the new data on first use.
+            self.scratch.close()
+
+    @contextmanager
+    def _read(self) -> Iterator[Dict[str, str]]:
+        """Read the database in one transaction, so that signatures and
+        digests describe the same version of it.
+
+        Yields:
+            The user tables, see `user_tables`.
+        """
+        self.conn.execute("BEGIN")
+        try:
+            yield user_tables(self.conn)
+        finally:
+            self.conn.execute("COMMIT")
+
+    def _watched_tables(self, known: Set[str]) -> Set[str]:
+        """Return the tables that the watched lessons read."""
+        tables: Set[str] = set()
+        for lesson in self.lessons:
+            tables |= self._tables_of(lesson, known)
+        return tables
+
+    def _watch_new_tables(self) -> None:
+        """Take the signature and digest of every watched table that has
+        none yet.
+        """
+        with self._read() as tables:
+            self._known = set(tables)
+            for name in self._watched_tables(self._known) - set(self._signatures):
+                if name in tables:
+                    self._signatures[name] = table_signature(self.conn, name, tables[name])
+                    self._digests[name] = table_digest(self.conn, name)
+
+    def _compare_signatures(self) -> List[str]:
+        """Return the watched tables whose signature changed since the
+        last check, and mark the others as unverified.
+        """
+        changed = set()
+        with self._read() as tables:
+            self._known = set(tables)
+            signatures = {}
+            for name in self._watched_tables(self._known) | set(self._signatures):
+                if name not in tables:
+                    if name in self._signatures:
+                        changed.add(name)
+                    continue
+                signatures[name] = table_signature(self.conn, name, tables[name])
+                if signatures[name] != self._signatures.get(name) or self._digests.get(name) is None:
+                    # A table without a digest may have changed in place.
+                    changed.add(name)
+                    self._digests[name] = None
+                else:
+                    self._unverified.add(name)
+        self._signatures = signatures
+        self._digests = {name: self._digests.get(name) for name in signatures}
+        self._unverified = (self._unverified & set(signatures)) | {name for name in changed if name in signatures}
+        return sorted(changed)
+
+    def _record_digests(self, names: List[str]) -> None:
+        """Take the digest of tables whose lessons were just regenerated.
+        If the database changed meanwhile, they keep no digest and are
+        compared as changed on the next check.
+        """
+        if not names or _file_state(self.db_path) != self._db_state:
+            return
+        with self._read():
+            if self.conn.execute("PRAGMA data_version").fetchone()[0] != self._data_version:
+                return
+            for name in names:
+                if name in self._signatures:
+                    self._digests[name] = table_digest(self.conn, name)
+                    self._unverified.discard(name)
+
+    def _verify(self, seconds: float = VERIFY_SECONDS) -> List[str]:
+        """Hash unverified tables for up to `seconds`, as long as the
+        database does not change meanwhile.
+
+        Returns:
+            The tables whose rows changed since their last digest.
+        """
+        if not self._unverified or _file_state(self.db_path) != self._db_state:
+            return []
+        deadline = time.perf_counter() + seconds
+        changed = []
+        with self._read():
+            if self.conn.execute("PRAGMA data_version").fetchone()[0] != self._data_version:
+                return []
+            for name in sorted(self._unverified):
+                if time.perf_counter() > deadline:
+                    break
+                digest = table_digest(self.conn, name)
+                if self._digests[name] not in (None, digest):
+                    changed.append(name)
+                self._digests[name] = digest
+                self._unverified.discard(name)
+        return changed
+
+    def _load_lessons(self) -> None:
+        self._files = lesson_files(self.catalog_dir)
+        self.lessons = load_lessons(self.only, self.tags, self.catalog_dir)
+        if self.execute_mutating:
+            if self.scratch is None:
+                self.scratch = ScratchDatabase(self.db_path, budget=self.budget)
+            self.scratch.register(load_requirements(self.lessons, self.catalog_dir))
+            self.scratch.register(self.lessons)
+
+    def _generate(self, lessons: List[Dict], use_cache: bool) -> List[str]:
+        return generate_lessons(self.db_path, lessons, self.lesson_dir, count_total=self.count_total,
+                                use_cache=use_cache, scratch=self.scratch, result_cache=self.cache,
+                                budget=self.budget, conn=self.conn)
+
+    def start(self) -> List[str]:
+        """Open the database, load the lessons and bring every lesson file
+        up to date, using the generator's manifest cache.
+
+        Returns:
+            The slugs of the lessons that were rendered.
+        """
+        self._load_lessons()
+        self._open()
+        self._watch_new_tables()
+        return self._generate(self.lessons, use_cache=True)
+
+    def _tables_of(self, lesson: Dict, known: Set[str]) -> Set[str]:
+        """Return the tables whose data a lesson's file depends on."""
+        if lesson.get("run", True):
+            return referenced_tables(lesson["query"], known)
+        if self.scratch is None:
+            return set()
+        scripts = required_scripts(lesson, self.scratch.lessons_by_slug) + [lesson["query"]]
+        return referenced_tables("\n".join(scripts), known)
+
+    def _changed_tables(self) -> List[str]:
+        state = _file_state(self.db_path)
+        if state is None:
+            # The file is being replaced; look again on the next check.
+            return []
+        version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+        if state == self._db_state and version == self._data_version:
+            return []
+        if state[0] != self._db_state[0]:
+            # A new file was moved into place; the old connection still
+            # reads the old one.
+            self._open()
+        else:
+            self._db_state, self._data_version = state, version
+            if self.scratch is not None:
+                self.scratch.close()
+        return self._compare_signatures()
+
+    def poll(self) -> WatchEvent:
+        """Check once for changes and regenerate the affected lessons."""
+        start = time.perf_counter()
+        changed_tables = self._changed_tables()
+        if not changed_tables:
+            # Only while the database is quiet, so a change is handled
+            # without first hashing rows.
+            changed_tables = self._verify()
+        changed_lessons: List[str] = []
+        files = lesson_files(self.catalog_dir)
+        if files != self._files:
+            previous = self._files
+            self._load_lessons()
+            self._watch_new_tables()
+            changed_lessons = sorted(name[:-len(LESSON_SUFFIX)] for name in files
+                                     if previous.get(name) != files[name])
+
+        affected = set(changed_lessons)
+        if changed_tables:
+            known = self._known | set(changed_tables)
+            affected.update(lesson["slug"] for lesson in self.lessons
+                            if self._tables_of(lesson, known) & set(changed_tables))
+        if self.scratch is not None and changed_lessons:
+            affected.update(lesson["slug"] for lesson in self.lessons
+                            if set(changed_lessons) & set(lesson.get("requires", ())))
+        regenerated: List[str] = []
+        exceeded: List[Tuple[str, str]] = []
+        if affected:
+            lessons = [lesson for lesson in self.lessons if lesson["slug"] in affected]
+            regenerated = self._generate(lessons, use_cache=False)
+            if self.budget is not None:
+                exceeded = [(slug, self.budget.exceeded[slug]) for slug in regenerated
+                            if slug in self.budget.exceeded]
+        elapsed = time.perf_counter() - start
+        self._record_digests([name for name in changed_tables if self._digests.get(name) is None])
+        return WatchEvent(changed_tables, changed_lessons, regenerated, exceeded, elapsed)
+
+    def run(self, interval: float = DEFAULT_WATCH_INTERVAL, checks: Optional[int] = None) -> None:
+        """Poll for changes until interrupted, printing what was done.
+
+        Args:
+            interval: Seconds between two checks.
+            checks: Stop after this many checks; None runs until Ctrl+C.
+        """
+        rendered = self.start()
+        print(f"Rendered {len(rendered)} lesson(s); watching {self.db_path} and "
+              f"{self.catalog_dir} for changes (Ctrl+C to stop).", flush=True)
+        count = 0
+        try:
+            while checks is None or count < checks:
+                time.sleep(interval)
+                count += 1
+                event = self.poll()
+                if not event.regenerated and not event.changed_tables and not event.changed_lessons:
+                    continue
+                causes = [f"table {name}" for name in event.changed_tables]
+                causes += [f"lesson {slug}" for slug in event.changed_lessons]
+                print(f"Changed {', '.join(causes)}: regenerated {len(event.regenerated)} "
+                      f"lesson(s) in {event.elapsed * 1000:.1f} ms"
+                      + (f" ({', '.join(event.regenerated)})" if event.regenerated else ""),
+                      flush=True)
+                for slug, reason in event.exceeded:
+                    print(f"  {slug}: {reason}", flush=True)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        """Close the warm connection, the result cache and the scratch copy."""
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+        if self.scratch is not None:
+            self.scratch.close()
+        self.cache.close()
@@ -0,0 +1,705 @@
+"""
+Partition the sales fact tables, `invoices` and `invoice_items`, into
+separate database files and run aggregate queries over the partitions
+in parallel.
+
+`partition_database` writes a partitioned copy of a database to a
+directory:
+
+* `main.db` holds every other table;
+* one `part_<label>.db` per partition holds the invoices of some years
+  (`by="year"`, on `InvoiceDate`) or of the customers of some countries
+  (`by="country"`, on `customers.Country`), together with their invoice
+  lines, so the two tables are partitioned the same way;
+* `manifest.json` lists the partitions and the keys in each.
+
+SQLite attaches at most `SQLITE_LIMIT_ATTACHED` databases (10 by
+default) to a connection, so when there are more years or countries
+than that, neighbouring years or countries of similar sizes share a
+partition.
+
+A `PartitionedDatabase` opens such a directory. `connect` returns a
+read-only connection to `main.db` with the partitions ATTACHed and
+temporary `invoices` and `invoice_items` views that combine them with
+`UNION ALL`, so any lesson query runs unchanged. `execute` goes further
+for aggregate queries: `plan_fan_out` splits the query into a partial
+aggregate that runs on one connection per partition, on a thread pool,
+and a merge query that combines the partial results (sums of sums and
+counts, minimum of minimums, `AVG` from sums and counts) and applies
+`HAVING`, `ORDER BY` and `LIMIT`. Queries that cannot be split that way,
+e.g. those that are not aggregates, outer-join a fact table to another
+table or use `COUNT(DISTINCT ...)`, run on the combined views.
+
+Run this script from the root of the project directory to partition a
+database, optionally running a query on the result:
+
+    python partitioned_sales.py --db bench_data/chinook_x100.db --by year \\
+        --query "SELECT BillingCountry, SUM(Total) FROM invoices GROUP BY 1 ORDER BY 2 DESC"
+"""
+
+import argparse
+import json
+import os
+import re
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from generate_lessons import DEFAULT_DB_PATH, connect_read_only, require_database, rows_to_markdown
+from lesson_sql import normalize_sql, referenced_tables
+
+# The tables split across partitions; the others stay in `main.db`.
+FACT_TABLES = ("invoices", "invoice_items")
+
+# Partition key of an invoice `i` of customer `c`, per partitioning mode.
+PARTITION_KEYS = {
+    "year": "strftime('%Y', i.InvoiceDate)",
+    "country": "COALESCE(c.Country, '')",
+}
+
+# Directory holding the partitioned copy of a database by default.
+DEFAULT_PARTITION_DIR = "partitions"
+
+MAIN_NAME = "main.db"
+MANIFEST_NAME = "manifest.json"
+
+# Aggregate functions a fan-out can split into partial and merge steps.
+_AGGREGATES = re.compile(r"\b(COUNT|SUM|TOTAL|MIN|MAX|AVG)\s*\(", re.IGNORECASE)
+
+# Aggregates it cannot split; such queries run on the combined views.
+_OTHER_AGGREGATES = re.compile(r"\b(GROUP_CONCAT|STRING_AGG|JSON_GROUP_ARRAY|JSON_GROUP_OBJECT)\s*\(",
+                               re.IGNORECASE)
+
+_CLAUSE = re.compile(r"\b(SELECT|FROM|WHERE|GROUP BY|HAVING|ORDER BY|LIMIT|WINDOW)\b", re.IGNORECASE)
+
+
+class Partition(NamedTuple):
+    """One file of a partitioned database."""
+
+    label: str
+    path: str
+    keys: List[str]
+
+
+class FanOutPlan(NamedTuple):
+    """How to run an aggregate query over partitions.
+
+    `partial_sql` runs on every partition and returns the columns
+    `partial_columns`; `merge_sql` reads those rows from a `partials`
+    table and returns the result of the original query.
+    """
+
+    partial_sql: str
+    partial_columns: List[str]
+    merge_sql: str
+
+
+def _file_label(key: str) -> str:
+    return re.sub(r"\W+", "_", key).strip("_") or "none"
+
+
+def assign_partitions(counts: Dict[str, int], by: str, max_partitions: int) -> List[Tuple[str, List[str]]]:
+    """Group partition keys into at most `max_partitions` partitions.
+
+    Every key gets its own partition when there are few enough.
+    Otherwise years are cut into ranges of consecutive years and
+    countries are spread so that the partitions hold similar numbers of
+    invoices.
+
+    Args:
+        counts: Number of invoices per key.
+        by: `year` or `country`.
+        max_partitions: Largest number of partitions to create.
+
+    Returns:
+        A label and the keys of each partition.
+    """
+    keys = sorted(counts)
+    if len(keys) <= max_partitions:
+        return [(_file_label(key), [key]) for key in keys]
+    if by == "year":
+        target = sum(counts.values()) / max_partitions
+        groups: List[List[str]] = [[]]
+        filled = 0
+        for index, key in enumerate(keys):
+            remaining = len(keys) - index
+            if groups[-1] and (filled + counts[key] / 2 > target * len(groups)
+                               or remaining <= max_partitions - len(groups)):
+                groups.append([])
+            groups[-1].append(key)
+            filled += counts[key]
+        return [(f"{group[0]}-{group[-1]}" if len(group) > 1 else group[0], group) for group in groups]
+    bins: List[List[str]] = [[] for _ in range(max_partitions)]
+    sizes = [0] * max_partitions
+    for key in sorted(keys, key=lambda key: (-counts[key], key)):
+        lightest = sizes.index(min(sizes))
+        bins[lightest].append(key)
+        sizes[lightest] += counts[key]
+    return [(f"group{index}", sorted(group)) for index, group in enumerate(bins)]
+
+
+def partition_database(source: str, directory: str, by: str = "year",
+                       max_partitions: Optional[int] = None) -> Dict:
+    """Write a partitioned copy of a database, replacing any previous one.
+
+    Args:
+        source: Path to the Chinook database.
+        directory: Directory to write `main.db`, the partitions and the
+            manifest to.
+        by: `year` or `country`, see `PARTITION_KEYS`.
+        max_partitions: Largest number of partitions; defaults to the
+            number of databases SQLite can attach to a connection.
+
+    Returns:
+        The manifest.
+
+    Raises:
+        ValueError: If `by` is unknown, or if `directory` exists and is
+            neither empty nor a partitioned database written earlier.
+        RuntimeError: If rows were lost, e.g. invoice lines whose
+            invoice does not exist.
+    """
+    if by not in PARTITION_KEYS:
+        raise ValueError(f"Unknown partitioning {by!r}, expected one of {', '.join(PARTITION_KEYS)}")
+    if os.path.lexists(directory):
+        if not os.path.isdir(directory) or os.path.islink(directory):
+            raise ValueError(f"{directory} exists and is not a directory")
+        if os.listdir(directory) and not os.path.isfile(os.path.join(directory, MANIFEST_NAME)):
+            raise ValueError(f"{directory} is not empty and holds no {MANIFEST_NAME}; refusing to replace it")
+    parent = os.path.dirname(os.path.abspath(directory))
+    os.makedirs(parent, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(prefix=os.path.basename(os.path.abspath(directory)) + ".", suffix=".tmp", dir=parent)
+    try:
+        manifest = _write_partitions(source, tmp_dir, by, max_partitions)
+        shutil.rmtree(directory, ignore_errors=True)
+        os.replace(tmp_dir, directory)
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+    return manifest
+
+
+def _write_partitions(source: str, tmp_dir: str, by: str, max_partitions: Optional[int]) -> Dict:
+    """Write the files of `partition_database` into an empty directory.
+
+    Returns:
+        The manifest.
+    """
+    source_uri = Path(source).absolute().as_uri() + "?mode=ro"
+
+    src = sqlite3.connect(source_uri, uri=True)
+    try:
+        if max_partitions is None:
+            max_partitions = src.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED)
+        key = PARTITION_KEYS[by]
+        counts = dict(src.execute(
+            f"SELECT {key}, COUNT(*) FROM invoices i LEFT JOIN customers c ON c.CustomerId = i.CustomerId "
+            "GROUP BY 1"))
+        totals = {table: src.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] for table in FACT_TABLES}
+        schema = src.execute(
+            "SELECT type, sql FROM sqlite_master WHERE tbl_name IN (?, ?) AND sql IS NOT NULL "
+            "ORDER BY tbl_name = 'invoice_items', name", FACT_TABLES).fetchall()
+        main = sqlite3.connect(os.path.join(tmp_dir, MAIN_NAME))
+        try:
+            src.backup(main)
+            for table in reversed(FACT_TABLES):
+                main.execute(f"DROP TABLE {table}")
+            main.execute("VACUUM")
+        finally:
+            main.close()
+    finally:
+        src.close()
+
+    partitions = []
+    for label, keys in assign_partitions(counts, by, max_partitions):
+        name = f"part_{label}.db"
+        conn = sqlite3.connect(os.path.join(tmp_dir, name))
+        try:
+            conn.execute("PRAGMA journal_mode = OFF")
+            conn.execute("PRAGMA synchronous = OFF")
+            conn.execute("ATTACH ? AS src", (source_uri,))
+            with conn:
+                for kind, sql in schema:
+                    if kind == "table":
+                        conn.execute(sql)
+                conn.execute(
+                    f"INSERT INTO main.invoices SELECT i.* FROM src.invoices i "
+                    f"LEFT JOIN src.customers c ON c.CustomerId = i.CustomerId "
+                    f"WHERE {key} IN (SELECT value FROM json_each(?)) ORDER BY i.InvoiceId", (json.dumps(keys),))
+                conn.execute(
+                    "INSERT INTO main.invoice_items SELECT ii.* FROM src.invoice_items ii "
+                    "WHERE ii.InvoiceId IN (SELECT InvoiceId FROM main.invoices) ORDER BY ii.InvoiceLineId")
+                # Indexed once the rows are in, which is cheaper than row by row.
+                for kind, sql in schema:
+                    if kind == "index":
+                        conn.execute(sql)
+            rows = {table: conn.execute(f"SELECT COUNT(*) FROM main.{table}").fetchone()[0]
+                    for table in FACT_TABLES}
+            conn.execute("DETACH src")
+            conn.execute("ANALYZE")
+        finally:
+            conn.close()
+        partitions.append({"label": label, "file": name, "keys": keys, "rows": rows})
+
+    for table, total in totals.items():
+        partitioned = sum(partition["rows"][table] for partition in partitions)
+        if partitioned != total:
+            raise RuntimeError(f"{table}: {total} rows in {source} but {partitioned} in the partitions")
+    manifest = {"source": os.path.abspath(source), "by": by, "partitions": partitions}
+    with open(os.path.join(tmp_dir, MANIFEST_NAME), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+        f.write("\n")
+    return manifest
+
+
+def _mask(sql: str) -> str:
+    """Blank out the inside of string literals and quoted identifiers,
+    keeping every position, so that scans skip text inside them.
+    """
+    return re.sub(r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"",
+                  lambda match: match.group(0)[0] + "_" * (len(match.group(0)) - 2) + match.group(0)[0], sql)
+
+
+def _depths(masked: str) -> List[int]:
+    """Return the parenthesis depth at every position."""
+    depths, depth = [], 0
+    for char in masked:
+        if char == ")":
+            depth -= 1
+        depths.append(depth)
+        if char == "(":
+            depth += 1
+    return depths
+
+
+def _split_top_level(text: str, masked: str, depths: List[int], offset: int = 0) -> List[str]:
+    """Split `text` at the commas outside parentheses."""
+    parts, start = [], 0
+    for index, char in enumerate(masked):
+        if char == "," and depths[offset + index] == 0:
+            parts.append(text[start:index].strip())
+            start = index + 1
+    parts.append(text[start:].strip())
+    return parts
+
+
+def _closing_paren(masked: str, open_index: int) -> int:
+    depth = 0
+    for index in range(open_index, len(masked)):
+        if masked[index] == "(":
+            depth += 1
+        elif masked[index] == ")":
+            depth -= 1
+            if depth == 0:
+                return index
+    raise ValueError("unbalanced parentheses")
+
+
+def _canonical(expr: str) -> str:
+    return re.sub(r"\s+", " ", expr.strip()).lower()
+
+
+def _uses_fact_tables_safely(query: str, masked: str) -> bool:
+    """Check that every row of the query's join comes from one partition.
+
+    Each fact table may appear once, in the top-level `FROM` clause; a
+    fact table must be the first table when there are outer joins; and
+    when both fact tables are joined, it must be on `InvoiceId`.
+    """
+    references = [match for match in re.finditer(r"\b(?:FROM|JOIN)\s+\"?(\w+)\"?", masked, re.IGNORECASE)
+                  if match.group(1).lower() in FACT_TABLES]
+    tables = [match.group(1).lower() for match in references]
+    if not tables or len(tables) != len(set(tables)):
+        return False
+    depths = _depths(masked)
+    if any(depths[match.start()] != 0 for match in references):
+        return False
+    if re.search(r"\b(RIGHT|FULL)\b", masked, re.IGNORECASE):
+        return False
+    if re.search(r"\bLEFT\b", masked, re.IGNORECASE):
+        first = re.search(r"\bFROM\s+\"?(\w+)", masked, re.IGNORECASE)
+        if first is None or first.group(1).lower() not in FACT_TABLES:
+            return False
+    if len(tables) == 2 and not re.search(r"\.InvoiceId\s*=\s*\w+\.InvoiceId\b|\bUSING\s*\(\s*InvoiceId\s*\)",
+                                          query, re.IGNORECASE):
+        return False
+    return True
+
+
+class _Rewriter:
+    """Rewrites expressions of the merge query in terms of the columns
+    of the partial query.
+    """
+
+    def __init__(self) -> None:
+        self.partial: List[Tuple[str, str]] = []
+        self._aggregates: Dict[str, str] = {}
+        self._columns: Dict[str, str] = {}
+
+    def column(self, expr: str, prefix: str) -> str:
+        """Return the partial column that holds `expr`, adding it."""
+        key = _canonical(expr)
+        if key not in self._columns:
+            name = f"_{prefix}{len(self.partial) + 1}"
+            self.partial.append((expr, name))
+            self._columns[key] = name
+        return self._columns[key]
+
+    def _aggregate(self, function: str, argument: str) -> Optional[str]:
+        """Return the merge form of one aggregate call, or None when it
+        cannot be split.
+        """
+        if re.match(r"\s*DISTINCT\b", argument, re.IGNORECASE):
+            return None
+        key = f"{function}({_canonical(argument)})"
+        if key in self._aggregates:
+            return self._aggregates[key]
+        if function == "AVG":
+            total = self.column(f"TOTAL({argument})", "a")
+            count = self.column(f"COUNT({argument})", "a")
+            merged = f"(TOTAL({total}) / SUM({count}))"
+        else:
+            name = self.column(f"{function}({argument})", "a")
+            merged = {"COUNT": "SUM", "SUM": "SUM", "TOTAL": "TOTAL", "MIN": "MIN", "MAX": "MAX"}[function]
+            merged = f"{merged}({name})"
+        self._aggregates[key] = merged
+        return merged
+
+    def rewrite(self, expr: str, columns: Dict[str, str]) -> Optional[str]:
+        """Replace the aggregate calls in `expr` by their merge form and
+        the expressions in `columns` by their partial column.
+
+        Returns:
+            The merge expression, or None when it cannot be split.
+        """
+        masked = _mask(expr)
+        pieces, position = [], 0
+        for match in _AGGREGATES.finditer(masked):
+            if match.start() < position:
+                continue
+            open_index = match.end() - 1
+            close_index = _closing_paren(masked, open_index)
+            argument = expr[open_index + 1:close_index]
+            function = match.group(1).upper()
+            if function in ("MIN", "MAX") and len(_split_top_level(
+                    argument, masked[open_index + 1:close_index],
+                    _depths(masked[open_index + 1:close_index]))) > 1:
+                continue  # Scalar MIN(a, b) / MAX(a, b).
+            merged = self._aggregate(function, argument)
+            if merged is None:
+                return None
+            pieces.append(self._replace_columns(expr[position:match.start()], columns))
+            pieces.append(merged)
+            position = close_index + 1
+        pieces.append(self._replace_columns(expr[position:], columns))
+        return "".join(pieces)
+
+    @staticmethod
+    def _replace_columns(text: str, columns: Dict[str, str]) -> str:
+        if not text.strip():
+            return text
+        key = _canonical(text)
+        if key in columns:
+            return columns[key]
+        for expr in sorted(columns, key=len, reverse=True):
+            pattern = r"(?<![\w.])" + r"\s*".join(map(re.escape, expr.split())) + r"(?![\w(])"
+            text = re.sub(pattern, columns[expr], text, flags=re.IGNORECASE)
+        return text
+
+
+def plan_fan_out(query: str) -> Optional[FanOutPlan]:
+    """Split an aggregate query over the fact tables into a partial
+    aggregate per partition and a merge query.
+
+    The scan is keyword-driven, like `lesson_sql.py`, and gives up on
+    anything it does not recognize; `PartitionedDatabase` also checks
+    that both queries compile before using a plan.
+
+    Returns:
+        The plan, or None if the query cannot be split.
+    """
+    query = normalize_sql(query)
+    masked = _mask(query)
+    if not re.match(r"SELECT\b", masked, re.IGNORECASE) or re.match(r"SELECT\s+DISTINCT\b", masked, re.IGNORECASE):
+        return None
+    if re.search(r"\b(UNION|INTERSECT|EXCEPT|OVER|WITH)\b", masked, re.IGNORECASE):
+        return None
+    if _OTHER_AGGREGATES.search(masked) or not _uses_fact_tables_safely(query, masked):
+        return None
+    for match in re.finditer(r"\(\s*SELECT\b", masked, re.IGNORECASE):
+        subquery = query[match.start() + 1:_closing_paren(masked, match.start())]
+        if referenced_tables(subquery) & set(FACT_TABLES):
+            return None
+
+    depths = _depths(masked)
+    clauses: Dict[str, Tuple[int, int]] = {}
+    matches = [match for match in _CLAUSE.finditer(masked) if depths[match.start()] == 0]
+    for index, match in enumerate(matches):
+        name = re.sub(r"\s+", " ", match.group(1).upper())
+        if name in clauses or name == "WINDOW":
+            return None
+        end = matches[index + 1].start() if index + 1 < len(matches) else len(query)
+        clauses[name] = (match.end(), end)
+    if list(clauses)[:2] != ["SELECT", "FROM"]:
+        return None
+
+    def clause(name: str) -> Optional[str]:
+        return query[clauses[name][0]:clauses[name][1]].strip() if name in clauses else None
+
+    def split(name: str) -> List[str]:
+        start, end = clauses[name]
+        return _split_top_level(query[start:end], masked[start:end], depths, start)
+
+    items = []
+    for item in split("SELECT"):
+        alias = re.search(r"\s+AS\s+(\w+|\"(?:[^\"]|\"\")*\")$", item, re.IGNORECASE)
+        if alias:
+            items.append((item[:alias.start()].strip(), alias.group(1)))
+        else:
+            items.append((item, None))
+    if any(expr == "*" or expr.endswith(".*") for expr, _ in items):
+        return None
+    grouped = "GROUP BY" in clauses
+    if not grouped and not any(_AGGREGATES.search(_mask(expr)) for expr, _ in items):
+        return None
+
+    rewriter = _Rewriter()
+    by_alias = {alias.strip('"').lower(): expr for expr, alias in items if alias}
+    columns: Dict[str, str] = {}
+    group_exprs, group_columns = [], []
+    for expr in split("GROUP BY") if grouped else []:
+        if re.fullmatch(r"\d+", expr):
+            position = int(expr)
+            if not 1 <= position <= len(items):
+                return None
+            expr = items[position - 1][0]
+        expr = by_alias.get(expr.strip('"').lower(), expr)
+        if _AGGREGATES.search(_mask(expr)):
+            return None
+        name = rewriter.column(expr, "g")
+        columns[_canonical(expr)] = name
+        group_exprs.append(expr)
+        group_columns.append(name)
+    for expr, _ in items:
+        if not _AGGREGATES.search(_mask(expr)) and _canonical(expr) not in columns:
+            if not grouped:
+                return None  # A bare column next to an aggregate picks an arbitrary row.
+            columns[_canonical(expr)] = rewriter.column(expr, "c")
+
+    merge_items = []
+    for expr, alias in items:
+        merged = rewriter.rewrite(expr, columns)
+        if merged is None:
+            return None
+        merge_items.append(f"{merged} AS {alias}" if alias else merged)
+    having = None
+    if "HAVING" in clauses:
+        having = rewriter.rewrite(clause("HAVING"), columns)
+        if having is None:
+            return None
+    order = []
+    for term in split("ORDER BY") if "ORDER BY" in clauses else []:
+        modifier = re.search(r"(\s+COLLATE\s+\w+)?(\s+(?:ASC|DESC))?(\s+NULLS\s+(?:FIRST|LAST))?$", term,
+                             re.IGNORECASE)
+        expr, suffix = term[:modifier.start()].strip(), term[modifier.start():]
+        if re.fullmatch(r"\d+", expr) or expr.strip('"').lower() in by_alias:
+            order.append(term)
+            continue
+        merged = rewriter.rewrite(expr, columns)
+        if merged is None:
+            return None
+        order.append(merged + suffix)
+
+    partial = [f"{expr} AS {name}" for expr, name in rewriter.partial]
+    partial_sql = f"SELECT {', '.join(partial)} FROM {clause('FROM')}"
+    if "WHERE" in clauses:
+        partial_sql += f" WHERE {clause('WHERE')}"
+    if grouped:
+        partial_sql += f" GROUP BY {', '.join(group_exprs)}"
+    merge_sql = f"SELECT {', '.join(merge_items)} FROM partials"
+    if group_columns:
+        merge_sql += f" GROUP BY {', '.join(group_columns)}"
+    if having is not None:
+        merge_sql += f" HAVING {having}"
+    if order:
+        merge_sql += f" ORDER BY {', '.join(order)}"
+    if "LIMIT" in clauses:
+        merge_sql += f" LIMIT {clause('LIMIT')}"
+    return FanOutPlan(partial_sql, [name for _, name in rewriter.partial], merge_sql)
+
+
+class PartitionedDatabase:
+    """A database partitioned by `partition_database`.
+
+    Args:
+        directory: Directory holding `main.db`, the partitions and the
+            manifest.
+        jobs: Threads running partial aggregates; one per partition by
+            default.
+    """
+
+    def __init__(self, directory: str, jobs: Optional[int] = None) -> None:
+        with open(os.path.join(directory, MANIFEST_NAME), encoding="utf-8") as f:
+            self.manifest = json.load(f)
+        self.main_path = os.path.join(directory, MAIN_NAME)
+        self.partitions = [Partition(entry["label"], os.path.join(directory, entry["file"]), entry["keys"])
+                           for entry in self.manifest["partitions"]]
+        self.jobs = jobs or len(self.partitions)
+        self._combined: Optional[sqlite3.Connection] = None
+        self._connections: Optional[List[sqlite3.Connection]] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        # Query -> fan-out plan, if any, and the names of its columns.
+        self._plans: Dict[str, Tuple[Optional[FanOutPlan], List[str]]] = {}
+
+    def connect(self, partitions: Optional[Sequence[Partition]] = None) -> sqlite3.Connection:
+        """Open a read-only connection to `main.db` with partitions
+        ATTACHed and `invoices` and `invoice_items` views over them.
+
+        Args:
+            partitions: The partitions to combine; every one by default.
+        """
+        partitions = self.partitions if partitions is None else partitions
+        conn = connect_read_only(self.main_path)
+        try:
+            for index, partition in enumerate(partitions):
+                conn.execute(f"ATTACH ? AS p{index}", (Path(partition.path).absolute().as_uri() + "?mode=ro",))
+            conn.execute("PRAGMA query_only = OFF")
+            for table in FACT_TABLES:
+                union = " UNION ALL ".join(f"SELECT * FROM p{index}.{table}" for index in range(len(partitions)))
+                conn.execute(f"CREATE TEMP VIEW {table} AS {union}")
+            conn.execute("PRAGMA query_only = ON")
+        except sqlite3.Error:
+            conn.close()
+            raise
+        return conn
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._combined is None:
+            self._combined = self.connect()
+        return self._combined
+
+    def _partition_connections(self) -> List[sqlite3.Connection]:
+        if self._connections is None:
+            self._connections = [self.connect([partition]) for partition in self.partitions]
+            self._executor = ThreadPoolExecutor(max_workers=self.jobs)
+        return self._connections
+
+    def _plan(self, query: str) -> Tuple[Optional[FanOutPlan], List[str]]:
+        if query not in self._plans:
+            # The merge query names unaliased columns differently.
+            columns = [desc[0] for desc in self._connection().execute(
+                f"SELECT * FROM ({normalize_sql(query)}) LIMIT 0").description]
+            plan = plan_fan_out(query)
+            if plan is not None:
+                try:
+                    self._partition_connections()[0].execute(f"SELECT * FROM ({plan.partial_sql}) LIMIT 0")
+                    merge = sqlite3.connect(":memory:")
+                    try:
+                        merge.execute(f"CREATE TABLE partials ({', '.join(plan.partial_columns)})")
+                        merge.execute(f"SELECT * FROM ({plan.merge_sql}) LIMIT 0")
+                    finally:
+                        merge.close()
+                except sqlite3.Error:
+                    plan = None
+            self._plans[query] = (plan, columns)
+        return self._plans[query]
+
+    def plan(self, query: str) -> Optional[FanOutPlan]:
+        """Return the fan-out plan of a query, or None if it runs on the
+        combined views. Plans are cached and checked to compile.
+        """
+        return self._plan(query)[0]
+
+    def execute(self, query: str, fan_out: bool = True) -> Tuple[List[str], List[tuple], str]:
+        """Run a query on the partitioned database.
+
+        Args:
+            query: A lesson query.
+            fan_out: Whether to split aggregate queries over the
+                partitions; if False every query runs on the combined
+                views.
+
+        Returns:
+            The column names, the rows and how the query ran: `fan-out`
+            or `combined`.
+        """
+        plan, columns = self._plan(query) if fan_out else (None, [])
+        if plan is None:
+            cursor = self._connection().execute(query)
+            rows = cursor.fetchall()
+            return [desc[0] for desc in cursor.description], rows, "combined"
+
+        def partial(conn: sqlite3.Connection) -> List[tuple]:
+            return conn.execute(plan.partial_sql).fetchall()
+
+        results = list(self._executor.map(partial, self._partition_connections()))
+        merge = sqlite3.connect(":memory:")
+        try:
+            merge.execute(f"CREATE TABLE partials ({', '.join(plan.partial_columns)})")
+            placeholders = ", ".join("?" * len(plan.partial_columns))
+            merge.executemany(f"INSERT INTO partials VALUES ({placeholders})", chain.from_iterable(results))
+            return columns, merge.execute(plan.merge_sql).fetchall(), "fan-out"
+        finally:
+            merge.close()
+
+    def close(self) -> None:
+        """Close every connection and stop the thread pool."""
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        for conn in (self._connections or []) + ([self._combined] if self._combined else []):
+            conn.close()
+        self._connections = None
+        self._combined = None
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Partition the sales tables into ATTACHed databases.")
+    parser.add_argument("--db", default=DEFAULT_DB_PATH,
+                        help="path to the SQLite database")
+    parser.add_argument("--dir", default=DEFAULT_PARTITION_DIR,
+                        help="directory to write the partitioned database to")
+    parser.add_argument("--by", choices=sorted(PARTITION_KEYS), default="year",
+                        help="partition invoices by year or by customer country")
+    parser.add_argument("--max-partitions", type=int,
+                        help="largest number of partitions; defaults to SQLite's ATTACH limit")
+    parser.add_argument("--query",
+                        help="run this query on the partitioned database and show how it ran")
+    args = parser.parse_args(argv)
+    require_database(args.db)
+
+    start = time.perf_counter()
+    try:
+        manifest = partition_database(args.db, args.dir, args.by, args.max_partitions)
+    except ValueError as exc:
+        sys.exit(f"error: {exc}")
+    elapsed = time.perf_counter() - start
+    rows = [(entry["label"], ", ".join(entry["keys"]), entry["rows"]["invoices"], entry["rows"]["invoice_items"],
+             round(os.path.getsize(os.path.join(args.dir, entry["file"])) / 1e6, 1))
+            for entry in manifest["partitions"]]
+    print(f"Partitioned {args.db} by {args.by} into {args.dir} in {elapsed:.1f} s\n")
+    print(rows_to_markdown(["Partition", "Keys", "Invoices", "Invoice lines", "MB"], rows))
+
+    if args.query:
+        database = PartitionedDatabase(args.dir)
+        try:
+            plan = database.plan(args.query)
+            start = time.perf_counter()
+            columns, result, how = database.execute(args.query)
+            elapsed = time.perf_counter() - start
+        finally:
+            database.close()
+        print(f"\nRan {how} in {elapsed * 1000:.1f} ms\n")
+        if plan is not None:
+            print(f"Partial query: {plan.partial_sql}\nMerge query: {plan.merge_sql}\n")
+        print(rows_to_markdown(columns, result))
+
+
+if __name__ == '__main__':
+    main()
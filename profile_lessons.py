@@ -0,0 +1,207 @@
+"""
+This script profiles the example queries of the SQL tutorial lessons.
+For every lesson whose query is executed by `generate_lessons.py`, it
+records how long the query takes to run to completion, how many rows
+it returns, how many SQLite virtual machine steps it needs (a measure
+of how much data it scans) and its `EXPLAIN QUERY PLAN` output.
+
+Plan steps that read a whole table (`SCAN ...`) or build a temporary
+B-tree to sort, group or de-duplicate rows are flagged, because these
+are the parts of a query that grow with the size of the data.
+
+Run this script from the root of the project directory:
+
+    python profile_lessons.py --output-dir profile
+
+It writes `profile.json`, a machine-readable report in lesson order,
+and `profile.md`, a Markdown summary ranked from the most to the least
+expensive query.
+"""
+
+import argparse
+import json
+import os
+import re
+import sqlite3
+import time
+from typing import Dict, List, Optional
+
+from generate_lessons import (
+    BUDGET_CHECK_INTERVAL, DEFAULT_DB_PATH, connect_read_only, get_lessons, progress_listener, require_database,
+    rows_to_markdown, set_progress_listener,
+)
+
+# Number of SQLite virtual machine instructions between two calls of the
+# progress handler used to count VM steps. It divides
+# `BUDGET_CHECK_INTERVAL`, so that a listener already set on the
+# connection keeps being called at its own interval.
+PROGRESS_INTERVAL = 100
+
+# Plan details for full table scans, e.g. `SCAN tracks` or, on older
+# SQLite versions, `SCAN TABLE tracks AS t`. Index scans, subquery and
+# constant-row scans are not flagged.
+_FULL_SCAN = re.compile(r"^SCAN (?:TABLE )?(?!\(subquery|CONSTANT ROW)(?!.* USING (?:COVERING )?INDEX)")
+
+
+def explain_query_plan(conn: sqlite3.Connection, query: str) -> List[str]:
+    """Return the `EXPLAIN QUERY PLAN` details of a query, indented to
+    show the nesting of the plan.
+
+    Args:
+        conn: SQLite connection object.
+        query: SQL query to explain. A trailing semicolon is ignored.
+
+    Returns:
+        One string per plan step.
+    """
+    rows = conn.execute("EXPLAIN QUERY PLAN " + query.strip().rstrip(';')).fetchall()
+    depth = {0: -1}
+    lines = []
+    for node_id, parent, _, detail in rows:
+        depth[node_id] = depth.get(parent, -1) + 1
+        lines.append("  " * depth[node_id] + detail)
+    return lines
+
+
+def profile_query(conn: sqlite3.Connection, query: str, repeat: int = 3) -> Dict:
+    """Run a query to completion and measure it.
+
+    Args:
+        conn: SQLite connection object.
+        query: SQL query to profile. A trailing semicolon is ignored.
+        repeat: Number of timed runs; the fastest one is reported.
+
+    A listener set with `generate_lessons.set_progress_listener`, such
+    as a `sql_trace.SQLTracer` or the budget check of `guard_query`,
+    keeps being called while the query runs and is reinstalled after.
+
+    Returns:
+        A dictionary with the wall time in milliseconds, the number of
+        rows returned, the approximate number of VM steps, the query
+        plan and the flagged plan steps.
+    """
+    clean_query = query.strip().rstrip(';')
+    plan = explain_query_plan(conn, clean_query)
+    steps = 0
+    calls = 0
+    listener = progress_listener(conn)
+    per_listener_call = BUDGET_CHECK_INTERVAL // PROGRESS_INTERVAL
+
+    def count_steps() -> int:
+        nonlocal steps, calls
+        steps += PROGRESS_INTERVAL
+        calls += 1
+        if listener is not None and calls % per_listener_call == 0:
+            return listener()
+        return 0
+
+    timings = []
+    rows_returned = 0
+    conn.set_progress_handler(count_steps, PROGRESS_INTERVAL)
+    try:
+        for _ in range(max(1, repeat)):
+            steps = 0
+            start = time.perf_counter()
+            cursor = conn.execute(clean_query)
+            rows_returned = sum(1 for _ in cursor)
+            timings.append(time.perf_counter() - start)
+    finally:
+        set_progress_listener(conn, listener)
+
+    details = [line.strip() for line in plan]
+    return {
+        "wall_ms": round(min(timings) * 1000, 3),
+        "rows_returned": rows_returned,
+        "vm_steps": steps,
+        "plan": plan,
+        "full_scans": [detail for detail in details if _FULL_SCAN.match(detail)],
+        "temp_btrees": [detail for detail in details if "TEMP B-TREE" in detail],
+    }
+
+
+def profile_lessons(conn: sqlite3.Connection, lessons: List[Dict[str, str]],
+                    repeat: int = 3) -> List[Dict]:
+    """Profile the query of every executed lesson.
+
+    Args:
+        conn: SQLite connection object.
+        lessons: Lesson definitions, see `generate_lessons.get_lessons`.
+        repeat: Number of timed runs per query.
+
+    Returns:
+        One report entry per executed lesson, in lesson order. Queries
+        that fail are reported with an `error` message instead of
+        measurements.
+    """
+    entries = []
+    for lesson in lessons:
+        if not lesson.get("run", True):
+            continue
+        entry = {"slug": lesson["slug"], "title": lesson["title"], "error": None}
+        try:
+            entry.update(profile_query(conn, lesson["query"], repeat))
+        except sqlite3.Error as exc:
+            entry["error"] = str(exc)
+        entries.append(entry)
+    return entries
+
+
+def format_summary(entries: List[Dict]) -> str:
+    """Render profile entries as a Markdown report ranked by wall time."""
+    ranked = sorted(entries, key=lambda entry: entry.get("wall_ms", -1), reverse=True)
+    rows = []
+    for rank, entry in enumerate(ranked, start=1):
+        if entry["error"]:
+            rows.append((rank, entry["slug"], None, None, None, "error: " + entry["error"]))
+            continue
+        flags = [detail.lower() for detail in entry["full_scans"] + entry["temp_btrees"]]
+        rows.append((rank, entry["slug"], entry["wall_ms"], entry["rows_returned"],
+                     entry["vm_steps"], "; ".join(flags)))
+    table = rows_to_markdown(["Rank", "Lesson", "Wall ms", "Rows", "VM steps", "Flags"], rows)
+    flagged = sum(1 for entry in entries if entry.get("full_scans") or entry.get("temp_btrees"))
+    return "\n\n".join([
+        "# Lesson query profile",
+        f"{len(entries)} executed lessons, {flagged} with full table scans "
+        "or temporary B-trees. Lessons are ranked by wall time.",
+        table,
+    ]) + "\n"
+
+
+def write_reports(entries: List[Dict], output_dir: str, db_path: str) -> None:
+    """Write `profile.json` and `profile.md` into `output_dir`."""
+    os.makedirs(output_dir, exist_ok=True)
+    report = {
+        "database": db_path,
+        "sqlite_version": sqlite3.sqlite_version,
+        "progress_interval": PROGRESS_INTERVAL,
+        "lessons": entries,
+    }
+    with open(os.path.join(output_dir, "profile.json"), "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+        f.write("\n")
+    with open(os.path.join(output_dir, "profile.md"), "w", encoding="utf-8") as f:
+        f.write(format_summary(entries))
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Profile the lesson queries.")
+    parser.add_argument("--db", default=DEFAULT_DB_PATH,
+                        help="path to the Chinook SQLite database")
+    parser.add_argument("--output-dir", default="profile",
+                        help="directory the JSON and Markdown reports are written to")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="timed runs per query; the fastest is reported")
+    args = parser.parse_args(argv)
+    require_database(args.db)
+
+    conn = connect_read_only(args.db)
+    try:
+        entries = profile_lessons(conn, get_lessons(), args.repeat)
+    finally:
+        conn.close()
+    write_reports(entries, args.output_dir, args.db)
+    print(f"Profiled {len(entries)} lesson queries; reports written to {args.output_dir}.")
+
+
+if __name__ == '__main__':
+    main()
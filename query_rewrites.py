@@ -0,0 +1,511 @@
+"""
+This script looks for query patterns in the lessons that scale badly,
+proposes an equivalent rewrite for each one and measures both versions.
+
+The patterns, found with the same keyword-driven scanning as
+`lesson_sql.py`:
+
+* `SELECT *` at the top level of a query: rewritten with the explicit
+  column list the query returns, so the result does not change shape
+  when columns are added and unused columns can be dropped;
+* a correlated `EXISTS (SELECT ... WHERE inner.col = outer.col)` or an
+  `col IN (SELECT col FROM table)` filter: rewritten as a join against
+  the distinct keys of the inner table, which keeps every outer row at
+  most once, exactly like the semi-join it replaces;
+* a `LEFT JOIN` whose left side has a NOT NULL foreign key to the
+  joined key, as in the usual emulation of a `RIGHT JOIN`: every row
+  has a match, so it is rewritten as an inner join, which lets the
+  planner pick the join order;
+* `UNION` whose branches provably never return the same row twice:
+  every branch reads one table and returns its primary key, and a
+  constant column tags each branch with a different value. It is
+  rewritten as `UNION ALL`, which skips de-duplication.
+
+A rewrite is only suggested when both versions return the same rows on
+the database it is checked against; rewrites whose result differs, or
+that cannot be run there, are left out. Pass `--suggest-rewrites` to
+`generate_lessons.py` to add the suggestions and their measured
+difference to the lesson files.
+
+Run this script from the root of the project directory, ideally against
+one of the scaled benchmark databases:
+
+    python query_rewrites.py --db bench_data/chinook_x100.db
+"""
+
+import argparse
+import re
+import sqlite3
+import time
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from generate_lessons import (
+    DEFAULT_DB_PATH, BudgetExceeded, QueryBudget, connect_read_only, get_lessons, guard_query,
+    require_database, rows_to_markdown,
+)
+from lesson_sql import normalize_sql
+
+# Complete runs of each version; the best one is reported.
+DEFAULT_REPEAT = 5
+
+# Lesson files only report a difference in speed when a version takes
+# at least this many milliseconds; below it the difference is mostly
+# noise.
+NOISE_MS = 1.0
+
+_TABLE = r"(\w+)(?: (?:AS )?(?!(?:WHERE|JOIN|LEFT|INNER|CROSS|ON|ORDER|GROUP|LIMIT)\b)(\w+))?"
+
+_EXISTS = re.compile(
+    rf"\bEXISTS \( ?SELECT [^()]*? FROM {_TABLE} WHERE (\w+)\.(\w+) = (\w+)\.(\w+) ?\)", re.IGNORECASE)
+
+_IN_SUBQUERY = re.compile(
+    rf"\b(?:(\w+)\.)?(\w+) IN \( ?SELECT (?:\w+\.)?(\w+) FROM {_TABLE} ?\)", re.IGNORECASE)
+
+_LEFT_JOIN = re.compile(
+    rf"\bFROM {_TABLE} LEFT (?:OUTER )?JOIN {_TABLE} ON (\w+)\.(\w+) = (\w+)\.(\w+)", re.IGNORECASE)
+
+
+class Rewrite(NamedTuple):
+    """An equivalent form of a query."""
+
+    pattern: str
+    title: str
+    explanation: str
+    sql: str
+
+
+class Measurement(NamedTuple):
+    """How fast a rewrite is compared with the original query."""
+
+    original_ms: float
+    rewritten_ms: float
+
+
+def _depth_at(query: str, position: int) -> int:
+    """Return the parenthesis depth at a position of a stripped query."""
+    return query.count("(", 0, position) - query.count(")", 0, position)
+
+
+def _blank(query: str) -> str:
+    """Blank out the contents of the string literals of a normalized
+    query, keeping every other character at its position.
+    """
+    return re.sub(r"'(?:[^']|'')*'", lambda match: "'" + " " * (len(match.group(0)) - 2) + "'", query)
+
+
+def _top_level(query: str, pattern: str) -> List["re.Match[str]"]:
+    stripped = _blank(query)
+    return [match for match in re.finditer(pattern, stripped, re.IGNORECASE)
+            if _depth_at(stripped, match.start()) == 0]
+
+
+def _rewrite_select_star(conn: sqlite3.Connection, query: str) -> Optional[Rewrite]:
+    matches = _top_level(query, r"\bSELECT \*")
+    if len(matches) != 1:
+        return None
+    columns = [desc[0] for desc in conn.execute(f"SELECT * FROM ({query}) LIMIT 0").description]
+    if len(set(name.lower() for name in columns)) != len(columns):
+        return None
+    start, end = matches[0].span()
+    sql = query[:start] + "SELECT " + ", ".join(columns) + query[end:]
+    return Rewrite(
+        "select-star", "explicit column list",
+        "Name the columns instead of `*`: the result keeps its shape when columns are added to "
+        "the table, and dropping columns you do not need lets SQLite read less of each row or "
+        "answer from a covering index.",
+        sql)
+
+
+def _semi_join(query: str, condition: Tuple[int, int], outer_alias: Optional[str],
+               join: str) -> Optional[str]:
+    """Move a semi-join condition of the WHERE clause into a JOIN.
+
+    Args:
+        query: Normalized query.
+        condition: Span of the condition inside the WHERE clause.
+        outer_alias: Alias or table name the condition refers to in the
+            outer query, or None if it is not qualified.
+        join: JOIN clause to add after the outer table.
+
+    Returns:
+        The rewritten query, or None if the condition is not one of the
+        top-level `AND` terms of a single-table `FROM ... WHERE`.
+    """
+    stripped = _blank(query)
+    start, end = condition
+    where = stripped.rfind(" WHERE ", 0, start)
+    if where < 0 or _depth_at(stripped, where) != 0:
+        return None
+    source = re.search(rf"\bFROM {_TABLE}$", stripped[:where], re.IGNORECASE)
+    if source is None or _depth_at(stripped, source.start()) != 0:
+        return None
+    alias = source.group(2) or source.group(1)
+    if outer_alias is not None and outer_alias.lower() != alias.lower():
+        return None
+    before = stripped[where + len(" WHERE "):start]
+    after = stripped[end:]
+    if before and not re.fullmatch(r".* AND ", before, re.IGNORECASE):
+        return None
+    if before:
+        # Drop the AND that joined this condition to the previous one.
+        remaining = query[where:where + len(" WHERE ") + len(before) - len(" AND ")] + query[end:]
+    elif re.match(r" AND ", after, re.IGNORECASE):
+        remaining = " WHERE" + query[end + len(" AND") :]
+    else:
+        remaining = query[end:]
+    return query[:source.end()] + f" {join}" + remaining
+
+
+def _rewrite_exists(conn: sqlite3.Connection, query: str) -> Optional[Rewrite]:
+    stripped = _blank(query)
+    match = _EXISTS.search(stripped)
+    if match is None or re.search(r"\bNOT\s*$", stripped[:match.start()], re.IGNORECASE):
+        return None
+    table, alias = match.group(1), match.group(2) or match.group(1)
+    left, left_col, right, right_col = match.group(3, 4, 5, 6)
+    if left.lower() == alias.lower():
+        inner_col, outer, outer_col = left_col, right, right_col
+    elif right.lower() == alias.lower():
+        inner_col, outer, outer_col = right_col, left, left_col
+    else:
+        return None
+    join = (f"JOIN (SELECT DISTINCT {inner_col} FROM {table}) {alias} "
+            f"ON {alias}.{inner_col} = {outer}.{outer_col}")
+    sql = _semi_join(query, match.span(), outer, join)
+    if sql is None:
+        return None
+    return Rewrite(
+        "correlated-exists", "join instead of a correlated EXISTS",
+        "The correlated subquery is evaluated once per outer row. Joining against the distinct "
+        "keys of the inner table reads it once and returns each outer row at most once, like "
+        "`EXISTS`.",
+        sql)
+
+
+def _rewrite_in_subquery(conn: sqlite3.Connection, query: str) -> Optional[Rewrite]:
+    stripped = _blank(query)
+    match = _IN_SUBQUERY.search(stripped)
+    if match is None or re.search(r"\bNOT\s*$", stripped[:match.start()], re.IGNORECASE):
+        return None
+    outer, outer_col, inner_col, table = match.group(1, 2, 3, 4)
+    alias = "in_keys"
+    qualified = f"{outer}.{outer_col}" if outer else outer_col
+    join = f"JOIN (SELECT DISTINCT {inner_col} FROM {table}) {alias} ON {alias}.{inner_col} = {qualified}"
+    sql = _semi_join(query, match.span(), outer, join)
+    if sql is None:
+        return None
+    return Rewrite(
+        "in-subquery", "join instead of IN (SELECT ...)",
+        "Joining against the distinct keys of the subquery gives the planner the choice of "
+        "which side to loop over, and still returns each outer row at most once.",
+        sql)
+
+
+def _not_null_foreign_key(conn: sqlite3.Connection, table: str, column: str,
+                          parent: str, parent_column: str) -> bool:
+    """Return whether `table.column` is NOT NULL and references
+    `parent.parent_column`.
+    """
+    not_null = any(row[1].lower() == column.lower() and row[3]
+                   for row in conn.execute(f'PRAGMA table_info("{table}")'))
+    references = any(row[2].lower() == parent.lower() and row[3].lower() == column.lower()
+                     and (row[4] or "").lower() == parent_column.lower()
+                     for row in conn.execute(f'PRAGMA foreign_key_list("{table}")'))
+    return not_null and references
+
+
+def _rewrite_left_join(conn: sqlite3.Connection, query: str) -> Optional[Rewrite]:
+    match = _LEFT_JOIN.search(_blank(query))
+    if match is None:
+        return None
+    left_table, left_alias = match.group(1), match.group(2) or match.group(1)
+    right_table, right_alias = match.group(3), match.group(4) or match.group(3)
+    sides = {match.group(5).lower(): match.group(6), match.group(7).lower(): match.group(8)}
+    if set(sides) != {left_alias.lower(), right_alias.lower()} or left_alias.lower() == right_alias.lower():
+        return None
+    if not _not_null_foreign_key(conn, left_table, sides[left_alias.lower()],
+                                 right_table, sides[right_alias.lower()]):
+        return None
+    join = re.search(r"\bLEFT (?:OUTER )?JOIN\b", query[match.start():], re.IGNORECASE)
+    start = match.start() + join.start()
+    sql = query[:start] + "JOIN" + query[start + len(join.group(0)):]
+    return Rewrite(
+        "left-join", "inner join instead of an outer join",
+        f"`{left_table}.{sides[left_alias.lower()]}` is NOT NULL and references "
+        f"`{right_table}`, so every row has a match and the outer join keeps no extra rows. "
+        "An inner join lets the planner start from either table.",
+        sql)
+
+
+def _split_top_level(text: str, stripped: str, separator: str) -> List[str]:
+    """Split a query, or a part of one, at the top-level matches of a
+    pattern, found in its blanked form.
+    """
+    parts, start = [], 0
+    for match in re.finditer(separator, stripped, re.IGNORECASE):
+        if _depth_at(stripped, match.start()) == 0:
+            parts.append(text[start:match.start()])
+            start = match.end()
+    parts.append(text[start:])
+    return parts
+
+
+def _literal(item: str) -> Optional[Tuple[str, object]]:
+    """Return the value of a select-list item that is a constant, or
+    None if it is anything else.
+    """
+    match = re.fullmatch(r"('(?:[^']|'')*'|-?\d+(?:\.\d*)?(?:[eE][-+]?\d+)?)(?: (?:AS )?\w+)?",
+                         item.strip(), re.IGNORECASE)
+    if match is None:
+        return None
+    value = match.group(1)
+    if value.startswith("'"):
+        return ("text", value[1:-1].replace("''", "'"))
+    return ("number", float(value))
+
+
+def _returns_primary_key(conn: sqlite3.Connection, table: str, items: List[str],
+                         alias: str) -> bool:
+    """Return whether a single-table select list includes every column
+    of the table's primary key, none of which can be NULL.
+    """
+    info = conn.execute(f'PRAGMA table_info("{table}")').fetchall()
+    key = [row for row in info if row[5]]
+    if not key:
+        return False
+    if len(key) > 1 or key[0][2].upper() != "INTEGER":
+        # Only an INTEGER PRIMARY KEY is implicitly NOT NULL.
+        if not all(row[3] for row in key):
+            return False
+    columns = set()
+    for item in items:
+        match = re.fullmatch(r"(?:(\w+)\.)?(\w+)(?: (?:AS )?\w+)?", item.strip(), re.IGNORECASE)
+        if match and (match.group(1) is None or match.group(1).lower() == alias.lower()):
+            columns.add(match.group(2).lower())
+    return all(row[1].lower() in columns for row in key)
+
+
+def _disjoint_branches(conn: sqlite3.Connection, query: str) -> bool:
+    """Return whether the branches of a compound query can never return
+    the same row twice, so that `UNION` and `UNION ALL` agree.
+
+    That holds when every branch is a plain `SELECT` from one table that
+    returns the table's primary key, so no branch repeats a row, and
+    one column is a constant with a different value in every branch,
+    so no two branches return the same row.
+    """
+    stripped = _blank(query)
+    if _top_level(query, r"\b(?:INTERSECT|EXCEPT)\b") or not _top_level(query, r"^SELECT\b"):
+        return False
+    separator = r"\bUNION(?: ALL)?\b"
+    branches = _split_top_level(query, stripped, separator)
+    blanked = _split_top_level(stripped, stripped, separator)
+    tail = _top_level(blanked[-1], r"\b(?:ORDER BY|LIMIT)\b")
+    if tail:
+        branches[-1] = branches[-1][:tail[0].start()]
+        blanked[-1] = blanked[-1][:tail[0].start()]
+    tags = []
+    for branch, blank in zip(branches, blanked):
+        match = re.fullmatch(
+            rf" ?SELECT (?!(?:DISTINCT|ALL)\b)(.+?) FROM {_TABLE}"
+            r"(?: WHERE (?:(?!\b(?:JOIN|GROUP|HAVING|WINDOW)\b).)*)? ?",
+            blank, re.IGNORECASE)
+        if match is None:
+            return False
+        start, end = match.span(1)
+        items = _split_top_level(branch[start:end], blank[start:end], ",")
+        if not _returns_primary_key(conn, match.group(2), items, match.group(3) or match.group(2)):
+            return False
+        tags.append([_literal(item) for item in items])
+    if len({len(items) for items in tags}) != 1:
+        return False
+    return any(None not in column and len(set(column)) == len(column) for column in zip(*tags))
+
+
+def _rewrite_union(conn: sqlite3.Connection, query: str) -> Optional[Rewrite]:
+    matches = _top_level(query, r"\bUNION\b(?! ALL\b)")
+    if not matches or not _disjoint_branches(conn, query):
+        return None
+    sql = query
+    for match in reversed(matches):
+        sql = sql[:match.start()] + "UNION ALL" + sql[match.end():]
+    return Rewrite(
+        "union", "UNION ALL instead of UNION",
+        "Every branch returns the primary key of its table and a constant that no other branch "
+        "returns, so no row can appear twice. `UNION ALL` returns the same rows without the "
+        "temporary B-tree `UNION` uses to remove duplicates.",
+        sql)
+
+
+_DETECTORS = (_rewrite_select_star, _rewrite_exists, _rewrite_in_subquery, _rewrite_left_join,
+              _rewrite_union)
+
+
+def _run(conn: sqlite3.Connection, query: str, repeat: int,
+         budget: Optional[QueryBudget]) -> Tuple[List[tuple], float]:
+    """Return the rows of a query and the best time of `repeat` runs."""
+    best = float("inf")
+    rows: List[tuple] = []
+    for _ in range(repeat):
+        with guard_query(conn, budget):
+            start = time.perf_counter()
+            rows = conn.execute(query).fetchall()
+            best = min(best, time.perf_counter() - start)
+    return rows, best * 1000
+
+
+def _same_result(conn: sqlite3.Connection, query: str, rewrite: Rewrite,
+                 budget: Optional[QueryBudget]) -> bool:
+    """Return whether a query and its rewrite return the same rows.
+
+    Results are compared in order when the query has a top-level
+    `ORDER BY`, and as multisets otherwise. A rewrite that fails or goes
+    over the budget does not count as the same.
+    """
+    try:
+        expected, _ = _run(conn, query, 1, budget)
+        actual, _ = _run(conn, rewrite.sql, 1, budget)
+    except (sqlite3.Error, BudgetExceeded):
+        return False
+    if not _top_level(query, r"\bORDER BY\b"):
+        expected, actual = sorted(expected, key=repr), sorted(actual, key=repr)
+    return expected == actual
+
+
+def suggest_rewrites(conn: sqlite3.Connection, query: str,
+                     budget: Optional[QueryBudget] = None) -> List[Rewrite]:
+    """Return an equivalent rewrite for every pattern found in a query.
+
+    Every rewrite is run once against the connection's database next to
+    the query, and only kept if both return the same rows.
+
+    Args:
+        conn: SQLite connection, used to look up the result columns and
+            foreign keys and to compare the results.
+        query: A single SQL query.
+        budget: Optional limits for each comparison run.
+
+    Returns:
+        The rewrites, each of the normalized query (see
+        `lesson_sql.normalize_sql`) with one pattern replaced.
+    """
+    query = normalize_sql(query)
+    rewrites = []
+    for detect in _DETECTORS:
+        try:
+            rewrite = detect(conn, query)
+        except sqlite3.Error:
+            rewrite = None
+        if rewrite is not None and _same_result(conn, query, rewrite, budget):
+            rewrites.append(rewrite)
+    return rewrites
+
+
+def measure_rewrite(conn: sqlite3.Connection, query: str, rewrite: Rewrite,
+                    repeat: int = DEFAULT_REPEAT, budget: Optional[QueryBudget] = None) -> Measurement:
+    """Time a query and its rewrite.
+
+    Raises:
+        sqlite3.Error: If either version fails.
+        BudgetExceeded: If either version goes over the budget.
+    """
+    _, original_ms = _run(conn, normalize_sql(query), repeat, budget)
+    _, rewritten_ms = _run(conn, rewrite.sql, repeat, budget)
+    return Measurement(original_ms, rewritten_ms)
+
+
+def _speed(measurement: Measurement) -> str:
+    """Describe how fast the rewrite is, coarsely enough that a lesson
+    file does not change from one run to the next.
+    """
+    ratio = measurement.original_ms / max(measurement.rewritten_ms, 1e-9)
+    factor = max(ratio, 1 / ratio)
+    if factor < 2 or max(measurement.original_ms, measurement.rewritten_ms) < NOISE_MS:
+        return "runs about as fast as the original"
+    amount = "more than 10x" if factor >= 10 else f"about {round(factor)}x"
+    return f"runs {amount} {'faster' if ratio > 1 else 'slower'} than the original"
+
+
+def format_suggestions(conn: sqlite3.Connection, query: str, repeat: int = DEFAULT_REPEAT,
+                       budget: Optional[QueryBudget] = None) -> str:
+    """Render the rewrites of a lesson query and their measured
+    difference as Markdown for a lesson file. Returns an empty string if
+    the query has none.
+
+    Speeds are described in rounded terms (see `_speed`), so that the
+    file only changes when the comparison does; the exact timings are in
+    the report of `analyze_lessons`.
+    """
+    sections = []
+    for rewrite in suggest_rewrites(conn, query, budget):
+        try:
+            measurement = measure_rewrite(conn, query, rewrite, repeat, budget)
+        except (sqlite3.Error, BudgetExceeded) as exc:
+            outcome = f"_Returns the same rows on this database, but could not be timed: {exc}._"
+        else:
+            outcome = f"_Measured on this database: returns the same rows and {_speed(measurement)}._"
+        sections.append(f"**Rewrite: {rewrite.title}.** {rewrite.explanation}\n\n"
+                        f"```sql\n{rewrite.sql}\n```\n\n{outcome}")
+    return "\n\n".join(sections)
+
+
+def analyze_lessons(conn: sqlite3.Connection, lessons: List[Dict[str, str]],
+                    repeat: int = DEFAULT_REPEAT, budget: Optional[QueryBudget] = None) -> List[Dict]:
+    """Suggest and measure rewrites for every executed lesson query."""
+    results = []
+    for lesson in lessons:
+        if not lesson.get("run", True):
+            continue
+        for rewrite in suggest_rewrites(conn, lesson["query"], budget):
+            entry = {"slug": lesson["slug"], "pattern": rewrite.pattern, "sql": rewrite.sql, "error": None}
+            try:
+                entry.update(measure_rewrite(conn, lesson["query"], rewrite, repeat, budget)._asdict())
+            except (sqlite3.Error, BudgetExceeded) as exc:
+                entry["error"] = str(exc)
+            results.append(entry)
+    return results
+
+
+def format_report(results: List[Dict]) -> str:
+    """Render the analysis as a Markdown table."""
+    rows = []
+    for entry in results:
+        if entry["error"]:
+            rows.append((entry["slug"], entry["pattern"], None, None, None, entry["error"]))
+            continue
+        rows.append((
+            entry["slug"],
+            entry["pattern"],
+            round(entry["original_ms"], 3),
+            round(entry["rewritten_ms"], 3),
+            f"{entry['original_ms'] / max(entry['rewritten_ms'], 1e-9):.2f}x",
+            "",
+        ))
+    return rows_to_markdown(
+        ["Lesson", "Pattern", "Original ms", "Rewritten ms", "Speedup", "Error"], rows)
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Suggest and measure rewrites of the lesson queries.")
+    parser.add_argument("--db", default=DEFAULT_DB_PATH,
+                        help="path to the Chinook SQLite database")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT,
+                        help="complete runs of each version; the best is reported")
+    parser.add_argument("--show-sql", action="store_true",
+                        help="also print every rewritten query")
+    args = parser.parse_args(argv)
+    require_database(args.db)
+
+    conn = connect_read_only(args.db)
+    try:
+        results = analyze_lessons(conn, get_lessons(), args.repeat, QueryBudget())
+    finally:
+        conn.close()
+    print(format_report(results))
+    if args.show_sql:
+        for entry in results:
+            print(f"\n{entry['slug']} ({entry['pattern']}):\n\n    {entry['sql']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,381 @@
+"""
+Per-statement metrics for the SQLite connections of the project.
+
+A `SQLTracer` attaches to a connection with three hooks that SQLite and
+the `sqlite3` module already provide, without wrapping the connection
+or its cursors:
+
+* `set_trace_callback` marks the start of every statement, which is
+  grouped under its fingerprint (`lesson_sql.fingerprint_sql`: the
+  normalized SQL with its literals replaced by `?`);
+* a progress listener (see `generate_lessons.set_progress_listener`)
+  runs every `BUDGET_CHECK_INTERVAL` virtual machine steps and counts
+  them, so it also works under the query budget of `guard_query`;
+* a row factory notes when each row reaches Python, chaining any row
+  factory the connection already had.
+
+A statement ends when the next one starts on the same connection or
+when the tracer is flushed. None of the hooks fires when a cursor is
+exhausted, so its latency runs from its start to the last sign of
+activity, a progress tick or a row. Time the caller spends between
+fetches is not counted, but neither is the work after the last sign,
+up to one progress interval: statements that finish within one
+interval without returning rows are recorded as taking no time. VM
+steps are counted in whole intervals, so they too are approximate, at
+a resolution of `BUDGET_CHECK_INTERVAL` steps.
+
+For each fingerprint the tracer keeps the number of executions, the
+total and maximum latency, a latency histogram and the VM steps, and
+exports them as JSON or in the Prometheus text format, e.g. for the
+node exporter's textfile collector.
+
+Example, e.g. in a notebook, tracing every connection opened with
+`connect_read_only`:
+
+    from sql_trace import SQLTracer
+
+    with SQLTracer() as tracer:
+        ...
+    tracer.write("trace.prom")
+
+`generate_lessons.py --trace trace.json` traces a generator run. Run
+this script from the root of the project directory to list the
+slowest statements of a JSON export:
+
+    python sql_trace.py trace.json --top 10
+"""
+
+import argparse
+import bisect
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import weakref
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from generate_lessons import BUDGET_CHECK_INTERVAL, CONNECTION_HOOKS, rows_to_markdown, set_progress_listener
+from lesson_sql import fingerprint_sql
+
+# Upper bounds of the latency histogram buckets in seconds; a last
+# `+Inf` bucket catches the rest.
+DEFAULT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+# Distinct fingerprints tracked; further ones are counted under
+# `OVERFLOW_FINGERPRINT`.
+DEFAULT_MAX_STATEMENTS = 1000
+
+OVERFLOW_FINGERPRINT = "(other statements)"
+
+# Fingerprints remembered, keyed by statement text without literals.
+FINGERPRINT_CACHE_SIZE = 4096
+
+# String and numeric literals, replaced to key the fingerprint cache
+# without running the slower `fingerprint_sql` on every statement.
+_CACHE_KEY_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+
+# Prefix of the exported Prometheus metric names.
+METRIC_PREFIX = "sqlite_statement"
+
+
+class StatementStats:
+    """Aggregated metrics of the statements sharing one fingerprint."""
+
+    __slots__ = ("fingerprint", "count", "total_seconds", "max_seconds", "vm_steps", "bucket_counts")
+
+    def __init__(self, fingerprint: str, buckets: int) -> None:
+        self.fingerprint = fingerprint
+        self.count = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.vm_steps = 0
+        # One count per bucket plus the `+Inf` bucket, not cumulative.
+        self.bucket_counts = [0] * (buckets + 1)
+
+    @property
+    def statement_id(self) -> str:
+        """A short stable identifier of the fingerprint."""
+        return hashlib.sha1(self.fingerprint.encode("utf-8")).hexdigest()[:12]
+
+
+class _Pending:
+    """The statement in progress on one connection."""
+
+    __slots__ = ("fingerprint", "start", "last", "ticks", "row_factory")
+
+    def __init__(self, row_factory: Optional[Callable[[sqlite3.Cursor, tuple], Any]]) -> None:
+        self.fingerprint: Optional[str] = None
+        self.start = 0.0
+        self.last = 0.0
+        self.ticks = 0
+        # The connection's row factory before the tracer attached.
+        self.row_factory = row_factory
+
+
+class SQLTracer:
+    """Collects per-statement metrics from the connections it is
+    attached to.
+
+    Args:
+        buckets: Upper bounds of the latency histogram buckets in
+            seconds, in increasing order.
+        max_statements: Distinct fingerprints to track.
+    """
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS,
+                 max_statements: int = DEFAULT_MAX_STATEMENTS) -> None:
+        if list(buckets) != sorted(buckets):
+            raise ValueError("buckets must be in increasing order")
+        self.buckets = tuple(buckets)
+        self.max_statements = max_statements
+        self._stats: Dict[str, StatementStats] = {}
+        # Entries go away with their connection.
+        self._pending: "weakref.WeakKeyDictionary[sqlite3.Connection, _Pending]" = weakref.WeakKeyDictionary()
+        self._fingerprints: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def __enter__(self) -> "SQLTracer":
+        self.install()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.uninstall()
+        self.flush()
+
+    def install(self) -> None:
+        """Attach to every connection `connect_read_only` opens from now on."""
+        if self.attach not in CONNECTION_HOOKS:
+            CONNECTION_HOOKS.append(self.attach)
+
+    def uninstall(self) -> None:
+        """Stop attaching to new connections."""
+        if self.attach in CONNECTION_HOOKS:
+            CONNECTION_HOOKS.remove(self.attach)
+
+    def _fingerprint(self, sql: str) -> str:
+        key = _CACHE_KEY_LITERALS.sub("?", sql)
+        fingerprint = self._fingerprints.get(key)
+        if fingerprint is None:
+            fingerprint = fingerprint_sql(sql)
+            if len(self._fingerprints) >= FINGERPRINT_CACHE_SIZE:
+                self._fingerprints.clear()
+            self._fingerprints[key] = fingerprint
+        return fingerprint
+
+    def _finish(self, pending: _Pending) -> None:
+        """Record the statement in progress, if any."""
+        fingerprint = pending.fingerprint
+        if fingerprint is None:
+            return
+        pending.fingerprint = None
+        seconds = pending.last - pending.start
+        with self._lock:
+            stats = self._stats.get(fingerprint)
+            if stats is None:
+                if len(self._stats) >= self.max_statements:
+                    fingerprint = OVERFLOW_FINGERPRINT
+                stats = self._stats.get(fingerprint)
+                if stats is None:
+                    stats = self._stats[fingerprint] = StatementStats(fingerprint, len(self.buckets))
+            stats.count += 1
+            stats.total_seconds += seconds
+            stats.max_seconds = max(stats.max_seconds, seconds)
+            stats.vm_steps += pending.ticks * BUDGET_CHECK_INTERVAL
+            stats.bucket_counts[bisect.bisect_left(self.buckets, seconds)] += 1
+
+    def attach(self, conn: sqlite3.Connection) -> sqlite3.Connection:
+        """Start tracing the statements run on a connection.
+
+        The connection's trace callback and progress listener are
+        replaced. Only cursors created afterwards report their rows. The
+        last statement of a connection that is garbage collected without
+        being detached is recorded then.
+
+        Returns:
+            The connection, for chaining.
+
+        Raises:
+            TypeError: If the connection cannot be weakly referenced, see
+                `generate_lessons.LessonConnection`.
+        """
+        # Attaching twice keeps the original row factory.
+        row_factory = getattr(conn.row_factory, "untraced", conn.row_factory)
+        pending = _Pending(row_factory)
+        with self._lock:
+            try:
+                previous = self._pending.get(conn)
+                self._pending[conn] = pending
+            except TypeError:
+                raise TypeError("SQLTracer needs a connection opened with factory=LessonConnection, "
+                                "e.g. by connect_read_only") from None
+        if previous is not None:
+            self._finish(previous)
+        weakref.finalize(conn, self._finish, pending)
+        clock = time.perf_counter
+
+        def trace(sql: str) -> None:
+            # Trigger bodies are reported as `-- TRIGGER name`.
+            if sql.startswith("--"):
+                return
+            self._finish(pending)
+            pending.fingerprint = self._fingerprint(sql)
+            pending.start = pending.last = clock()
+            pending.ticks = 0
+
+        def tick() -> int:
+            pending.ticks += 1
+            pending.last = clock()
+            return 0
+
+        def note_row(cursor: sqlite3.Cursor, row: tuple):
+            pending.last = clock()
+            return row if row_factory is None else row_factory(cursor, row)
+
+        conn.set_trace_callback(trace)
+        set_progress_listener(conn, tick)
+        note_row.untraced = row_factory
+        conn.row_factory = note_row
+        return conn
+
+    def detach(self, conn: sqlite3.Connection) -> None:
+        """Stop tracing a connection and record its last statement."""
+        conn.set_trace_callback(None)
+        set_progress_listener(conn, None)
+        with self._lock:
+            pending = self._pending.pop(conn, None)
+        if pending is not None:
+            conn.row_factory = pending.row_factory
+            self._finish(pending)
+
+    def flush(self) -> None:
+        """Record the statements still in progress on every connection."""
+        with self._lock:
+            pending = list(self._pending.values())
+        for state in pending:
+            self._finish(state)
+
+    def statements(self) -> List[StatementStats]:
+        """Return the metrics per fingerprint, slowest in total first."""
+        with self._lock:
+            return sorted(self._stats.values(), key=lambda stats: -stats.total_seconds)
+
+    def to_json(self) -> Dict:
+        """Return the metrics as a JSON-serializable dictionary."""
+        return {
+            "buckets_seconds": list(self.buckets),
+            "vm_step_interval": BUDGET_CHECK_INTERVAL,
+            "statements": [{
+                "id": stats.statement_id,
+                "fingerprint": stats.fingerprint,
+                "count": stats.count,
+                "total_ms": stats.total_seconds * 1000,
+                "mean_ms": stats.total_seconds * 1000 / stats.count,
+                "max_ms": stats.max_seconds * 1000,
+                "vm_steps": stats.vm_steps,
+                "bucket_counts": stats.bucket_counts,
+            } for stats in self.statements()],
+        }
+
+    def to_prometheus(self) -> str:
+        """Return the metrics in the Prometheus text exposition format.
+
+        Each fingerprint is labelled by its `id`; an info metric maps the
+        ids to the SQL so the other series stay short.
+        """
+        statements = self.statements()
+        lines = [
+            f"# HELP {METRIC_PREFIX}_info Fingerprint of each traced statement.",
+            f"# TYPE {METRIC_PREFIX}_info gauge",
+        ]
+        for stats in statements:
+            lines.append(f'{METRIC_PREFIX}_info{{id="{stats.statement_id}",'
+                         f'sql="{_escape_label(stats.fingerprint)}"}} 1')
+        lines += [
+            f"# HELP {METRIC_PREFIX}_duration_seconds Latency of the statements, up to their last progress "
+            f"tick or row; work after it, up to {BUDGET_CHECK_INTERVAL} VM steps, is not counted.",
+            f"# TYPE {METRIC_PREFIX}_duration_seconds histogram",
+        ]
+        bounds = [_format_value(bound) for bound in self.buckets] + ["+Inf"]
+        for stats in statements:
+            label = f'id="{stats.statement_id}"'
+            cumulative = 0
+            for bound, count in zip(bounds, stats.bucket_counts):
+                cumulative += count
+                lines.append(f'{METRIC_PREFIX}_duration_seconds_bucket{{{label},le="{bound}"}} {cumulative}')
+            lines.append(f"{METRIC_PREFIX}_duration_seconds_sum{{{label}}} {_format_value(stats.total_seconds)}")
+            lines.append(f"{METRIC_PREFIX}_duration_seconds_count{{{label}}} {stats.count}")
+        lines += [
+            f"# HELP {METRIC_PREFIX}_max_duration_seconds Slowest execution of the statements.",
+            f"# TYPE {METRIC_PREFIX}_max_duration_seconds gauge",
+        ]
+        lines += [f'{METRIC_PREFIX}_max_duration_seconds{{id="{stats.statement_id}"}} '
+                  f'{_format_value(stats.max_seconds)}' for stats in statements]
+        lines += [
+            f"# HELP {METRIC_PREFIX}_vm_steps_total Approximate SQLite VM steps, counted at a resolution "
+            f"of {BUDGET_CHECK_INTERVAL} steps.",
+            f"# TYPE {METRIC_PREFIX}_vm_steps_total counter",
+        ]
+        lines += [f'{METRIC_PREFIX}_vm_steps_total{{id="{stats.statement_id}"}} {stats.vm_steps}'
+                  for stats in statements]
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: str, fmt: Optional[str] = None) -> None:
+        """Write the metrics to a file, replacing it atomically.
+
+        Args:
+            path: Destination file.
+            fmt: `json` or `prometheus`; by default `json` for a
+                `.json` file and `prometheus` otherwise.
+
+        Raises:
+            ValueError: If the format is unknown.
+        """
+        self.flush()
+        if fmt is None:
+            fmt = "json" if path.endswith(".json") else "prometheus"
+        if fmt == "json":
+            text = json.dumps(self.to_json(), indent=2) + "\n"
+        elif fmt == "prometheus":
+            text = self.to_prometheus()
+        else:
+            raise ValueError(f"Unknown trace format: {fmt}")
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+
+
+def _escape_label(value: str) -> str:
+    """Escape a Prometheus label value."""
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value))
+
+
+def format_report(trace: Dict, top: Optional[int] = None) -> str:
+    """Render a JSON export of a `SQLTracer` as a Markdown table."""
+    statements = trace["statements"][:top]
+    rows = [(stats["id"], stats["count"], round(stats["total_ms"], 3), round(stats["mean_ms"], 3),
+             round(stats["max_ms"], 3), stats["vm_steps"], stats["fingerprint"])
+            for stats in statements]
+    return rows_to_markdown(["Id", "Count", "Total ms", "Mean ms", "Max ms", "VM steps", "Statement"], rows)
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="List the slowest statements of a SQL trace.")
+    parser.add_argument("trace", help="JSON file written by SQLTracer.write or generate_lessons.py --trace")
+    parser.add_argument("--top", type=int, help="number of statements to list")
+    args = parser.parse_args(argv)
+
+    with open(args.trace, encoding="utf-8") as f:
+        trace = json.load(f)
+    print(format_report(trace, args.top))
+
+
+if __name__ == '__main__':
+    main()
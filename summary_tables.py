@@ -0,0 +1,306 @@
+"""
+This script precomputes sales summaries so that dashboard-style
+queries do not re-aggregate `invoice_items` on every run.
+
+Four summary tables are built from `invoice_items`, the fact table:
+sales per artist (through `tracks` and `albums`), per genre (through
+`tracks`), per customer and per billing country (through `invoices`).
+Each row holds the revenue in integer cents, the quantity sold and the
+number of invoice lines, so incremental updates add up to exactly what
+a full rebuild produces.
+
+The summaries can be kept current in two ways:
+
+* `--triggers` installs triggers on `invoice_items` that apply every
+  inserted, deleted or updated line to the summaries as it is written.
+  Changes to the dimension tables (e.g. moving an album to another
+  artist) are not tracked and need a rebuild;
+* `SummaryRefresher` rebuilds the summaries from a long-running
+  process whenever `PRAGMA data_version` shows that another connection
+  has committed to the database.
+
+`dashboard_query` returns the SQL for a dashboard, reading the
+summaries when they exist and falling back to aggregating the base
+tables otherwise, e.g. the notebook's top 10 artists by total sales.
+Groups whose lines have all been deleted keep a row with zero lines;
+the dashboard queries skip them.
+
+The summary tables are written into the database itself, because
+triggers cannot update tables in another database file. Run this
+script from the root of the project directory on a copy you are happy
+to modify, such as a scaled benchmark database:
+
+    python summary_tables.py --db bench_data/chinook_x100.db --triggers --compare
+"""
+
+import argparse
+import sqlite3
+import sys
+import time
+from typing import Dict, List, NamedTuple, Optional
+
+from generate_lessons import DEFAULT_DB_PATH, require_database, rows_to_markdown
+
+
+class Summary(NamedTuple):
+    """How one summary table is keyed and joined to the fact table."""
+
+    key_column: str
+    key_type: str
+    key_expr: str
+    joins: str
+
+
+SUMMARIES: Dict[str, Summary] = {
+    "summary_sales_by_artist": Summary(
+        "ArtistId", "INTEGER", "al.ArtistId",
+        "JOIN tracks t ON t.TrackId = ii.TrackId JOIN albums al ON al.AlbumId = t.AlbumId"),
+    "summary_sales_by_genre": Summary(
+        "GenreId", "INTEGER", "t.GenreId",
+        "JOIN tracks t ON t.TrackId = ii.TrackId"),
+    "summary_sales_by_customer": Summary(
+        "CustomerId", "INTEGER", "i.CustomerId",
+        "JOIN invoices i ON i.InvoiceId = ii.InvoiceId"),
+    "summary_sales_by_country": Summary(
+        "BillingCountry", "TEXT", "i.BillingCountry",
+        "JOIN invoices i ON i.InvoiceId = ii.InvoiceId"),
+}
+
+_CENTS = "CAST(ROUND({row}.UnitPrice * {row}.Quantity * 100) AS INTEGER)"
+
+# The base queries sort by revenue in the same integer cents as the
+# summaries, so that ties break the same way on both.
+_REVENUE_CENTS = f"SUM({_CENTS.format(row='ii')})"
+
+# Dashboard name -> (query over the summaries, equivalent query over the
+# base tables).
+DASHBOARDS: Dict[str, tuple] = {
+    "top_artists": (
+        """SELECT a.Name AS Artist, ROUND(s.RevenueCents / 100.0, 2) AS TotalSales
+FROM summary_sales_by_artist s JOIN artists a ON a.ArtistId = s.ArtistId
+WHERE s.Lines > 0 ORDER BY s.RevenueCents DESC, a.Name LIMIT 10;""",
+        f"""SELECT a.Name AS Artist, ROUND(SUM(ii.UnitPrice * ii.Quantity), 2) AS TotalSales
+FROM invoice_items ii
+JOIN tracks t ON ii.TrackId = t.TrackId
+JOIN albums al ON t.AlbumId = al.AlbumId
+JOIN artists a ON al.ArtistId = a.ArtistId
+GROUP BY a.ArtistId ORDER BY {_REVENUE_CENTS} DESC, a.Name LIMIT 10;"""),
+    "sales_by_genre": (
+        """SELECT g.Name AS Genre, ROUND(s.RevenueCents / 100.0, 2) AS TotalSales, s.Quantity
+FROM summary_sales_by_genre s JOIN genres g ON g.GenreId = s.GenreId
+WHERE s.Lines > 0 ORDER BY s.RevenueCents DESC, g.Name;""",
+        f"""SELECT g.Name AS Genre, ROUND(SUM(ii.UnitPrice * ii.Quantity), 2) AS TotalSales,
+SUM(ii.Quantity) AS Quantity
+FROM invoice_items ii JOIN tracks t ON t.TrackId = ii.TrackId JOIN genres g ON g.GenreId = t.GenreId
+GROUP BY g.GenreId ORDER BY {_REVENUE_CENTS} DESC, g.Name;"""),
+    "top_customers": (
+        """SELECT c.FirstName || ' ' || c.LastName AS Customer, ROUND(s.RevenueCents / 100.0, 2) AS TotalSales
+FROM summary_sales_by_customer s JOIN customers c ON c.CustomerId = s.CustomerId
+WHERE s.Lines > 0 ORDER BY s.RevenueCents DESC, s.CustomerId LIMIT 10;""",
+        f"""SELECT c.FirstName || ' ' || c.LastName AS Customer,
+ROUND(SUM(ii.UnitPrice * ii.Quantity), 2) AS TotalSales
+FROM invoice_items ii JOIN invoices i ON i.InvoiceId = ii.InvoiceId
+JOIN customers c ON c.CustomerId = i.CustomerId
+GROUP BY c.CustomerId ORDER BY {_REVENUE_CENTS} DESC, c.CustomerId LIMIT 10;"""),
+    "sales_by_country": (
+        """SELECT BillingCountry AS Country, ROUND(RevenueCents / 100.0, 2) AS TotalSales
+FROM summary_sales_by_country WHERE Lines > 0 ORDER BY RevenueCents DESC, BillingCountry;""",
+        f"""SELECT i.BillingCountry AS Country, ROUND(SUM(ii.UnitPrice * ii.Quantity), 2) AS TotalSales
+FROM invoice_items ii JOIN invoices i ON i.InvoiceId = ii.InvoiceId
+WHERE i.BillingCountry IS NOT NULL
+GROUP BY i.BillingCountry ORDER BY {_REVENUE_CENTS} DESC, i.BillingCountry;"""),
+}
+
+
+def aggregate_sql(name: str) -> str:
+    """Return the query that aggregates a summary from the fact table."""
+    summary = SUMMARIES[name]
+    return (f"SELECT {summary.key_expr}, SUM({_CENTS.format(row='ii')}), SUM(ii.Quantity), COUNT(*) "
+            f"FROM invoice_items ii {summary.joins} WHERE {summary.key_expr} IS NOT NULL "
+            f"GROUP BY {summary.key_expr}")
+
+
+def _apply_sql(name: str, row: str, sign: str) -> str:
+    """Return the upsert that adds (`+`) or removes (`-`) the invoice
+    line `row` (`NEW` or `OLD`) to or from a summary.
+    """
+    summary = SUMMARIES[name]
+    key = summary.key_column
+    line = (f"(SELECT {row}.InvoiceId AS InvoiceId, {row}.TrackId AS TrackId, "
+            f"{row}.UnitPrice AS UnitPrice, {row}.Quantity AS Quantity) ii")
+    return (f"INSERT INTO {name} ({key}, RevenueCents, Quantity, Lines) "
+            f"SELECT {summary.key_expr}, {sign}{_CENTS.format(row='ii')}, {sign}ii.Quantity, {sign}1 "
+            f"FROM {line} {summary.joins} WHERE {summary.key_expr} IS NOT NULL "
+            f"ON CONFLICT({key}) DO UPDATE SET RevenueCents = RevenueCents + excluded.RevenueCents, "
+            f"Quantity = Quantity + excluded.Quantity, Lines = Lines + excluded.Lines;")
+
+
+def drop_summaries(conn: sqlite3.Connection) -> None:
+    """Remove the summary tables and their triggers, if present."""
+    with conn:
+        for event in ("insert", "delete", "update"):
+            conn.execute(f"DROP TRIGGER IF EXISTS summary_invoice_items_{event}")
+        for name in SUMMARIES:
+            conn.execute(f"DROP TABLE IF EXISTS {name}")
+
+
+def build_summaries(conn: sqlite3.Connection) -> None:
+    """Create the summary tables, or rebuild them from the fact table if
+    they exist, in one transaction.
+    """
+    with conn:
+        for name, summary in SUMMARIES.items():
+            conn.execute(f"CREATE TABLE IF NOT EXISTS {name} ("
+                         f"{summary.key_column} {summary.key_type} PRIMARY KEY, "
+                         "RevenueCents INTEGER NOT NULL, Quantity INTEGER NOT NULL, "
+                         "Lines INTEGER NOT NULL)")
+            conn.execute(f"DELETE FROM {name}")
+            conn.execute(f"INSERT INTO {name} {aggregate_sql(name)}")
+
+
+def install_triggers(conn: sqlite3.Connection) -> None:
+    """Keep the summaries current as `invoice_items` changes."""
+    bodies = {
+        "insert": [_apply_sql(name, "NEW", "+") for name in SUMMARIES],
+        "delete": [_apply_sql(name, "OLD", "-") for name in SUMMARIES],
+        "update": [_apply_sql(name, row, sign) for name in SUMMARIES
+                   for row, sign in (("OLD", "-"), ("NEW", "+"))],
+    }
+    with conn:
+        for event, statements in bodies.items():
+            trigger = f"summary_invoice_items_{event}"
+            conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+            conn.execute(f"CREATE TRIGGER {trigger} AFTER {event.upper()} ON invoice_items BEGIN\n"
+                         + "\n".join(statements) + "\nEND")
+
+
+def summaries_installed(conn: sqlite3.Connection) -> bool:
+    """Return whether every summary table exists."""
+    names = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    return all(name in names for name in SUMMARIES)
+
+
+def dashboard_query(conn: sqlite3.Connection, name: str) -> str:
+    """Return the SQL for a dashboard, reading the summary tables when
+    they exist and the base tables otherwise.
+    """
+    summary_sql, base_sql = DASHBOARDS[name]
+    return summary_sql if summaries_installed(conn) else base_sql
+
+
+def check_summaries(conn: sqlite3.Connection) -> List[str]:
+    """Return the names of the summaries that differ from a fresh
+    aggregation of the fact table.
+    """
+    stale = []
+    for name, summary in SUMMARIES.items():
+        stored = conn.execute(f"SELECT {summary.key_column}, RevenueCents, Quantity, Lines "
+                              f"FROM {name} WHERE Lines != 0 ORDER BY 1").fetchall()
+        fresh = conn.execute(aggregate_sql(name) + " ORDER BY 1").fetchall()
+        if stored != fresh:
+            stale.append(name)
+    return stale
+
+
+class SummaryRefresher:
+    """Rebuild the summaries when another connection has committed.
+
+    `PRAGMA data_version` on a connection changes whenever a different
+    connection commits to the database, so a long-running process can
+    call `refresh_if_changed` periodically, e.g. before serving a
+    dashboard, and only pay for a rebuild after the data changed. This
+    is the alternative to `install_triggers` when the writers cannot be
+    given triggers.
+
+    Args:
+        conn: Writable connection used to rebuild the summaries.
+    """
+
+    def __init__(self, conn: sqlite3.Connection) -> None:
+        self.conn = conn
+        self.refreshes = 0
+        self._version: Optional[int] = None
+
+    def refresh_if_changed(self) -> bool:
+        """Rebuild the summaries if the data changed since the last call.
+
+        Returns:
+            True if the summaries were rebuilt.
+        """
+        version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+        if version == self._version and summaries_installed(self.conn):
+            return False
+        build_summaries(self.conn)
+        # Our own rebuild does not change what this connection reports.
+        self._version = version
+        self.refreshes += 1
+        return True
+
+
+def _best_time(conn: sqlite3.Connection, query: str, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        conn.execute(query).fetchall()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def compare_dashboards(conn: sqlite3.Connection, repeat: int = 5) -> str:
+    """Time every dashboard on the base tables and on the summaries and
+    check that both return the same rows.
+    """
+    rows = []
+    for name, (summary_sql, base_sql) in DASHBOARDS.items():
+        base_ms = _best_time(conn, base_sql, repeat)
+        summary_ms = _best_time(conn, summary_sql, repeat)
+        same = conn.execute(base_sql).fetchall() == conn.execute(summary_sql).fetchall()
+        rows.append((name, round(base_ms, 3), round(summary_ms, 3),
+                     f"{base_ms / max(summary_ms, 1e-9):.1f}x", "yes" if same else "no"))
+    return rows_to_markdown(["Dashboard", "Base tables ms", "Summaries ms", "Speedup", "Same rows"], rows)
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Build sales summary tables for dashboard queries.")
+    parser.add_argument("--db", default=DEFAULT_DB_PATH,
+                        help="path to the SQLite database to add the summaries to")
+    parser.add_argument("--triggers", action="store_true",
+                        help="install triggers that keep the summaries current")
+    parser.add_argument("--drop", action="store_true",
+                        help="remove the summary tables and triggers instead")
+    parser.add_argument("--check", action="store_true",
+                        help="exit with status 1 if a summary differs from the fact table")
+    parser.add_argument("--compare", action="store_true",
+                        help="time the dashboards on the base tables and on the summaries")
+    args = parser.parse_args(argv)
+    require_database(args.db)
+
+    conn = sqlite3.connect(args.db)
+    try:
+        if args.drop:
+            drop_summaries(conn)
+            print(f"Dropped the summary tables from {args.db}.")
+            return
+        if args.check:
+            if not summaries_installed(conn):
+                sys.exit(f"error: no summary tables in {args.db}; build them first")
+            stale = check_summaries(conn)
+            if stale:
+                sys.exit(f"Out of date: {', '.join(stale)}")
+            print("All summaries match the fact table.")
+            return
+        start = time.perf_counter()
+        build_summaries(conn)
+        if args.triggers:
+            install_triggers(conn)
+        print(f"Built {len(SUMMARIES)} summary table(s) in {(time.perf_counter() - start) * 1000:.1f} ms"
+              + (" and installed triggers." if args.triggers else "."))
+        if args.compare:
+            print()
+            print(compare_dashboards(conn))
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
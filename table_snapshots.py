@@ -0,0 +1,369 @@
+"""
+Columnar snapshots of the database tables for pandas workloads.
+
+`pd.read_sql_query` decodes every row through SQLite and Python objects
+each time a table is loaded. A `SnapshotStore` exports each table once
+to one `.npy` file per column under `snapshots/<database name>-<hash of
+its resolved path>/` and afterwards loads it with
+`numpy.load(..., mmap_mode="r")`. The kind of each column is found
+first by counting the types of its values in SQLite, and the rows are
+then fetched `EXPORT_BATCH` at a time into preallocated arrays:
+
+* integer and real columns are stored as `int64` or `float64` (integer
+  columns with NULLs become `float64` with NaN, as in
+  `pd.read_sql_query`) and are memory-mapped without a copy, so a
+  column only takes memory once its pages are read;
+* text columns are dictionary-encoded: the `int32` codes are
+  memory-mapped and only the distinct values are read, and they load as
+  pandas categoricals, or as plain strings with `strings="object"`;
+* anything else (BLOBs, mixed types) is stored as a type code and the
+  bytes of each value, without pickle, and decoded into an object array
+  in memory.
+
+A snapshot records the resolved path of the database and the size and
+modification time of the file and of its write-ahead log, and a store
+additionally watches `PRAGMA data_version` on a private connection, so
+a commit from any process makes the next load export the table again.
+
+Example, e.g. in a notebook:
+
+    from table_snapshots import load_tables
+
+    tables = load_tables("chinook.db", ["invoice_items", "tracks"])
+
+Run this script from the root of the project directory to export every
+table up front:
+
+    python table_snapshots.py --db chinook.db
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import time
+from typing import TYPE_CHECKING, Any, Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+
+from generate_lessons import DEFAULT_DB_PATH, connect_read_only, require_database
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# Directory holding one snapshot directory per database.
+DEFAULT_SNAPSHOT_DIR = "snapshots"
+
+# Bump when the layout of a snapshot changes.
+SNAPSHOT_VERSION = 2
+
+# Rows fetched from SQLite at a time while exporting a table.
+EXPORT_BATCH = 10000
+
+# Type codes of the values of `object` columns.
+_NULL, _INTEGER, _REAL, _TEXT, _BLOB = range(5)
+
+# Name of the metadata file in every table snapshot.
+META_NAME = "meta.json"
+
+
+def file_identity(db_path: str) -> List[List[int]]:
+    """Return the size and modification time of a database file and of
+    its write-ahead log, if any.
+    """
+    identity = []
+    for path in (db_path, db_path + "-wal"):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            identity.append([])
+            continue
+        identity.append([stat.st_size, stat.st_mtime_ns])
+    return identity
+
+
+def _column_kind(rows: int, integers: int, reals: int, texts: int, nulls: int) -> str:
+    """Return the storage kind of a column from the types of its values."""
+    if integers and integers + nulls == rows:
+        return "real" if nulls else "integer"
+    if integers + reals and integers + reals + nulls == rows:
+        return "real"
+    if texts + nulls == rows:
+        return "text"
+    return "object"
+
+
+class _ColumnWriter:
+    """Fills the arrays of one column of a snapshot, batch by batch."""
+
+    def __init__(self, kind: str, rows: int) -> None:
+        self.kind = kind
+        if kind == "integer":
+            self.values = np.empty(rows, dtype=np.int64)
+        elif kind == "real":
+            self.values = np.empty(rows, dtype=np.float64)
+        elif kind == "text":
+            self.codes = np.empty(rows, dtype=np.int32)
+            self.dictionary: Dict[str, int] = {}
+        else:
+            self.types = np.empty(rows, dtype=np.int8)
+            self.offsets = np.zeros(rows + 1, dtype=np.int64)
+            self.data = bytearray()
+
+    def add(self, start: int, values: Sequence[Any]) -> None:
+        """Store the values of rows `start` onwards."""
+        end = start + len(values)
+        if self.kind == "integer":
+            self.values[start:end] = values
+        elif self.kind == "real":
+            self.values[start:end] = [np.nan if value is None else value for value in values]
+        elif self.kind == "text":
+            dictionary = self.dictionary
+            self.codes[start:end] = [-1 if value is None else dictionary.setdefault(value, len(dictionary))
+                                     for value in values]
+        else:
+            for index, value in enumerate(values, start):
+                if value is None:
+                    self.types[index] = _NULL
+                elif isinstance(value, int):
+                    self.types[index] = _INTEGER
+                    self.data += str(value).encode("ascii")
+                elif isinstance(value, float):
+                    self.types[index] = _REAL
+                    self.data += repr(value).encode("ascii")
+                elif isinstance(value, str):
+                    self.types[index] = _TEXT
+                    self.data += value.encode("utf-8")
+                else:
+                    self.types[index] = _BLOB
+                    self.data += value
+                self.offsets[index + 1] = len(self.data)
+
+    def arrays(self) -> Dict[str, np.ndarray]:
+        """Return the arrays to save, keyed by file part."""
+        if self.kind in ("integer", "real"):
+            return {"values": self.values}
+        if self.kind == "text":
+            return {"codes": self.codes, "dictionary": np.array(list(self.dictionary), dtype=np.str_)}
+        return {"types": self.types, "offsets": self.offsets,
+                "data": np.frombuffer(bytes(self.data), dtype=np.uint8)}
+
+
+def _decode_objects(types: np.ndarray, offsets: np.ndarray, data: np.ndarray) -> np.ndarray:
+    """Rebuild the values of an `object` column."""
+    raw = data.tobytes()
+    bounds = offsets.tolist()
+    values = np.empty(len(types), dtype=object)
+    for index, code in enumerate(types.tolist()):
+        value = raw[bounds[index]:bounds[index + 1]]
+        if code == _NULL:
+            values[index] = None
+        elif code == _INTEGER:
+            values[index] = int(value)
+        elif code == _REAL:
+            values[index] = float(value)
+        elif code == _TEXT:
+            values[index] = value.decode("utf-8")
+        else:
+            values[index] = value
+    return values
+
+
+class SnapshotStore:
+    """Exports tables of one database to columnar snapshots and loads
+    them back as DataFrames.
+
+    Args:
+        db_path: Path to the SQLite database.
+        snapshot_dir: Directory holding the snapshots of all databases.
+    """
+
+    def __init__(self, db_path: str, snapshot_dir: str = DEFAULT_SNAPSHOT_DIR) -> None:
+        self.db_path = db_path
+        self.source = os.path.realpath(db_path)
+        name = os.path.splitext(os.path.basename(db_path))[0]
+        key = hashlib.sha1(self.source.encode("utf-8")).hexdigest()[:12]
+        self.directory = os.path.join(snapshot_dir, f"{name}-{key}")
+        self.exports = 0
+        self._conn: Optional[sqlite3.Connection] = None
+        self._versions: Dict[str, int] = {}
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = connect_read_only(self.db_path, tuned=False)
+        return self._conn
+
+    def _data_version(self) -> int:
+        return self._connection().execute("PRAGMA data_version").fetchone()[0]
+
+    def tables(self) -> List[str]:
+        """Return the names of the user tables in the database."""
+        return [row[0] for row in self._connection().execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' "
+            "ORDER BY name")]
+
+    def _table_dir(self, table: str) -> str:
+        return os.path.join(self.directory, table.lower())
+
+    def _meta(self, table: str) -> Optional[Dict]:
+        try:
+            with open(os.path.join(self._table_dir(table), META_NAME), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def is_fresh(self, table: str) -> bool:
+        """Return whether the snapshot of a table matches the database."""
+        meta = self._meta(table)
+        if meta is None or meta.get("version") != SNAPSHOT_VERSION or meta.get("source") != self.source:
+            return False
+        if meta.get("identity") != file_identity(self.db_path):
+            return False
+        # Catches commits within the file system's timestamp resolution.
+        exported = self._versions.get(table.lower())
+        return exported is None or exported == self._data_version()
+
+    def export(self, table: str) -> None:
+        """Write the snapshot of a table, replacing any previous one."""
+        conn = self._connection()
+        target = self._table_dir(table)
+        tmp_dir = target + ".tmp"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        # One read transaction, so that the type counts and the rows
+        # describe the same version of the table.
+        conn.execute("BEGIN")
+        try:
+            version = self._data_version()
+            identity = file_identity(self.db_path)
+            cursor = conn.execute(f'SELECT * FROM "{table}" LIMIT 0')
+            names = [desc[0] for desc in cursor.description]
+            counts = ", ".join(
+                f"SUM(typeof({column}) = '{kind}')"
+                for column in ('"' + name.replace('"', '""') + '"' for name in names)
+                for kind in ("integer", "real", "text", "null"))
+            summary = conn.execute(f'SELECT COUNT(*), {counts} FROM "{table}"').fetchone()
+            rows = summary[0]
+            writers = []
+            for index in range(len(names)):
+                # SUM is NULL on an empty table.
+                types = [count or 0 for count in summary[1 + 4 * index:5 + 4 * index]]
+                writers.append(_ColumnWriter(_column_kind(rows, *types), rows))
+            cursor = conn.execute(f'SELECT * FROM "{table}"')
+            start = 0
+            while True:
+                batch = cursor.fetchmany(EXPORT_BATCH)
+                if not batch:
+                    break
+                for writer, values in zip(writers, zip(*batch)):
+                    writer.add(start, values)
+                start += len(batch)
+        finally:
+            conn.execute("COMMIT")
+
+        meta = {"version": SNAPSHOT_VERSION, "source": self.source, "table": table, "identity": identity,
+                "rows": rows, "columns": []}
+        for index, (name, writer) in enumerate(zip(names, writers)):
+            for part, array in writer.arrays().items():
+                np.save(os.path.join(tmp_dir, f"{index}.{part}.npy"), array, allow_pickle=False)
+            meta["columns"].append({"name": name, "kind": writer.kind})
+        with open(os.path.join(tmp_dir, META_NAME), "w", encoding="utf-8") as f:
+            json.dump(meta, f, indent=2)
+        shutil.rmtree(target, ignore_errors=True)
+        os.replace(tmp_dir, target)
+        self._versions[table.lower()] = version
+        self.exports += 1
+
+    def load(self, table: str, strings: str = "category") -> "pd.DataFrame":
+        """Return a table as a DataFrame, exporting it first if its
+        snapshot is missing or out of date.
+
+        Args:
+            table: Name of the table.
+            strings: `category` to load text columns as categoricals over
+                the memory-mapped codes, or `object` to load them as
+                strings like `pd.read_sql_query` does.
+
+        Returns:
+            A DataFrame whose numeric columns are read-only views of the
+            memory-mapped snapshot.
+        """
+        import pandas as pd
+
+        if strings not in ("category", "object"):
+            raise ValueError(f"strings must be 'category' or 'object', not {strings!r}")
+        if not self.is_fresh(table):
+            self.export(table)
+        directory = self._table_dir(table)
+        meta = self._meta(table)
+        data = {}
+        for index, column in enumerate(meta["columns"]):
+            path = os.path.join(directory, f"{index}.%s.npy")
+            if column["kind"] in ("integer", "real"):
+                data[column["name"]] = np.load(path % "values", mmap_mode="r")
+            elif column["kind"] == "text":
+                codes = np.load(path % "codes", mmap_mode="r")
+                dictionary = np.load(path % "dictionary").astype(object)
+                categorical = pd.Categorical.from_codes(codes, categories=pd.Index(dictionary, dtype=object))
+                data[column["name"]] = categorical if strings == "category" else np.asarray(categorical)
+            else:
+                data[column["name"]] = _decode_objects(np.load(path % "types"), np.load(path % "offsets"),
+                                                       np.load(path % "data"))
+        return pd.DataFrame(data, copy=False)
+
+    def close(self) -> None:
+        """Close the connection used for exports and change detection."""
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+def load_tables(db_path: str, tables: Optional[Iterable[str]] = None, strings: str = "category",
+                snapshot_dir: str = DEFAULT_SNAPSHOT_DIR) -> Dict[str, "pd.DataFrame"]:
+    """Load tables from their snapshots, exporting stale ones first.
+
+    Args:
+        db_path: Path to the SQLite database.
+        tables: Names of the tables to load; every table by default.
+        strings: How to load text columns, see `SnapshotStore.load`.
+        snapshot_dir: Directory holding the snapshots.
+
+    Returns:
+        The DataFrames keyed by lower-cased table name.
+    """
+    store = SnapshotStore(db_path, snapshot_dir)
+    try:
+        names = store.tables() if tables is None else list(tables)
+        return {name.lower(): store.load(name, strings) for name in names}
+    finally:
+        store.close()
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Export the database tables to columnar snapshots.")
+    parser.add_argument("--db", default=DEFAULT_DB_PATH,
+                        help="path to the SQLite database")
+    parser.add_argument("--snapshot-dir", default=DEFAULT_SNAPSHOT_DIR,
+                        help="directory holding the snapshots")
+    parser.add_argument("--force", action="store_true",
+                        help="export every table even if its snapshot is up to date")
+    args = parser.parse_args(argv)
+    require_database(args.db)
+
+    store = SnapshotStore(args.db, args.snapshot_dir)
+    try:
+        for table in store.tables():
+            if not args.force and store.is_fresh(table):
+                print(f"{table}: up to date")
+                continue
+            start = time.perf_counter()
+            store.export(table)
+            print(f"{table}: exported in {(time.perf_counter() - start) * 1000:.1f} ms")
+    finally:
+        store.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,229 @@
+"""
+This script checks the executed lesson queries for regressions against
+a stored golden file.
+
+A lesson whose query breaks only loses its sample table in the
+generated Markdown, which is easy to miss. Here the complete, ordered
+result of every executed lesson is hashed row by row as it is streamed
+from the cursor (see `generate_lessons.stream_script`), so no result is
+ever held in memory, and the column names, row count and SHA-256 digest
+are compared with the golden file. A lesson whose result changed, that
+now fails or stops failing, or that appeared or disappeared counts as
+drift, and the script exits with status 1. The time each query takes is
+reported next to the golden timing, but timings never count as drift.
+
+Queries without an `ORDER BY` return rows in whatever order the query
+plan produces, so a new index can show up as drift too; that is
+intended, since the lesson output would change as well.
+
+Every query runs under the generator's time budget (see
+`generate_lessons.QueryBudget`), so a runaway query is reported as a
+failure instead of blocking the check.
+
+Run this script from the root of the project directory. Record the
+golden file once, then verify on every commit:
+
+    python verify_lessons.py --db bench_data/chinook_x100.db --update
+    python verify_lessons.py --db bench_data/chinook_x100.db
+
+By default the golden file of a database is `golden/<database name>.json`.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import time
+from typing import Dict, List, NamedTuple, Optional
+
+from generate_lessons import (
+    DEFAULT_DB_PATH, DEFAULT_TIMEOUT, BudgetExceeded, QueryBudget, connect_read_only, get_lessons,
+    guard_query, require_database, rows_to_markdown, stream_script,
+)
+
+# Directory holding the golden files, one per database.
+DEFAULT_GOLDEN_DIR = "golden"
+
+# Rows fetched from the cursor per batch while hashing.
+BATCH_SIZE = 1000
+
+
+class Fingerprint(NamedTuple):
+    """Identity of a lesson's complete result set."""
+
+    columns: List[str]
+    rows: int
+    sha256: Optional[str]
+    elapsed_ms: float
+    error: Optional[str]
+
+
+def fingerprint_query(conn: sqlite3.Connection, query: str,
+                      budget: Optional[QueryBudget] = None) -> Fingerprint:
+    """Hash the complete result of the last query of a script.
+
+    The digest covers the column names and the `repr` of every row in
+    order, one row at a time, so it does not depend on how the rows
+    are batched.
+
+    Args:
+        conn: SQLite connection object.
+        query: SQL query or script, see `generate_lessons.stream_script`.
+        budget: Optional limits the query must stay within.
+
+    Returns:
+        The columns, the row count, the hex digest and the time taken in
+        milliseconds. If the query fails or goes over the budget, the
+        error message is set and the digest is None.
+    """
+    digest = hashlib.sha256()
+    columns: List[str] = []
+    count = 0
+    start = time.perf_counter()
+    try:
+        with guard_query(conn, budget):
+            columns, batches = stream_script(conn, query, BATCH_SIZE)
+            digest.update(repr(columns).encode("utf-8"))
+            for rows in batches:
+                for row in rows:
+                    digest.update(repr(row).encode("utf-8"))
+                    digest.update(b"\n")
+                count += len(rows)
+    except (sqlite3.Error, ValueError, BudgetExceeded) as exc:
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        return Fingerprint(columns, count, None, elapsed_ms, str(exc))
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    return Fingerprint(columns, count, digest.hexdigest(), elapsed_ms, None)
+
+
+def fingerprint_lessons(conn: sqlite3.Connection, lessons: List[Dict[str, str]],
+                        budget: Optional[QueryBudget] = None) -> Dict[str, Fingerprint]:
+    """Fingerprint every executed lesson, keyed by slug in lesson order."""
+    return {
+        lesson["slug"]: fingerprint_query(conn, lesson["query"], budget)
+        for lesson in lessons if lesson.get("run", True)
+    }
+
+
+def default_golden_path(db_path: str) -> str:
+    """Return the golden file used for a database by default."""
+    name = os.path.splitext(os.path.basename(db_path))[0]
+    return os.path.join(DEFAULT_GOLDEN_DIR, f"{name}.json")
+
+
+def save_golden(path: str, fingerprints: Dict[str, Fingerprint]) -> None:
+    """Write fingerprints to a golden file."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({slug: dict(fingerprint._asdict(), elapsed_ms=round(fingerprint.elapsed_ms, 3))
+                   for slug, fingerprint in fingerprints.items()}, f, indent=2)
+        f.write("\n")
+
+
+def load_golden(path: str) -> Dict[str, Fingerprint]:
+    """Read a golden file written by `save_golden`."""
+    with open(path, encoding="utf-8") as f:
+        return {slug: Fingerprint(**entry) for slug, entry in json.load(f).items()}
+
+
+def compare(golden: Dict[str, Fingerprint], current: Dict[str, Fingerprint]) -> List[Dict]:
+    """Compare current fingerprints with the golden ones.
+
+    Returns:
+        One entry per lesson in either set, with its `status` (`ok`,
+        `changed`, `failing`, `fixed`, `new` or `missing`), whether it
+        counts as drift, and the golden and current row counts and
+        timings.
+    """
+    report = []
+    for slug in list(current) + [slug for slug in golden if slug not in current]:
+        before, after = golden.get(slug), current.get(slug)
+        if before is None:
+            status = "new"
+        elif after is None:
+            status = "missing"
+        elif after.error and not before.error:
+            status = "failing"
+        elif before.error and not after.error:
+            status = "fixed"
+        elif (before.columns, before.rows, before.sha256) != (after.columns, after.rows, after.sha256):
+            status = "changed"
+        else:
+            status = "ok"
+        report.append({
+            "slug": slug,
+            "status": status,
+            "drift": status != "ok",
+            "rows_before": before.rows if before else None,
+            "rows_after": after.rows if after else None,
+            "ms_before": before.elapsed_ms if before else None,
+            "ms_after": after.elapsed_ms if after else None,
+            "error": after.error if after else None,
+        })
+    return report
+
+
+def format_report(report: List[Dict]) -> str:
+    """Render a comparison as a Markdown table, drift first."""
+    rows = []
+    for entry in sorted(report, key=lambda entry: not entry["drift"]):
+        before, after = entry["ms_before"], entry["ms_after"]
+        delta = None
+        if before is not None and after is not None and before > 0:
+            delta = f"{(after - before) / before:+.0%}"
+        rows.append((
+            entry["slug"],
+            entry["status"],
+            entry["rows_before"],
+            entry["rows_after"],
+            None if before is None else round(before, 3),
+            None if after is None else round(after, 3),
+            delta,
+            entry["error"] or "",
+        ))
+    return rows_to_markdown(
+        ["Lesson", "Status", "Golden rows", "Rows", "Golden ms", "ms", "Time delta", "Error"], rows)
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Check the lesson query results against a golden file.")
+    parser.add_argument("--db", default=DEFAULT_DB_PATH,
+                        help="path to the Chinook SQLite database")
+    parser.add_argument("--golden",
+                        help="golden file to compare with; defaults to golden/<database name>.json")
+    parser.add_argument("--update", action="store_true",
+                        help="record the current results as the new golden file")
+    parser.add_argument("--timeout", type=float, default=DEFAULT_TIMEOUT,
+                        help="seconds a lesson query may run before it is stopped; 0 for no limit")
+    args = parser.parse_args(argv)
+    require_database(args.db)
+
+    golden_path = args.golden or default_golden_path(args.db)
+    conn = connect_read_only(args.db)
+    try:
+        current = fingerprint_lessons(conn, get_lessons(), QueryBudget(args.timeout or None))
+    finally:
+        conn.close()
+
+    if args.update:
+        save_golden(golden_path, current)
+        print(f"Recorded {len(current)} lesson fingerprint(s) in {golden_path}.")
+        return
+    try:
+        golden = load_golden(golden_path)
+    except FileNotFoundError:
+        sys.exit(f"error: no golden file at {golden_path}; record one with --update")
+
+    report = compare(golden, current)
+    print(format_report(report))
+    drift = [entry["slug"] for entry in report if entry["drift"]]
+    if drift:
+        print(f"\n{len(drift)} lesson(s) drifted from {golden_path}: {', '.join(drift)}", file=sys.stderr)
+        sys.exit(1)
+    print(f"\nAll {len(report)} lesson(s) match {golden_path}.")
+
+
+if __name__ == '__main__':
+    main()